@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""In-process S3 stand-in for benchmarks.
+
+Serves the subset of the S3 REST API that isd_s3 uses over plain HTTP on
+localhost, with objects kept in memory. Requests go through the real
+botocore client, connection pool and s3transfer, so only the network and
+the server are simulated. Each request can be delayed by a fixed latency
+and a per byte transfer time, and made to fail to test retries.
+
+Example usage:
+```
+>>> from benchmarks import fake_s3
+>>> server = fake_s3.FakeS3Server(latency=0.005)
+>>> server.start()
+>>> session = isd_s3.Session(endpoint_url=server.url, default_bucket='bench')
+>>> server.add_fault('UploadPart', after=1)
+>>> server.stop()
+```
+"""
+
+import re
+import time
+import uuid
+import base64
+import hashlib
+import logging
+import datetime
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+class FakeS3Server(object):
+
+    def __init__(self, latency=0.0, bandwidth=None, buckets=('bench',), port=0):
+        """FakeS3Server constructor
+
+        Args:
+            latency (float): Seconds added to every request.
+            bandwidth (float): Bytes per second of request and response
+                               bodies. Default unlimited.
+            buckets (iterable): Buckets that exist.
+            port (int): Port to listen on. Default any free port.
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.buckets = dict((bucket, {}) for bucket in buckets)
+        self.uploads = {}
+        self.requests = {}
+        self.faults = []
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """Endpoint url to give Session."""
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counts(self):
+        """Clears request counts and returns the previous ones."""
+        with self.lock:
+            counts, self.requests = self.requests, {}
+        return counts
+
+    def put(self, bucket, key, body, metadata=None, part_size=None):
+        """Stores an object directly, without a request.
+
+        With part_size, the object looks like a multipart upload with parts
+        of that size.
+        """
+        if part_size is None:
+            _object = _new_object(body, _md5_etag(body), metadata)
+        else:
+            parts = [body[i:i+part_size] for i in range(0, len(body), part_size)]
+            _object = _new_object(body, _multipart_etag([_md5_etag(p) for p in parts]), metadata,
+                    part_sizes=[len(p) for p in parts])
+        with self.lock:
+            self.buckets[bucket][key] = _object
+
+    def add_fault(self, operation, kind='error', times=1, after=0, status=503, code='SlowDown'):
+        """Makes requests of an operation fail.
+
+        Args:
+            operation (str): Operation as counted in requests, e.g. 'UploadPart'.
+            kind (str): 'error' answers with status and code.
+                        'truncate' sends half the body of a GetObject and
+                        closes the connection.
+                        'bad_etag' stores an UploadPart, but answers with a
+                        wrong ETag.
+                        'key_errors' keeps all keys of a DeleteObjects, and
+                        reports each as failed with code.
+            times (int): Number of requests that fail.
+            after (int): Number of requests let through before.
+            status (int): HTTP status of 'error'.
+            code (str): Error code of 'error' and 'key_errors'.
+        """
+        with self.lock:
+            self.faults.append({'operation' : operation, 'kind' : kind, 'times' : times,
+                    'after' : after, 'status' : status, 'code' : code})
+
+    def _count(self, operation):
+        """Counts a request, and returns the fault to inject into it, if any."""
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+            for fault in self.faults:
+                if fault['operation'] != operation or fault['times'] == 0:
+                    continue
+                if fault['after'] > 0:
+                    fault['after'] -= 1
+                    continue
+                fault['times'] -= 1
+                return fault
+        return None
+
+    def _delay(self, nbytes=0):
+        delay = self.latency
+        if self.bandwidth:
+            delay += nbytes / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+# Headers stored with an object besides Content-Type, and returned by GET and HEAD
+CONTENT_HEADERS = ('Content-Encoding', 'Cache-Control', 'Content-Disposition',
+        'Content-Language', 'Expires')
+
+def _new_object(body, etag, metadata=None, content_type='binary/octet-stream', part_sizes=None, headers=None):
+    return {'Body' : body, 'ETag' : etag, 'Metadata' : dict(metadata or {}),
+            'ContentType' : content_type, 'Headers' : dict(headers or {}), 'PartSizes' : part_sizes,
+            'LastModified' : datetime.datetime.now(datetime.timezone.utc)}
+
+def _md5_etag(body):
+    return '"{}"'.format(hashlib.md5(body).hexdigest())
+
+def _multipart_etag(part_etags):
+    digests = b''.join(bytes.fromhex(etag.strip('"')) for etag in part_etags)
+    return '"{}-{}"'.format(hashlib.md5(digests).hexdigest(), len(part_etags))
+
+def _iso(date):
+    return date.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def _http_date(date):
+    return date.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+def _decode_aws_chunked(body):
+    """Returns the payload of an aws-chunked body, dropping trailers."""
+    payload = []
+    pos = 0
+    while True:
+        end = body.index(b'\r\n', pos)
+        size = int(body[pos:end].split(b';')[0], 16)
+        if size == 0:
+            return b''.join(payload)
+        payload.append(body[end+2:end+2+size])
+        pos = end + 2 + size + 2
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def _parse(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        parts = url.path.lstrip('/').split('/', 1)
+        bucket = urllib.parse.unquote(parts[0])
+        key = urllib.parse.unquote(parts[1]) if len(parts) > 1 else ''
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length > 0 else b''
+        if 'aws-chunked' in self.headers.get('Content-Encoding', '') or \
+                self.headers.get('x-amz-content-sha256', '').startswith('STREAMING-'):
+            body = _decode_aws_chunked(body)
+        self._received = length
+        return bucket, key, query, body
+
+    def _send(self, status, body=b'', headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        # One latency per request, transfer time for both directions
+        self.fake._delay(len(body) + getattr(self, '_received', 0))
+        self._received = 0
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.command != 'HEAD' or 'Content-Length' not in (headers or {}):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_xml(self, root, content):
+        self._send(200, '<?xml version="1.0" encoding="UTF-8"?><{0} xmlns="{1}">{2}</{0}>'.format(
+                root, XMLNS, content), {'Content-Type' : 'application/xml'})
+
+    def _error(self, status, code, message=''):
+        if self.command == 'HEAD':
+            self._send(status)
+            return
+        self._send(status, '<?xml version="1.0" encoding="UTF-8"?><Error><Code>{}</Code>'
+                '<Message>{}</Message></Error>'.format(code, escape(message)),
+                {'Content-Type' : 'application/xml'})
+
+    def _start(self, operation):
+        """Counts a request. Returns False if an injected error was sent instead."""
+        self._fault = self.fake._count(operation)
+        if self._fault is not None and self._fault['kind'] == 'error':
+            self._error(self._fault['status'], self._fault['code'], 'Injected fault')
+            return False
+        return True
+
+    def _injected(self, kind):
+        return self._fault is not None and self._fault['kind'] == kind
+
+    def _get_bucket(self, bucket):
+        objects = self.fake.buckets.get(bucket)
+        if objects is None:
+            self._error(404, 'NoSuchBucket', bucket)
+        return objects
+
+    def do_GET(self):
+        bucket, key, query, _ = self._parse()
+        if bucket == '':
+            if not self._start('ListBuckets'):
+                return
+            buckets = ''.join('<Bucket><Name>{}</Name><CreationDate>2020-01-01T00:00:00.000Z'
+                    '</CreationDate></Bucket>'.format(escape(b)) for b in sorted(self.fake.buckets))
+            self._send_xml('ListAllMyBucketsResult',
+                    '<Owner><ID>bench</ID></Owner><Buckets>{}</Buckets>'.format(buckets))
+        elif key == '':
+            self._list_objects(bucket, query)
+        else:
+            self._get_object(bucket, key, query, send_body=True)
+
+    def do_HEAD(self):
+        bucket, key, query, _ = self._parse()
+        self._get_object(bucket, key, query, send_body=False)
+
+    def _list_objects(self, bucket, query):
+        if not self._start('ListObjectsV2'):
+            return
+        objects = self._get_bucket(bucket)
+        if objects is None:
+            return
+        url_encode = query.get('encoding-type') == 'url'
+        quote = (lambda s: urllib.parse.quote(s, safe='/')) if url_encode else (lambda s: s)
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter')
+        max_keys = int(query.get('max-keys', 1000))
+        start = query.get('continuation-token') or query.get('start-after') or ''
+        with self.fake.lock:
+            keys = sorted(k for k in objects if k.startswith(prefix) and k > start)
+        contents = []
+        prefixes = []
+        last = None
+        truncated = False
+        for key in keys:
+            if len(contents) + len(prefixes) >= max_keys:
+                truncated = True
+                break
+            if delimiter:
+                end = key.find(delimiter, len(prefix))
+                if end >= 0:
+                    common_prefix = key[:end + len(delimiter)]
+                    if len(prefixes) == 0 or prefixes[-1] != common_prefix:
+                        prefixes.append(common_prefix)
+                    last = key
+                    continue
+            contents.append(key)
+            last = key
+        parts = ['<Name>{}</Name><Prefix>{}</Prefix><KeyCount>{}</KeyCount><MaxKeys>{}</MaxKeys>'
+                '<IsTruncated>{}</IsTruncated>'.format(escape(bucket), escape(quote(prefix)),
+                len(contents) + len(prefixes), max_keys, 'true' if truncated else 'false')]
+        if url_encode:
+            parts.append('<EncodingType>url</EncodingType>')
+        if truncated:
+            parts.append('<NextContinuationToken>{}</NextContinuationToken>'.format(escape(last)))
+        for key in contents:
+            _object = objects.get(key)
+            if _object is None:
+                continue
+            parts.append('<Contents><Key>{}</Key><LastModified>{}</LastModified><ETag>{}</ETag>'
+                    '<Size>{}</Size><StorageClass>STANDARD</StorageClass></Contents>'.format(
+                    escape(quote(key)), _iso(_object['LastModified']), escape(_object['ETag']),
+                    len(_object['Body'])))
+        for common_prefix in prefixes:
+            parts.append('<CommonPrefixes><Prefix>{}</Prefix></CommonPrefixes>'.format(
+                    escape(quote(common_prefix))))
+        self._send_xml('ListBucketResult', ''.join(parts))
+
+    def _get_object(self, bucket, key, query, send_body):
+        if not self._start('GetObject' if send_body else 'HeadObject'):
+            return
+        objects = self._get_bucket(bucket)
+        if objects is None:
+            return
+        _object = objects.get(key)
+        if _object is None:
+            self._error(404, 'NoSuchKey', key)
+            return
+        body = _object['Body']
+        headers = {'ETag' : _object['ETag'],
+                'Last-Modified' : _http_date(_object['LastModified']),
+                'Content-Type' : _object['ContentType'],
+                'Accept-Ranges' : 'bytes'}
+        headers.update(_object['Headers'])
+        for name, value in _object['Metadata'].items():
+            headers['x-amz-meta-' + name] = value
+        status = 200
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if 'partNumber' in query:
+            # Single part objects only have part 1, the whole object
+            part_sizes = _object['PartSizes'] or [len(body)]
+            part_number = int(query['partNumber'])
+            if part_number > len(part_sizes):
+                self._error(416, 'InvalidPartNumber', query['partNumber'])
+                return
+            first = sum(part_sizes[:part_number-1])
+            last = first + part_sizes[part_number-1] - 1
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, len(body))
+            if _object['PartSizes'] is not None:
+                headers['x-amz-mp-parts-count'] = str(len(part_sizes))
+            body = body[first:last+1]
+            status = 206
+        elif match is not None:
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else len(body) - 1
+            last = min(last, len(body) - 1)
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, len(body))
+            body = body[first:last+1]
+            status = 206
+        if not send_body:
+            headers['Content-Length'] = str(len(body))
+            self._send(status, b'', headers)
+        elif self._injected('truncate'):
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        else:
+            self._send(status, body, headers)
+
+    def do_PUT(self):
+        bucket, key, query, body = self._parse()
+        objects = self._get_bucket(bucket)
+        if objects is None:
+            return
+        copy_source = self.headers.get('x-amz-copy-source')
+        if 'uploadId' in query:
+            upload = self.fake.uploads.get(query['uploadId'])
+            if upload is None:
+                self._error(404, 'NoSuchUpload', query['uploadId'])
+                return
+            if copy_source is not None:
+                if not self._start('UploadPartCopy'):
+                    return
+                source = self._get_copy_source(copy_source)
+                if source is None:
+                    return
+                data = source['Body']
+                match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('x-amz-copy-source-range', ''))
+                if match is not None:
+                    data = data[int(match.group(1)):int(match.group(2))+1]
+                etag = _md5_etag(data)
+                upload['Parts'][int(query['partNumber'])] = (data, etag)
+                self._send_xml('CopyPartResult', '<LastModified>{}</LastModified><ETag>{}</ETag>'.format(
+                        _iso(datetime.datetime.now(datetime.timezone.utc)), escape(etag)))
+            else:
+                if not self._start('UploadPart'):
+                    return
+                if not self._check_md5(body):
+                    return
+                etag = _md5_etag(body)
+                upload['Parts'][int(query['partNumber'])] = (body, etag)
+                if self._injected('bad_etag'):
+                    etag = '"{}"'.format('0' * 32)
+                self._send(200, b'', {'ETag' : etag})
+        elif copy_source is not None:
+            if not self._start('CopyObject'):
+                return
+            source = self._get_copy_source(copy_source)
+            if source is None:
+                return
+            if self.headers.get('x-amz-metadata-directive', 'COPY').upper() == 'REPLACE':
+                # Replaces the headers too, like S3
+                metadata = self._get_metadata()
+                content_type = self.headers.get('Content-Type', 'binary/octet-stream')
+                headers = self._get_content_headers()
+            else:
+                metadata = source['Metadata']
+                content_type = source['ContentType']
+                headers = source['Headers']
+            # Single request copies get a plain md5 ETag, like S3
+            _object = _new_object(source['Body'], _md5_etag(source['Body']), metadata, content_type,
+                    headers=headers)
+            with self.fake.lock:
+                objects[key] = _object
+            self._send_xml('CopyObjectResult', '<LastModified>{}</LastModified><ETag>{}</ETag>'.format(
+                    _iso(_object['LastModified']), escape(_object['ETag'])))
+        else:
+            if not self._start('PutObject'):
+                return
+            if not self._check_md5(body):
+                return
+            _object = _new_object(body, _md5_etag(body), self._get_metadata(),
+                    self.headers.get('Content-Type', 'binary/octet-stream'),
+                    headers=self._get_content_headers())
+            with self.fake.lock:
+                objects[key] = _object
+            self._send(200, b'', {'ETag' : _object['ETag']})
+
+    def do_POST(self):
+        bucket, key, query, body = self._parse()
+        objects = self._get_bucket(bucket)
+        if objects is None:
+            return
+        if 'delete' in query:
+            if not self._start('DeleteObjects'):
+                return
+            root = ElementTree.fromstring(body)
+            keys = [element.text for element in root.iter() if element.tag.endswith('Key')]
+            if self._injected('key_errors'):
+                self._send_xml('DeleteResult', ''.join(
+                        '<Error><Key>{}</Key><Code>{}</Code><Message>Injected fault</Message></Error>'.format(
+                        escape(k), self._fault['code']) for k in keys))
+                return
+            with self.fake.lock:
+                for key in keys:
+                    objects.pop(key, None)
+            self._send_xml('DeleteResult', ''.join(
+                    '<Deleted><Key>{}</Key></Deleted>'.format(escape(k)) for k in keys))
+        elif 'uploads' in query:
+            if not self._start('CreateMultipartUpload'):
+                return
+            upload_id = uuid.uuid4().hex
+            self.fake.uploads[upload_id] = {'Parts' : {}, 'Metadata' : self._get_metadata(),
+                    'ContentType' : self.headers.get('Content-Type', 'binary/octet-stream'),
+                    'Headers' : self._get_content_headers()}
+            self._send_xml('InitiateMultipartUploadResult',
+                    '<Bucket>{}</Bucket><Key>{}</Key><UploadId>{}</UploadId>'.format(
+                    escape(bucket), escape(key), upload_id))
+        elif 'uploadId' in query:
+            if not self._start('CompleteMultipartUpload'):
+                return
+            upload = self.fake.uploads.pop(query['uploadId'], None)
+            if upload is None:
+                self._error(404, 'NoSuchUpload', query['uploadId'])
+                return
+            numbers = [int(e.text) for e in ElementTree.fromstring(body).iter()
+                    if e.tag.endswith('PartNumber')]
+            parts = [upload['Parts'][n] for n in numbers]
+            data = b''.join(p[0] for p in parts)
+            _object = _new_object(data, _multipart_etag([p[1] for p in parts]),
+                    upload['Metadata'], upload['ContentType'], [len(p[0]) for p in parts],
+                    upload['Headers'])
+            with self.fake.lock:
+                objects[key] = _object
+            self._send_xml('CompleteMultipartUploadResult',
+                    '<Bucket>{}</Bucket><Key>{}</Key><ETag>{}</ETag>'.format(
+                    escape(bucket), escape(key), escape(_object['ETag'])))
+        else:
+            self._error(400, 'InvalidRequest', self.path)
+
+    def do_DELETE(self):
+        bucket, key, query, _ = self._parse()
+        objects = self._get_bucket(bucket)
+        if objects is None:
+            return
+        if 'uploadId' in query:
+            if not self._start('AbortMultipartUpload'):
+                return
+            self.fake.uploads.pop(query['uploadId'], None)
+        else:
+            if not self._start('DeleteObject'):
+                return
+            with self.fake.lock:
+                objects.pop(key, None)
+        self._send(204)
+
+    def _get_metadata(self):
+        return dict((name[len('x-amz-meta-'):].lower(), value)
+                for name, value in self.headers.items()
+                if name.lower().startswith('x-amz-meta-'))
+
+    def _get_content_headers(self):
+        return dict((name, self.headers[name]) for name in CONTENT_HEADERS if name in self.headers)
+
+    def _get_copy_source(self, copy_source):
+        bucket, _, key = urllib.parse.unquote(copy_source.split('?')[0]).lstrip('/').partition('/')
+        source = self.fake.buckets.get(bucket, {}).get(key)
+        if source is None:
+            self._error(404, 'NoSuchKey', copy_source)
+        return source
+
+    def _check_md5(self, body):
+        content_md5 = self.headers.get('Content-MD5')
+        if content_md5 is not None and base64.b64decode(content_md5) != hashlib.md5(body).digest():
+            self._error(400, 'BadDigest', 'Content-MD5 does not match')
+            return False
+        return True
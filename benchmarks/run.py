@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""Benchmarks isd_s3 against an in-process S3 stand-in.
+
+Runs offline. Each benchmark prepares its data, then times one operation
+a number of times, and reports the median and fastest run with a rate in
+objects or MB per second. Results are written as json, and can be compared
+with the results of an earlier release.
+
+Usage:
+```
+$ python -m benchmarks.run --output results.json
+$ python -m benchmarks.run --scale medium --latency 0.01 --compare results.json
+```
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import contextlib
+import tempfile
+import statistics
+
+if __package__ is None or __package__ == "":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import fake_s3
+else:
+    from . import fake_s3
+
+import isd_s3
+from isd_s3 import isd_s3 as s3
+
+logger = logging.getLogger(__name__)
+
+# Version of the result format
+SCHEMA_VERSION = 1
+BUCKET = 'bench'
+MiB = 1024*1024
+
+# Data sizes per scale: object counts, file sizes in MiB, and file sizes
+# in MiB for local hashing.
+SCALES = {
+        'small' : {'objects' : [100, 1000], 'file_mib' : [1, 16], 'hash_mib' : [16, 64]},
+        'medium' : {'objects' : [1000, 10000], 'file_mib' : [1, 16, 64], 'hash_mib' : [16, 256]},
+        'large' : {'objects' : [10000, 50000], 'file_mib' : [16, 128, 512], 'hash_mib' : [256, 1024]},
+        }
+# Size of each file in bulk upload and download benchmarks
+SMALL_FILE_SIZE = 16 * 1024
+
+class Context(object):
+    """Server, Session and scratch directory shared by benchmarks."""
+
+    def __init__(self, server, session, tmpdir):
+        self.server = server
+        self.session = session
+        self.tmpdir = tmpdir
+
+    def clear(self):
+        """Removes all objects and local files."""
+        with self.server.lock:
+            self.server.buckets[BUCKET] = {}
+        shutil.rmtree(self.tmpdir)
+        os.makedirs(self.tmpdir)
+
+    def put_objects(self, prefix, count, size=16, metadata=None):
+        body = os.urandom(size)
+        for i in range(count):
+            self.server.put(BUCKET, '{}{:08d}'.format(prefix, i), body, metadata)
+
+    def write_file(self, name, size):
+        path = os.path.join(self.tmpdir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            for _ in range(size // MiB):
+                fh.write(os.urandom(MiB))
+            fh.write(os.urandom(size % MiB))
+        return path
+
+# Benchmarks. Each prepares its data and returns a function that runs the
+# timed operation and returns the amount of work done, in the unit of the
+# benchmark.
+
+def list_objects(ctx, count, parallelism=1):
+    ctx.put_objects('list/', count)
+    def run():
+        return sum(1 for _ in ctx.session.iter_keys(BUCKET, 'list/', parallelism=parallelism))
+    return run
+
+def list_objects_parallel(ctx, count):
+    return list_objects(ctx, count, parallelism=4)
+
+def upload(ctx, mib):
+    local_file = ctx.write_file('upload', mib * MiB)
+    def run():
+        ctx.session.upload_object(local_file, 'upload/file', bucket=BUCKET)
+        return mib * MiB
+    return run
+
+def download(ctx, mib):
+    ctx.server.put(BUCKET, 'download/file', os.urandom(mib * MiB))
+    def run():
+        ctx.session.get_object('download/file', bucket=BUCKET, local_dir=ctx.tmpdir,
+                local_filename='download')
+        return mib * MiB
+    return run
+
+def upload_mult(ctx, count):
+    for i in range(count):
+        ctx.write_file('upload_mult/{:08d}'.format(i), SMALL_FILE_SIZE)
+    local_dir = os.path.join(ctx.tmpdir, 'upload_mult')
+    def run():
+        result = ctx.session.upload_mult_objects(local_dir, key_prefix='upload_mult/',
+                bucket=BUCKET, recursive=True)
+        assert result.get('failed', 0) == 0, result
+        return count
+    return run
+
+def download_mult(ctx, count):
+    ctx.put_objects('download_mult/', count, SMALL_FILE_SIZE)
+    local_dir = os.path.join(ctx.tmpdir, 'download_mult')
+    def run():
+        ctx.session.get_objects('download_mult/', bucket=BUCKET, local_dir=local_dir)
+        return count
+    return run
+
+def delete_mult(ctx, count):
+    ctx.put_objects('delete/', count)
+    def run():
+        result = ctx.session.delete_mult(bucket=BUCKET, prefix='delete/', recursive=True)
+        assert result['deleted'] == count, result
+        return count
+    return run
+
+def copy(ctx, mib):
+    ctx.server.put(BUCKET, 'copy/source', os.urandom(mib * MiB))
+    def run():
+        ctx.session.copy_object('copy/source', 'copy/dest', source_bucket=BUCKET)
+        return mib * MiB
+    return run
+
+def move(ctx, count):
+    ctx.put_objects('move/', count)
+    def run():
+        ctx.session.move_object('move/', 'moved/', source_bucket=BUCKET)
+        return count
+    return run
+
+def search_metadata(ctx, count):
+    ctx.put_objects('search/', count, metadata={'dataset' : 'ds084.1'})
+    def run():
+        found = ctx.session.search_metadata(BUCKET, prefix='search/',
+                metadata_key='dataset', metadata_value='ds084.1')
+        assert len(found) == count
+        return count
+    return run
+
+def etag(ctx, mib):
+    local_file = ctx.write_file('etag', mib * MiB)
+    def run():
+        s3.calculate_s3_etag(local_file)
+        return mib * MiB
+    return run
+
+# name, function, sizes of the scale it runs with, unit of work
+BENCHMARKS = [
+        ('list_objects', list_objects, 'objects', 'objects'),
+        ('list_objects_parallel', list_objects_parallel, 'objects', 'objects'),
+        ('upload', upload, 'file_mib', 'bytes'),
+        ('download', download, 'file_mib', 'bytes'),
+        ('upload_mult', upload_mult, 'objects', 'objects'),
+        ('download_mult', download_mult, 'objects', 'objects'),
+        ('delete_mult', delete_mult, 'objects', 'objects'),
+        ('copy', copy, 'file_mib', 'bytes'),
+        ('move', move, 'objects', 'objects'),
+        ('search_metadata', search_metadata, 'objects', 'objects'),
+        ('etag', etag, 'hash_mib', 'bytes'),
+        ]
+
+def run_benchmark(ctx, name, function, size, unit, repeat):
+    """Runs a benchmark repeat times, preparing its data before each run.
+
+    Returns:
+        (dict) : result
+    """
+    seconds = []
+    requests = {}
+    for _ in range(repeat):
+        ctx.clear()
+        run = function(ctx, size)
+        ctx.server.reset_counts()
+        # Keep progress output of bulk operations out of the results
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            work = run()
+            seconds.append(time.perf_counter() - start)
+        requests = ctx.server.reset_counts()
+    median = statistics.median(seconds)
+    if unit == 'bytes':
+        rate, rate_unit = work / MiB / median, 'MiB/s'
+    else:
+        rate, rate_unit = work / median, unit + '/s'
+    return {'name' : name,
+            'size' : size,
+            'unit' : 'MiB' if unit == 'bytes' else unit,
+            'seconds' : median,
+            'min_seconds' : min(seconds),
+            'runs' : seconds,
+            'rate' : rate,
+            'rate_unit' : rate_unit,
+            'requests' : requests}
+
+def run_all(scale='small', latency=0.002, bandwidth=None, repeat=3, only=None):
+    """Runs the benchmarks.
+
+    Args:
+        scale (str): Key of SCALES.
+        latency (float): Seconds added to every request.
+        bandwidth (float): Bytes per second of the simulated network.
+        repeat (int): Timed runs per benchmark and size.
+        only (list): Names of benchmarks to run. Default all.
+
+    Returns:
+        (dict) : Results with the environment they were measured in.
+    """
+    # The stand-in doesn't check signatures, but botocore needs credentials to sign
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    server = fake_s3.FakeS3Server(latency=latency, bandwidth=bandwidth, buckets=(BUCKET,)).start()
+    tmpdir = tempfile.mkdtemp(prefix='isd_s3_bench')
+    results = []
+    try:
+        session = s3.Session(endpoint_url=server.url, default_bucket=BUCKET,
+                etag_cache=False, bucket_index=False)
+        ctx = Context(server, session, os.path.join(tmpdir, 'data'))
+        os.makedirs(ctx.tmpdir)
+        for name, function, sizes, unit in BENCHMARKS:
+            if only and name not in only:
+                continue
+            for size in SCALES[scale][sizes]:
+                result = run_benchmark(ctx, name, function, size, unit, repeat)
+                logger.info('{name} {size}: {seconds:.3f}s, {rate:.1f} {rate_unit}'.format(**result))
+                results.append(result)
+    finally:
+        server.stop()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    import boto3, botocore
+    return {'schema' : SCHEMA_VERSION,
+            'isd_s3' : isd_s3.__version__,
+            'python' : platform.python_version(),
+            'platform' : platform.platform(),
+            'boto3' : boto3.__version__,
+            'botocore' : botocore.__version__,
+            'date' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'params' : {'scale' : scale, 'latency' : latency,
+                    'bandwidth' : bandwidth, 'repeat' : repeat},
+            'results' : results}
+
+def compare(baseline, current, threshold=0.2):
+    """Returns benchmarks whose rate dropped by more than threshold.
+
+    Args:
+        baseline (dict): Earlier results.
+        current (dict): New results.
+        threshold (float): Relative drop of the rate that counts.
+
+    Returns:
+        (list) : dicts with name, size, baseline and current rate and
+                 their ratio.
+    """
+    if baseline.get('params') != current.get('params'):
+        logger.warning('Comparing results measured with different parameters')
+    previous = dict(((r['name'], r['size']), r) for r in baseline['results'])
+    regressions = []
+    for result in current['results']:
+        old = previous.get((result['name'], result['size']))
+        if old is None:
+            continue
+        ratio = result['rate'] / old['rate']
+        logger.info('{} {}: {:.2f}x of baseline'.format(result['name'], result['size'], ratio))
+        if ratio < 1 - threshold:
+            regressions.append({'name' : result['name'], 'size' : result['size'],
+                    'baseline' : old['rate'], 'current' : result['rate'],
+                    'ratio' : ratio})
+    return regressions
+
+def _get_parser():
+    parser = argparse.ArgumentParser(prog='benchmarks.run',
+            description='Benchmark isd_s3 against an in-process S3 stand-in.')
+    parser.add_argument('--scale', '-s',
+            choices=sorted(SCALES),
+            default='small',
+            help="Data sizes to run with. Default small")
+    parser.add_argument('--latency', '-l',
+            type=float,
+            default=0.002,
+            metavar='<seconds>',
+            help="Seconds added to every request. Default 0.002")
+    parser.add_argument('--bandwidth', '-bw',
+            type=float,
+            metavar='<MiB/s>',
+            help="Simulated network bandwidth. Default unlimited")
+    parser.add_argument('--repeat', '-r',
+            type=int,
+            default=3,
+            metavar='<n>',
+            help="Timed runs per benchmark and size. Default 3")
+    parser.add_argument('--only', '-o',
+            nargs='*',
+            choices=[b[0] for b in BENCHMARKS],
+            metavar='<benchmark>',
+            help="Benchmarks to run. Default all")
+    parser.add_argument('--output', '-out',
+            type=str,
+            metavar='<json file>',
+            help="Write results to this file instead of stdout")
+    parser.add_argument('--compare', '-c',
+            type=str,
+            metavar='<json file>',
+            help="Earlier results. Exits with 1 if a rate dropped by more than --threshold")
+    parser.add_argument('--threshold', '-t',
+            type=float,
+            default=0.2,
+            help="Relative drop of a rate reported as regression. Default 0.2")
+    return parser
+
+def main(*args_list):
+    args = _get_parser().parse_args(args_list)
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    logger.setLevel(logging.INFO)
+    # Uploads warn when the user name isn't available, e.g. in containers
+    logging.getLogger().setLevel(logging.ERROR)
+
+    bandwidth = args.bandwidth * MiB if args.bandwidth else None
+    results = run_all(args.scale, args.latency, bandwidth, args.repeat, args.only)
+    if args.output is None:
+        print(json.dumps(results, indent=4))
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare) as fh:
+            regressions = compare(json.load(fh), results, args.threshold)
+        for regression in regressions:
+            logger.warning('Regression: {name} {size}: {current:.1f} vs {baseline:.1f}/s '
+                    '({ratio:.2f}x)'.format(**regression))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
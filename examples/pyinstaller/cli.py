@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 import sys
 import os
-import pdb
 
 from isd_s3.__main__ import main, read_json_from_stdin, flatten_dict
 from isd_s3 import config
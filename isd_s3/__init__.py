@@ -1,13 +1,20 @@
 import sys
 import logging
-
-from isd_s3 import isd_s3
+import importlib
 
 __all__ = (
     "isd_s3",
     "config"
 )
 
+def __getattr__(name):
+    """Imports submodules on first use, so that `import isd_s3` and the
+    command line parser don't load boto3.
+    """
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 __version__ = "1.1.2"
 
 """
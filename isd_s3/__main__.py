@@ -38,15 +38,18 @@ import os
 import sys
 import argparse
 import logging
-import pdb
 import json
 import select
+import textwrap
+import io
+import types
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 if __package__ is None or __package__ == "":
-    import isd_s3
     import config
 else:
-    from . import isd_s3
     from . import config
 
 logger = logging.getLogger(__name__)
@@ -99,6 +102,37 @@ def _get_parser():
             action='store_true',
             required=False,
             help="Does not check for a valid SSL certificate.")
+    parser.add_argument('--multipart_chunksize', '-mc',
+            type=config.parse_size,
+            required=False,
+            metavar='<size>',
+            help="Part size of multipart transfers, e.g. 64MiB. Raised for files that would need more than 10000 parts.")
+    parser.add_argument('--transfer_concurrency', '-tc',
+            type=int,
+            required=False,
+            metavar='<parts>',
+            help="Most parts of a file transferred at once.")
+    parser.add_argument('--adaptive_transfers', '-at',
+            action='store_true',
+            default=None,
+            required=False,
+            help="Tune the parts transferred at once from measured throughput.")
+    parser.add_argument('--progress', '-pg',
+            action='store_true',
+            required=False,
+            help="Show files and bytes transferred, throughput and ETA on stderr. Not shown for json batches.")
+    parser.add_argument('--stats', '-st',
+            nargs='?',
+            const='-',
+            required=False,
+            metavar='<file>',
+            help="Report request counts, latencies, bytes, retries and time spent hashing at exit. "
+                 "Written to stderr, or to <file>. Not collected for json batches.")
+    parser.add_argument('--stats_format', '-sf',
+            choices=['text', 'json', 'openmetrics'],
+            default='text',
+            required=False,
+            help="Format of --stats. Default text")
 
     # Mutually exclusive commands
     actions_parser = parser.add_subparsers(title='Actions',
@@ -132,6 +166,12 @@ def _get_parser():
             metavar='<bucket>',
             required=False,
             help="Bucket from which to delete")
+    del_parser.add_argument('--concurrency', '-c',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=8,
+            help="Number of delete requests to send at the same time. Default 8")
 
     del_mult_parser = actions_parser.add_parser("delete_mult",
             aliases=['dm'],
@@ -157,6 +197,18 @@ def _get_parser():
             metavar='<bucket>',
             required=False,
             help="Bucket from which to delete")
+    del_mult_parser.add_argument('--parallelism', '-p',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=1,
+            help="Number of key ranges to list concurrently. Default 1")
+    del_mult_parser.add_argument('--concurrency', '-c',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=8,
+            help="Number of delete requests to send at the same time. Default 8")
 
     get_parser = actions_parser.add_parser("get_object",
             aliases=['go'],
@@ -184,47 +236,79 @@ def _get_parser():
             required=False,
             help="Bucket from which to pull object.")
 
-    upload_mult_parser = actions_parser.add_parser("upload_mult",
-            aliases=['um'],
-            help='Upload multiple objects.',
-            description='Upload multiple objects.')
-    upload_mult_parser.add_argument('--bucket', '-b',
+    download_mult_parser = actions_parser.add_parser("get_objects",
+            aliases=['download_mult', 'gos'],
+            help='Pull all objects under a prefix',
+            description='Pull all objects under a prefix into a directory tree mirroring the keys')
+    download_mult_parser.add_argument('prefix',
             type=str,
-            metavar='<bucket>',
+            nargs='?',
+            metavar='<prefix string>',
+            default="",
+            help="prefix of objects to pull. E.g. ds084.1/test")
+    download_mult_parser.add_argument('--regex', '-re',
+            type=str,
+            metavar='<regex>',
             required=False,
-            help="Destination bucket.")
-    upload_mult_parser.add_argument('--local_dir', '-ld',
+            help="Regular expression to match keys against")
+    download_mult_parser.add_argument('--bucket', '-b',
             type=str,
-            metavar='<directory>',
-            required=True,
-            help="Directory to search for files which will be uploaded.")
-    upload_mult_parser.add_argument('--key_prefix', '-kp',
+            metavar='<bucket>',
+            required=False,
+            help="Bucket from which to pull objects.")
+    download_mult_parser.add_argument('--local_dir', '-ld',
             type=str,
-            metavar='<prefix>',
+            metavar='<local directory>',
+            default='./',
             required=False,
-            default="",
-            help="Prepend this string to key")
-    upload_mult_parser.add_argument('--recursive', '-r',
+            help="Save below another specified directory, rather than current working directory.")
+    download_mult_parser.add_argument('--dry_run', '-dr',
             action='store_true',
             required=False,
-            help="Recursively search directory and uploads all found files. Preserves directory structure.")
-    upload_mult_parser.add_argument('--dry_run', '-dr',
+            help="Does not download files. This is used to test whether the correct objects are being selected.")
+    download_mult_parser.add_argument('--workers', '-w',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=8,
+            help="Number of download threads (per process). Default 8")
+    download_mult_parser.add_argument('--processes',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=0,
+            help="Number of worker processes. Default 0 (threads only)")
+    download_mult_parser.add_argument('--parallelism', '-p',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=1,
+            help="Number of key ranges to list concurrently. Default 1")
+
+    upload_mult_parser = actions_parser.add_parser("upload_mult",
+            aliases=['um'],
+            help='Upload multiple objects.',
+            description='Upload multiple objects.')
+    _add_upload_mult_arguments(upload_mult_parser)
+    upload_mult_parser.add_argument('--sync',
             action='store_true',
             required=False,
-            help="Does not upload files. This is used to test whether the correct files are being selected for upload.")
-    upload_mult_parser.add_argument('--ignore', '-i',
-            type=str,
-            metavar='<ignore str>',
-            nargs='*',
-            default=[],
+            help="Skip files whose object has the same size and ETag.")
+
+    sync_parser = actions_parser.add_parser("sync",
+            help='Upload new and changed files.',
+            description='Upload files that are new or differ in size or ETag from their object.')
+    _add_upload_mult_arguments(sync_parser)
+    sync_parser.add_argument('--delete',
+            action='store_true',
             required=False,
-            help="directory to search for files")
-    upload_mult_parser.add_argument('--metadata', '-md',
-            type=str,
-            metavar='<dict str, or path to script>',
+            help="Delete objects under key_prefix that have no local file.")
+    sync_parser.add_argument('--parallelism', '-p',
+            type=int,
+            metavar='<n>',
             required=False,
-            help="Optionally provide metadata for an object. \
-                    This can be a function where file is passed.")
+            default=1,
+            help="Number of key ranges to list concurrently. Default 1")
 
     replace_parser = actions_parser.add_parser("replace_metadata",
             help='replace object metadata',
@@ -278,6 +362,17 @@ def _get_parser():
             action='store_true',
             required=False,
             help="Does not delete files. This is used to test whether the correct files are being selected for move.")
+    move_parser.add_argument('--workers', '-w',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=8,
+            help="Number of copies to run at the same time. Default 8")
+    move_parser.add_argument('--checkpoint', '-cp',
+            type=str,
+            metavar='<file>',
+            required=False,
+            help="File recording finished copies, so an interrupted move can be resumed by running it again.")
 
     copy_parser = actions_parser.add_parser("copy_object",
             aliases=['cp'],
@@ -347,6 +442,11 @@ def _get_parser():
             metavar='<regex>',
             required=False,
             help="Regular expression to match keys against")
+    du_parser.add_argument('--glob', '-g',
+            type=str,
+            metavar='<glob>',
+            required=False,
+            help="Glob to match whole keys against, e.g. 'ds084.1/2019-*/*.nc'. Only matching prefixes are listed.")
     du_parser.add_argument('--bucket', '-b',
             type=str,
             metavar='<bucket>',
@@ -364,6 +464,27 @@ def _get_parser():
             required=False,
             default="1MB",
             help="Specify block size, e.g. 1KB, 500MB, etc")
+    du_parser.add_argument('--human_readable', '-H',
+            action='store_true',
+            required=False,
+            help="Print sizes in the largest fitting unit, e.g. 1.5GB")
+    du_parser.add_argument('--depth', '-d',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=0,
+            help="Also report usage of each prefix n key components below prefix. Default 0")
+    du_parser.add_argument('--parallelism', '-p',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=1,
+            help="Number of key ranges to list concurrently. Default 1")
+    du_parser.add_argument('--max_age', '-ma',
+            type=float,
+            metavar='<seconds>',
+            required=False,
+            help="Answer from the local bucket index if it was refreshed within this many seconds, refreshing it first otherwise.")
 
     lo_parser = actions_parser.add_parser("list_objects",
             aliases=['lo'],
@@ -374,6 +495,11 @@ def _get_parser():
             metavar='<regex>',
             required=False,
             help="Regular expression to match keys against")
+    lo_parser.add_argument('--glob', '-g',
+            type=str,
+            metavar='<glob>',
+            required=False,
+            help="Glob to match whole keys against, e.g. 'ds084.1/2019-*/*.nc'. Only matching prefixes are listed.")
     lo_parser.add_argument('--bucket', '-b',
             type=str,
             metavar='<bucket>',
@@ -393,6 +519,155 @@ def _get_parser():
             action='store_true',
             required=False,
             help="Only return the object keys")
+    lo_parser.add_argument('--parallelism', '-p',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=1,
+            help="Number of key ranges to list concurrently. Default 1")
+    lo_parser.add_argument('--max_age', '-ma',
+            type=float,
+            metavar='<seconds>',
+            required=False,
+            help="Answer from the local bucket index if it was refreshed within this many seconds, refreshing it first otherwise.")
+
+    index_parser = actions_parser.add_parser("refresh_index",
+            aliases=['ri'],
+            help='Refresh the local bucket index',
+            description='List objects under a prefix into the local bucket index used by --max_age')
+    index_parser.add_argument('prefix',
+            type=str,
+            nargs='?',
+            metavar='<prefix string>',
+            default="",
+            help="prefix to index. E.g. ds084.1/test")
+    index_parser.add_argument('--bucket', '-b',
+            type=str,
+            metavar='<bucket>',
+            required=False,
+            help="Bucket to index")
+    index_parser.add_argument('--incremental', '-inc',
+            action='store_true',
+            required=False,
+            help="Only list keys after the last indexed key. For prefixes that are only appended to.")
+    index_parser.add_argument('--parallelism', '-p',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=1,
+            help="Number of key ranges to list concurrently. Default 1")
+
+    meta_mult_parser = actions_parser.add_parser("get_metadata_mult",
+            aliases=['gmm'],
+            help='Get Metadata of all objects under a prefix',
+            description='Get Metadata of all objects under a prefix')
+    meta_mult_parser.add_argument('prefix',
+            type=str,
+            nargs='?',
+            metavar='<prefix string>',
+            default="",
+            help="prefix to filter objects. E.g. ds084.1/test")
+    meta_mult_parser.add_argument('--regex', '-re',
+            type=str,
+            metavar='<regex>',
+            required=False,
+            help="Regular expression to match keys against")
+    meta_mult_parser.add_argument('--bucket', '-b',
+            type=str,
+            metavar='<bucket>',
+            required=False,
+            help="Bucket from which to retrieve metadata")
+    meta_mult_parser.add_argument('--workers', '-w',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=8,
+            help="Number of HEAD requests to send at the same time. Default 8")
+    meta_mult_parser.add_argument('--parallelism', '-p',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=1,
+            help="Number of key ranges to list concurrently. Default 1")
+
+    search_parser = actions_parser.add_parser("search_metadata",
+            aliases=['sm'],
+            help='Find objects by metadata',
+            description='Find objects that have a metadata key, optionally with a given value')
+    search_parser.add_argument('prefix',
+            type=str,
+            nargs='?',
+            metavar='<prefix string>',
+            default="",
+            help="prefix to filter objects. E.g. ds084.1/test")
+    search_parser.add_argument('--metadata_key', '-mk',
+            type=str,
+            metavar='<metadata key>',
+            required=True,
+            help="Metadata key objects must have")
+    search_parser.add_argument('--metadata_value', '-mv',
+            type=str,
+            metavar='<metadata value>',
+            required=False,
+            help="Value metadata key must have")
+    search_parser.add_argument('--obj_regex', '-re',
+            type=str,
+            metavar='<regex>',
+            required=False,
+            help="Regular expression to match keys against")
+    search_parser.add_argument('--bucket', '-b',
+            type=str,
+            metavar='<bucket>',
+            required=False,
+            help="Bucket to search")
+    search_parser.add_argument('--workers', '-w',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=8,
+            help="Number of HEAD requests to send at the same time. Default 8")
+    search_parser.add_argument('--parallelism', '-p',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=1,
+            help="Number of key ranges to list concurrently. Default 1")
+
+    verify_parser = actions_parser.add_parser("verify_object",
+            aliases=['vf'],
+            help='Compare object with local file',
+            description='Compare the ETag of an object with the ETag of a local file')
+    verify_parser.add_argument('--local_file', '-lf',
+            type=str,
+            metavar='<filename>',
+            required=True,
+            help="local file to compare against")
+    verify_parser.add_argument('--key', '-k',
+            type=str,
+            metavar='<key>',
+            required=True,
+            help="Object key to compare")
+    verify_parser.add_argument('--bucket', '-b',
+            type=str,
+            metavar='<bucket>',
+            required=False,
+            help="Bucket of object")
+
+    serve_parser = actions_parser.add_parser("serve",
+            help='Serve commands from a local socket',
+            description="""Keep Sessions and connection pools warm and serve commands on a Unix
+            domain socket. While it runs, isd_s3 forwards commands to it.
+            Commands run with the credentials of the daemon.""")
+    serve_parser.add_argument('--socket', '-s',
+            type=str,
+            metavar='<socket file>',
+            required=False,
+            help="Socket to listen on. Default $ISD_S3_SOCKET, or isd_s3.sock in $XDG_RUNTIME_DIR or ~/.cache/isd_s3")
+    serve_parser.add_argument('--workers', '-w',
+            type=int,
+            metavar='<n>',
+            required=False,
+            help="Number of commands to run at the same time. Default $ISD_S3_BATCH_WORKERS or 8")
 
     meta_parser = actions_parser.add_parser("get_metadata",
             aliases=['gm'],
@@ -411,6 +686,58 @@ def _get_parser():
 
     return parser
 
+def _add_upload_mult_arguments(upload_mult_parser):
+    """Adds arguments shared by upload_mult and sync."""
+    upload_mult_parser.add_argument('--bucket', '-b',
+            type=str,
+            metavar='<bucket>',
+            required=False,
+            help="Destination bucket.")
+    upload_mult_parser.add_argument('--local_dir', '-ld',
+            type=str,
+            metavar='<directory>',
+            required=True,
+            help="Directory to search for files which will be uploaded.")
+    upload_mult_parser.add_argument('--key_prefix', '-kp',
+            type=str,
+            metavar='<prefix>',
+            required=False,
+            default="",
+            help="Prepend this string to key")
+    upload_mult_parser.add_argument('--recursive', '-r',
+            action='store_true',
+            required=False,
+            help="Recursively search directory and uploads all found files. Preserves directory structure.")
+    upload_mult_parser.add_argument('--dry_run', '-dr',
+            action='store_true',
+            required=False,
+            help="Does not upload files. This is used to test whether the correct files are being selected for upload.")
+    upload_mult_parser.add_argument('--ignore', '-i',
+            type=str,
+            metavar='<ignore str>',
+            nargs='*',
+            default=[],
+            required=False,
+            help="directory to search for files")
+    upload_mult_parser.add_argument('--metadata', '-md',
+            type=str,
+            metavar='<dict str, or path to script>',
+            required=False,
+            help="Optionally provide metadata for an object. \
+                    This can be a function where file is passed.")
+    upload_mult_parser.add_argument('--workers', '-w',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=8,
+            help="Number of upload threads (per process). Default 8")
+    upload_mult_parser.add_argument('--processes',
+            type=int,
+            metavar='<n>',
+            required=False,
+            default=0,
+            help="Number of worker processes. Default 0 (threads only)")
+
 def _get_action(obj, command):
     """Gets a map between the command line 'commands' and functions.
 
@@ -422,9 +749,13 @@ def _get_action(obj, command):
     # If command isn't the same as the method use map
     command_map = {
             "go" : 'get_object',
+            "gos" : 'get_objects',
+            "download_mult" : 'get_objects',
             "lb" : 'list_buckets',
             "lo" : 'list_objects',
             "gm" : 'get_metadata',
+            "gmm" : 'get_metadata_mult',
+            "sm" : 'search_metadata',
             "upload" : 'upload_object',
             "ul" : 'upload_object',
             "cp" : 'copy_object',
@@ -432,6 +763,8 @@ def _get_action(obj, command):
             "dl" : 'delete',
             "dm" : 'delete_mult',
             "du" : 'disk_usage',
+            "vf" : 'verify_object',
+            "ri" : 'refresh_index',
             "upload_mult" : 'upload_mult_objects',
             "um" : 'upload_mult_objects'
             }
@@ -451,7 +784,13 @@ def get_global_args():
             'default_bucket',
             'loglevel',
             'credentials_file',
-            'no_verify_certs']
+            'no_verify_certs',
+            'multipart_chunksize',
+            'transfer_concurrency',
+            'adaptive_transfers',
+            'progress',
+            'stats',
+            'stats_format']
     return global_args
 
 def _remove_common_args(_dict):
@@ -468,17 +807,74 @@ def _remove_common_args(_dict):
     for arg in args:
         _dict.pop(arg, None)
 
-def do_action(args):
+def _import_isd_s3():
+    """Imports the isd_s3 module.
+
+    Deferred until an action runs, since it loads boto3 and botocore, which
+    take most of the startup time of the command line tool.
+    """
+    if __package__ is None or __package__ == "":
+        import isd_s3
+    else:
+        from . import isd_s3
+    return isd_s3
+
+def get_session(args, stats=False, progress=False):
+    """Creates a Session from the global arguments.
+
+    Args:
+        args (Namespace): Parsed arguments.
+        stats (bool): Collect stats, see write_stats.
+        progress (bool): Show progress of transfers on stderr.
+    """
+    isd_s3 = _import_isd_s3()
+    reporter = None
+    if progress:
+        if __package__ is None or __package__ == "":
+            from progress import TerminalReporter
+        else:
+            from .progress import TerminalReporter
+        reporter = TerminalReporter()
+    return isd_s3.Session(endpoint_url=args.s3_url, credentials_loc=args.credentials_file, verify=not args.no_verify_certs,
+            multipart_chunksize=args.multipart_chunksize,
+            max_transfer_concurrency=args.transfer_concurrency,
+            adaptive_transfers=args.adaptive_transfers,
+            stats=stats, progress=reporter)
+
+def write_stats(stats, stats_file='-', stats_format='text'):
+    """Writes the stats of a Session.
+
+    Args:
+        stats (stats.SessionStats): Stats to write.
+        stats_file (str): File to write to, '-' for stderr.
+        stats_format (str): 'text', 'json' or 'openmetrics'.
+    """
+    if stats_format == 'json':
+        output = json.dumps(stats.to_dict(), indent=4) + '\n'
+    elif stats_format == 'openmetrics':
+        output = stats.to_openmetrics()
+    else:
+        output = stats.summary() + '\n'
+    if stats_file == '-':
+        sys.stderr.write(output)
+    else:
+        with open(stats_file, 'w') as fh:
+            fh.write(output)
+
+def do_action(args, session=None):
     """Interprets the parser and kicks processes command
 
     Args:
         args (Namespace): Argument parser to find commands and sub-commands.
+        session (Session): Session to run the command with. Default a new
+                           Session from the global arguments.
 
     Returns:
         function
     """
     # Init Session
-    session = isd_s3.Session(endpoint_url=args.s3_url, credentials_loc=args.credentials_file, verify=not args.no_verify_certs)
+    if session is None:
+        session = get_session(args)
 
     # Get function corresponding with command
     function = _get_action(session, args.command)
@@ -487,17 +883,39 @@ def do_action(args):
     args_dict = args.__dict__
     _remove_common_args(args_dict)
 
+    # Stream listings rather than building the whole list
+    if function == session.list_objects and not args_dict['ls']:
+        del args_dict['ls']
+        function = session.iter_objects
 
     return function(**args_dict)
 
 def _pretty_print(struct, pretty_print=True):
     """pretty print output struct"""
-    if struct is not None:
+    if isinstance(struct, types.GeneratorType):
+        _print_stream(struct, pretty_print)
+    elif struct is not None:
         if pretty_print:
             print(json.dumps(struct, indent=4, default=lambda x: x.__str__()))
         else:
             print(json.dumps(struct, default=lambda x: x.__str__()))
 
+def _print_stream(items, pretty_print=True):
+    """Prints items of a generator as a json list while they are produced"""
+    indent = 4 if pretty_print else None
+    separator = ',\n' if pretty_print else ', '
+    start = '[\n' if pretty_print else '['
+    end = '\n]' if pretty_print else ']'
+
+    empty = True
+    for item in items:
+        item_str = json.dumps(item, indent=indent, default=lambda x: x.__str__())
+        if pretty_print:
+            item_str = textwrap.indent(item_str, ' ' * indent)
+        sys.stdout.write((start if empty else separator) + item_str)
+        empty = False
+    sys.stdout.write('[]\n' if empty else end + '\n')
+
 def flatten_dict(_dict):
     assert 'command' in _dict
     args_list = [_dict['command']]
@@ -542,6 +960,7 @@ def main(*args_list):
 
     Returns:
         (dict, generally) : result of argument call.
+                            Streamed results are consumed when printed.
     """
     parser = _get_parser()
     args_list = list(args_list) # args_list is tuple
@@ -567,8 +986,21 @@ def main(*args_list):
 
     config.configure_environment(args.s3_url, args.credentials_file, args.default_bucket)
 
-    result_json = do_action(args)
-    print_output(result_json, pp, noprint)
+    if args.command == 'serve':
+        return serve(args.socket, args.workers)
+
+    session = None
+    stats_file, stats_format = args.stats, args.stats_format
+    if stats_file is not None or args.progress:
+        session = get_session(args, stats=stats_file is not None, progress=args.progress)
+    try:
+        result_json = do_action(args, session)
+        if isinstance(result_json, types.GeneratorType) and noprint:
+            result_json = list(result_json)
+        print_output(result_json, pp, noprint)
+    finally:
+        if stats_file is not None:
+            write_stats(session.stats, stats_file, stats_format)
     return result_json
 
 def print_output(output, pretty_print=True, noprint=False):
@@ -601,7 +1033,7 @@ def call_action_from_dict(args_dict):
         args_dict['s3_url'] = None
     if 'credentials_file' not in args_dict:
         args_dict['credentials_file'] = None
-    session = isd_s3.Session(endpoint_url=args_dict['s3_url'], credentials_loc=args_dict['credentials_file'])
+    session = _import_isd_s3().Session(endpoint_url=args_dict['s3_url'], credentials_loc=args_dict['credentials_file'])
 
     # Get function corresponding with command
     function = _get_action(session, args_dict['command'])
@@ -613,21 +1045,322 @@ def call_action_from_dict(args_dict):
 
     return result
 
+def has_failures(result):
+    """Whether a command result reports failed items, e.g. from upload_mult."""
+    if not isinstance(result, dict):
+        return False
+    return result.get('failed', 0) > 0 or len(result.get('errors', [])) > 0
+
+def _session_key(args):
+    """Global arguments that need a separate Session."""
+    return (args.s3_url, args.credentials_file, args.no_verify_certs,
+            args.multipart_chunksize, args.transfer_concurrency,
+            args.adaptive_transfers)
+
+# Arguments holding local paths, resolved against the directory of the
+# client when commands run in the daemon. metadata is only a path when it
+# isn't json, see _is_metadata_script.
+LOCAL_PATH_ARGS = ('local_file', 'local_dir', 'credentials_file', 'checkpoint')
+
+def _is_metadata_script(metadata):
+    """Whether a --metadata value is the path of a script, not json."""
+    try:
+        json.loads(metadata)
+        return False
+    except ValueError:
+        return True
+
+def _prepare_batch_command(parser, command, cwd=None):
+    """Parses a command of a batch and sets its process wide options.
+
+    Args:
+        parser (ArgumentParser): from _get_parser.
+        command (dict, list): Command dict, or list of arguments.
+        cwd (str): Directory relative local paths are resolved against.
+
+    Returns:
+        (Namespace) : parsed arguments
+
+    Raises:
+        ValueError: if the command can't be parsed.
+    """
+    if not isinstance(command, (list, dict)):
+        raise ValueError('Invalid command {}: not a dict or list'.format(json.dumps(command)))
+    if isinstance(command, dict) and 'command' not in command:
+        raise ValueError('Invalid command {}: missing "command"'.format(json.dumps(command)))
+    usage = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(usage):
+            if isinstance(command, list):
+                args = parser.parse_args(command)
+            else:
+                args = parser.parse_args(flatten_dict(dict(command)))
+    except SystemExit:
+        message = usage.getvalue().strip().split('\n')[-1]
+        raise ValueError('Invalid command {}: {}'.format(json.dumps(command), message))
+    if cwd is not None:
+        for arg in LOCAL_PATH_ARGS:
+            path = getattr(args, arg, None)
+            if path is not None:
+                setattr(args, arg, os.path.join(cwd, os.path.expanduser(path)))
+        metadata = getattr(args, 'metadata', None)
+        if metadata is not None and _is_metadata_script(metadata):
+            args.metadata = os.path.join(cwd, os.path.expanduser(metadata))
+    if args.use_local_config is True:
+        os.environ.pop('AWS_SHARED_CREDENTIALS_FILE', None)
+    if args.s3_url is None:
+        # Resolved now, Sessions change the environment
+        args.s3_url = config.get_s3_url() or config.get_default_environment()['s3_url']
+    if args.loglevel is not None:
+        logger.setLevel(getattr(logging, args.loglevel.upper()))
+    return args
+
+def _run_batch_command(args, session):
+    """Runs a parsed command of a batch, returning its fully consumed result."""
+    if args.default_bucket is not None:
+        # The default bucket is process wide, so pass it explicitly.
+        # Copies and moves take source_bucket, and default dest_bucket to it
+        for arg in ('bucket', 'source_bucket'):
+            if getattr(args, arg, False) is None:
+                setattr(args, arg, config.remove_trailing_slash(args.default_bucket))
+    result = do_action(args, session)
+    if isinstance(result, types.GeneratorType):
+        result = list(result)
+    return result
+
+class BatchRunner(object):
+
+    def __init__(self, workers=config.DEFAULT_BATCH_WORKERS):
+        """Runs batches of commands on a shared thread pool.
+
+        Sessions are kept between batches, one per s3 url, credentials and
+        transfer options, so their clients and connection pools stay warm.
+
+        Args:
+            workers (int): Number of commands to run at the same time,
+                           across all batches.
+        """
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._parser = _get_parser()
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def _get_session(self, args):
+        key = _session_key(args)
+        with self._lock:
+            if key not in self._sessions:
+                self._sessions[key] = get_session(args)
+            return self._sessions[key]
+
+    def run(self, commands, cwd=None):
+        """Runs a list of commands concurrently.
+
+        Commands are parsed up front. Up to workers commands run at the same
+        time, so commands of a batch must not depend on each other.
+
+        Args:
+            commands (list): Command dicts, as read by pipmain, or lists of
+                             arguments.
+            cwd (str): Directory relative local paths are resolved against.
+                       Default the current directory of this process.
+
+        Returns:
+            (generator) : a dict per command, in the order they finish, with
+                          'index' into commands, 'command', 'status' and
+                          'result' or 'error'. status is 'ok', 'failed' if
+                          the result reports failed items, or 'error'.
+        """
+        futures = {}
+        try:
+            for index, command in enumerate(commands):
+                try:
+                    with self._lock:
+                        args = _prepare_batch_command(self._parser, command, cwd)
+                    # do_action removes the global arguments, so keep them
+                    name, noprint = args.command, args.noprint
+                    future = self._pool.submit(_run_batch_command, args, self._get_session(args))
+                    futures[future] = (index, name, noprint)
+                except Exception as e:
+                    name = command.get('command') if isinstance(command, dict) else None
+                    yield {'index' : index, 'command' : name, 'status' : 'error', 'error' : str(e)}
+            for future in as_completed(futures):
+                index, name, noprint = futures.pop(future)
+                status = {'index' : index, 'command' : name}
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.debug('Command {} failed'.format(index), exc_info=True)
+                    status.update({'status' : 'error', 'error' : str(e)})
+                else:
+                    status['status'] = 'failed' if has_failures(result) else 'ok'
+                    if not noprint:
+                        status['result'] = result
+                yield status
+        finally:
+            # Commands not started yet are dropped if the caller stops early
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        """Waits for running commands and releases the thread pool."""
+        self._pool.shutdown()
+
+def run_batch(commands, workers=config.DEFAULT_BATCH_WORKERS):
+    """Runs a list of commands concurrently. See BatchRunner.run.
+
+    Commands with the same s3 url, credentials and transfer options share
+    one Session, so one client and its connection pool.
+    """
+    runner = BatchRunner(workers)
+    try:
+        yield from runner.run(commands)
+    finally:
+        runner.close()
+
+def print_batch(statuses):
+    """Prints each command status of run_batch as a line of json.
+
+    Returns:
+        (bool) : Whether any command did not succeed.
+    """
+    failed = False
+    for status in statuses:
+        failed = failed or status['status'] != 'ok'
+        sys.stdout.write(json.dumps(status, default=lambda x: x.__str__()) + '\n')
+        sys.stdout.flush()
+    return failed
+
+def serve(socket_file=None, workers=None):
+    """Serves commands on a Unix domain socket until interrupted.
+
+    Args:
+        socket_file (str): Socket to listen on. Default config.get_socket_file
+        workers (int): Number of commands to run at the same time.
+                       Default config.get_batch_workers
+
+    Returns:
+        None
+    """
+    if __package__ is None or __package__ == "":
+        import daemon
+    else:
+        from . import daemon
+    if socket_file is None:
+        socket_file = config.get_socket_file()
+    if socket_file is None:
+        raise ValueError('Daemon socket disabled, set ' + config.ISD_S3_SOCKET)
+    runner = BatchRunner(workers or config.get_batch_workers())
+    try:
+        daemon.serve(runner.run, socket_file)
+    finally:
+        runner.close()
+
+def _forward(commands, batch=False):
+    """Runs commands on the daemon, if one is running.
+
+    Commands that change the process, with --use_local_config or
+    --loglevel, commands with --stats or --progress, and serve itself
+    always run locally. The s3 url,
+    credentials file and default bucket of this process are passed along,
+    since the daemon has its own environment. Commands also run locally
+    when the daemon has other AWS_* or ISD_S3_* variables, see
+    config.get_command_environment.
+
+    Args:
+        commands (list): Lists of arguments, or command dicts of a batch.
+        batch (bool): commands are a batch. Invalid commands are reported
+                      by the batch, instead of exiting here.
+
+    Returns:
+        (generator) : status dicts as from BatchRunner.run, or None if the
+                      commands have to run locally.
+    """
+    socket_file = config.get_socket_file()
+    if socket_file is None or not os.path.exists(socket_file):
+        return None
+    parser = _get_parser()
+    forwarded = []
+    for args_list in commands:
+        if not isinstance(args_list, list):
+            try:
+                args_list = flatten_dict(dict(args_list))
+            except Exception:
+                # Reported by BatchRunner on the daemon
+                forwarded.append(args_list)
+                continue
+        try:
+            with contextlib.redirect_stderr(io.StringIO()) if batch else contextlib.nullcontext():
+                args = parser.parse_args(args_list)
+        except SystemExit:
+            if not batch:
+                raise
+            return None
+        if (args.command == 'serve' or args.use_local_config or args.loglevel is not None
+                or args.stats is not None or args.progress):
+            return None
+        client_args = []
+        for arg, value in (('--s3_url', config.get_s3_url()),
+                ('--credentials_file', config.get_credentials_file()),
+                ('--default_bucket', config.get_default_bucket())):
+            if getattr(args, arg[2:]) is None and value is not None:
+                client_args.extend([arg, value])
+        forwarded.append(client_args + list(args_list))
+
+    if __package__ is None or __package__ == "":
+        import daemon
+    else:
+        from . import daemon
+    try:
+        return daemon.request(forwarded, socket_file=socket_file)
+    except OSError as e:
+        logger.debug('Not using daemon at {}: {}'.format(socket_file, e))
+        return None
+
+def _print_forwarded(args_list, statuses):
+    """Prints the result of a single forwarded command like main would.
+
+    Returns:
+        (bool) : Whether the command did not succeed.
+    """
+    args = _get_parser().parse_args(args_list)
+    for status in statuses:
+        if status['status'] == 'error':
+            sys.stderr.write('isd_s3: {}\n'.format(status['error']))
+            return True
+        print_output(status.get('result'), args.prettyprint, args.noprint)
+        return status['status'] != 'ok'
+    sys.stderr.write('isd_s3: daemon closed the connection\n')
+    return True
+
 def pipmain():
     #from_pipe = not os.isatty(sys.stdin.fileno())
     from_pipe = select.select([sys.stdin,],[],[],0.0)[0]
+    failed = False
     if len(sys.argv) > 1:
-        main(*sys.argv[1:])
+        statuses = _forward([sys.argv[1:]])
+        if statuses is None:
+            failed = has_failures(main(*sys.argv[1:]))
+        else:
+            failed = _print_forwarded(sys.argv[1:], statuses)
     elif from_pipe:
         json_input = read_json_from_stdin()
         if isinstance(json_input, list):
-            for command_json in json_input:
-                main(*flatten_dict(command_json))
+            statuses = _forward(json_input, batch=True)
+            if statuses is None:
+                statuses = run_batch(json_input, config.get_batch_workers())
+            failed = print_batch(statuses)
         else:
-            main(*flatten_dict(json_input))
+            args_list = flatten_dict(json_input)
+            statuses = _forward([args_list])
+            if statuses is None:
+                failed = has_failures(main(*args_list))
+            else:
+                failed = _print_forwarded(args_list, statuses)
        # call_action_from_dict(json_input)
     else:
         main(*sys.argv[1:])
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Asyncio interface to s3.
+
+AsyncSession offers the Session operations as coroutines and async
+iterators. Requests run on the AsyncSession's own thread pool and client,
+with a connection pool at least as large, and a semaphore bounds how
+many run at once. The event loop is never blocked by a request. Endpoint,
+credentials and default bucket are configured through isd_s3.config, as
+for Session.
+
+Example usage:
+```
+>>> from isd_s3 import async_session
+>>> async with async_session.AsyncSession(concurrency=32) as session:
+...     async for key in session.iter_keys(prefix='ds084.1/'):
+...         print(key)
+...     metadata = await session.get_metadata('ds084.1/file.nc')
+```
+"""
+
+import asyncio
+import logging
+import functools
+import itertools
+import collections
+
+import botocore.exceptions
+from concurrent.futures import ThreadPoolExecutor
+
+if __package__ is None or __package__ == "":
+    import isd_s3
+else:
+    from . import isd_s3
+
+logger = logging.getLogger(__name__)
+
+# Objects fetched from a blocking iterator per executor call
+ITER_BATCH_SIZE = 1000
+
+class AsyncSession(object):
+
+    def __init__(self, endpoint_url=None, credentials_loc=None, default_bucket=None, verify=True, concurrency=isd_s3.DEFAULT_CONCURRENCY, **session_args):
+        """AsyncSession constructor
+
+        Args:
+            endpoint_url (str): The s3 url to connect to.
+            credentials_loc (str): location of the credentials file.
+                                   (default: ~/.aws/credentials)
+            default_bucket (str): bucket to use if not specified explicitly.
+            verify (bool): Check SSL certificates. Default True
+            concurrency (int): Most requests in flight at once. Also the
+                               size of the thread pool, and the least size
+                               of the connection pool.
+            session_args: Other Session arguments, e.g. metadata_cache_size.
+
+        The client isn't shared with Sessions, so their requests don't
+        compete for its connections.
+        """
+        session_args.setdefault('max_pool_connections', max(concurrency,
+                isd_s3.DEFAULT_CLIENT_OPTIONS['max_pool_connections']))
+        session_args.setdefault('shared_client', False)
+        self.session = isd_s3.Session(endpoint_url=endpoint_url,
+                credentials_loc=credentials_loc, default_bucket=default_bucket,
+                verify=verify, **session_args)
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Waits for running requests and releases the thread pool."""
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    def _get_semaphore(self):
+        # Created on first use, so it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _run(self, func, *args, **kwargs):
+        """Calls a blocking function on the thread pool, within the concurrency limit."""
+        async with self._get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                    self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _iterate(self, iterator):
+        """Yields the items of a blocking iterator, fetched in batches on the thread pool."""
+        try:
+            while True:
+                batch = await self._run(_take, iterator, ITER_BATCH_SIZE)
+                for item in batch:
+                    yield item
+                if len(batch) < ITER_BATCH_SIZE:
+                    return
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                # On the loop's executor, as this may run after close()
+                await asyncio.get_running_loop().run_in_executor(None, close)
+
+    async def _map_ordered(self, func, items):
+        """Yields func(item) for items, running up to concurrency calls at once in order."""
+        pending = collections.deque()
+        try:
+            async for item in items:
+                pending.append(asyncio.ensure_future(self._run(func, item)))
+                if len(pending) >= self.concurrency * isd_s3.TASKS_PER_WORKER:
+                    yield await pending.popleft()
+            while len(pending) > 0:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # Listing
+
+    async def list_buckets(self, buckets_only=False):
+        """See Session.list_buckets."""
+        return await self._run(self.session.list_buckets, buckets_only)
+
+    async def list_objects(self, *args, **kwargs):
+        """See Session.list_objects."""
+        return await self._run(self.session.list_objects, *args, **kwargs)
+
+    def iter_objects(self, *args, **kwargs):
+        """Async iterator over objects. See Session.iter_objects."""
+        return self._iterate(self.session.iter_objects(*args, **kwargs))
+
+    def iter_keys(self, *args, **kwargs):
+        """Async iterator over keys. See Session.iter_keys."""
+        return self._iterate(self.session.iter_keys(*args, **kwargs))
+
+    async def directory_list(self, *args, **kwargs):
+        """See Session.directory_list."""
+        return await self._run(self.session.directory_list, *args, **kwargs)
+
+    async def disk_usage(self, *args, **kwargs):
+        """See Session.disk_usage."""
+        return await self._run(self.session.disk_usage, *args, **kwargs)
+
+    # Single objects
+
+    async def get_metadata(self, key, bucket=None):
+        """See Session.get_metadata."""
+        return await self._run(self.session.get_metadata, key, bucket)
+
+    async def get_object(self, *args, **kwargs):
+        """See Session.get_object."""
+        return await self._run(self.session.get_object, *args, **kwargs)
+
+    async def upload_object(self, *args, **kwargs):
+        """See Session.upload_object."""
+        return await self._run(self.session.upload_object, *args, **kwargs)
+
+    async def copy_object(self, *args, **kwargs):
+        """See Session.copy_object."""
+        return await self._run(self.session.copy_object, *args, **kwargs)
+
+    async def replace_metadata(self, *args, **kwargs):
+        """See Session.replace_metadata."""
+        return await self._run(self.session.replace_metadata, *args, **kwargs)
+
+    async def verify_object(self, *args, **kwargs):
+        """See Session.verify_object."""
+        return await self._run(self.session.verify_object, *args, **kwargs)
+
+    async def delete(self, keys=[], bucket=None, dry_run=False):
+        """See Session.delete."""
+        return await self._run(self.session.delete, keys, bucket, dry_run,
+                concurrency=self.concurrency)
+
+    # Bulk operations. These fan out on the Session's own worker pools,
+    # with concurrency workers, while holding a single slot here.
+
+    async def move_object(self, *args, **kwargs):
+        """See Session.move_object."""
+        kwargs.setdefault('workers', self.concurrency)
+        return await self._run(self.session.move_object, *args, **kwargs)
+
+    async def delete_mult(self, *args, **kwargs):
+        """See Session.delete_mult."""
+        kwargs.setdefault('concurrency', self.concurrency)
+        return await self._run(self.session.delete_mult, *args, **kwargs)
+
+    async def upload_mult_objects(self, *args, **kwargs):
+        """See Session.upload_mult_objects."""
+        kwargs.setdefault('workers', self.concurrency)
+        return await self._run(self.session.upload_mult_objects, *args, **kwargs)
+
+    async def sync(self, *args, **kwargs):
+        """See Session.sync."""
+        kwargs.setdefault('workers', self.concurrency)
+        return await self._run(self.session.sync, *args, **kwargs)
+
+    async def get_objects(self, *args, **kwargs):
+        """See Session.get_objects."""
+        kwargs.setdefault('workers', self.concurrency)
+        return await self._run(self.session.get_objects, *args, **kwargs)
+
+    async def search_metadata(self, *args, **kwargs):
+        """See Session.search_metadata."""
+        kwargs.setdefault('workers', self.concurrency)
+        return await self._run(self.session.search_metadata, *args, **kwargs)
+
+    async def get_metadata_mult(self, prefix="", bucket=None, regex=None, parallelism=1):
+        """Async iterator over {'Key', 'Metadata'} of objects under prefix.
+
+        HEAD requests are sent concurrently, up to the concurrency limit,
+        while the listing streams. Objects deleted after listing are skipped.
+        See Session.get_metadata_mult.
+        """
+        bucket = self.session.get_bucket(bucket)
+        keys = self.iter_keys(bucket, prefix, regex=regex, parallelism=parallelism)
+        head = functools.partial(_head_or_none, self.session, bucket)
+        try:
+            async for key, head_response in self._map_ordered(head, keys):
+                if head_response is not None:
+                    yield {'Key' : key, 'Metadata' : head_response['Metadata']}
+        finally:
+            # Stops the listing now, not when the generator is collected
+            await keys.aclose()
+
+    def __str__(self):
+        return 'Async' + str(self.session)
+
+def _take(iterator, n):
+    return list(itertools.islice(iterator, n))
+
+def _head_or_none(session, bucket, key):
+    """Returns (key, head_object response), with None if key no longer exists."""
+    try:
+        return key, session.get_metadata(key, bucket)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            logger.debug('{} was removed after listing'.format(key))
+            return key, None
+        raise
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""Persistent local index of bucket listings.
+
+A refresh lists a prefix once and stores key, size, ETag, last modified
+time and storage class of every object in sqlite. Listings, disk usage and
+'directory' listings under an indexed prefix are then answered with range
+scans of the index instead of listing the bucket again. Each refreshed
+prefix records when it was listed, so callers can bound how stale an
+answer may be.
+
+Example usage:
+```
+>>> from isd_s3 import isd_s3
+>>> session = isd_s3.Session()
+>>> session.refresh_index('ds084.1/')
+>>> session.list_objects(prefix='ds084.1/2019', max_age=3600)
+```
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Rows written or read per statement
+BATCH_SIZE = 1000
+
+class BucketIndex(object):
+
+    def __init__(self, path):
+        """BucketIndex constructor
+
+        Args:
+            path (str): sqlite file. Parent directories are created.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        """Returns a connection, reconnecting in forked processes."""
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        directory = os.path.dirname(self.path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS objects (
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                storage_class TEXT,
+                PRIMARY KEY (bucket, key)) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+                bucket TEXT NOT NULL,
+                prefix TEXT NOT NULL,
+                refreshed REAL NOT NULL,
+                PRIMARY KEY (bucket, prefix))''')
+        # Listings being refreshed, moved to objects once complete
+        conn.execute('''CREATE TABLE IF NOT EXISTS staged_objects (
+                refresh TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                storage_class TEXT,
+                PRIMARY KEY (refresh, bucket, key)) WITHOUT ROWID''')
+        conn.commit()
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def age(self, bucket, prefix):
+        """Returns seconds since prefix was last refreshed.
+
+        A refresh of any prefix that prefix starts with also counts.
+
+        Returns:
+            (float) : age in seconds, or None if prefix is not indexed.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                    'SELECT prefix, refreshed FROM snapshots WHERE bucket=?',
+                    (bucket,)).fetchall()
+        refreshed = [r[1] for r in rows if prefix.startswith(r[0])]
+        if len(refreshed) == 0:
+            return None
+        return max(time.time() - max(refreshed), 0)
+
+    def is_fresh(self, bucket, prefix, max_age):
+        """Returns whether prefix was refreshed within max_age seconds."""
+        try:
+            age = self.age(bucket, prefix)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning('Bucket index {} unavailable: {}'.format(self.path, e))
+            return False
+        return age is not None and age <= max_age
+
+    def refresh(self, bucket, prefix, objects, incremental=False):
+        """Stores a listing of prefix.
+
+        Args:
+            bucket (str): Name of s3 bucket.
+            prefix (str): Prefix that was listed.
+            objects (iterable): objects as returned by list_objects_v2.
+            incremental (bool): objects only holds keys added since the last
+                                refresh. Otherwise all indexed objects under
+                                prefix are replaced.
+
+        Returns:
+            (int) : Number of objects stored.
+
+        objects are staged on a connection of their own while they are
+        listed. The lock is only held to swap them in, so the index keeps
+        answering from the previous listing until then.
+        """
+        with self._lock:
+            # Creates the tables
+            self._connect()
+        refresh_id = uuid.uuid4().hex
+        count = self._stage(refresh_id, bucket, objects)
+        with self._lock:
+            conn = self._connect()
+            try:
+                if not incremental:
+                    where, args = _range_clause(bucket, prefix)
+                    conn.execute('DELETE FROM objects WHERE ' + where, args)
+                    # Narrower snapshots are covered by this one
+                    conn.execute('''DELETE FROM snapshots WHERE bucket=?
+                            AND substr(prefix, 1, ?)=?''', (bucket, len(prefix), prefix))
+                conn.execute('''INSERT OR REPLACE INTO objects
+                        (bucket, key, size, etag, last_modified, storage_class)
+                        SELECT bucket, key, size, etag, last_modified, storage_class
+                        FROM staged_objects WHERE refresh=?''', (refresh_id,))
+                conn.execute('DELETE FROM staged_objects WHERE refresh=?', (refresh_id,))
+                conn.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)',
+                        (bucket, prefix, time.time()))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return count
+
+    def _stage(self, refresh_id, bucket, objects):
+        """Writes objects to staged_objects, returns how many."""
+        count = 0
+        staging = sqlite3.connect(self.path, timeout=30)
+        try:
+            for batch in _batches(objects, BATCH_SIZE):
+                staging.executemany('''INSERT OR REPLACE INTO staged_objects
+                        (refresh, bucket, key, size, etag, last_modified, storage_class)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                        [(refresh_id,) + _to_row(bucket, x) for x in batch])
+                # Committed per batch, so other writers aren't blocked
+                staging.commit()
+                count += len(batch)
+        except BaseException:
+            staging.rollback()
+            staging.execute('DELETE FROM staged_objects WHERE refresh=?', (refresh_id,))
+            staging.commit()
+            raise
+        finally:
+            staging.close()
+        return count
+
+    def last_key(self, bucket, prefix):
+        """Returns the greatest indexed key under prefix, or None."""
+        where, args = _range_clause(bucket, prefix)
+        with self._lock:
+            row = self._connect().execute(
+                    'SELECT MAX(key) FROM objects WHERE ' + where, args).fetchone()
+        return row[0]
+
+    def iter_pages(self, bucket, prefix):
+        """Yields pages of indexed objects under prefix in key order.
+
+        Objects have the same fields list_objects_v2 returns.
+        """
+        where, args = _range_clause(bucket, prefix)
+        last = None
+        while True:
+            with self._lock:
+                if last is None:
+                    rows = self._connect().execute('''SELECT key, size, etag,
+                            last_modified, storage_class FROM objects WHERE '''
+                            + where + ' ORDER BY key LIMIT ?', args + (BATCH_SIZE,)).fetchall()
+                else:
+                    rows = self._connect().execute('''SELECT key, size, etag,
+                            last_modified, storage_class FROM objects WHERE '''
+                            + where + ' AND key > ? ORDER BY key LIMIT ?',
+                            args + (last, BATCH_SIZE)).fetchall()
+            if len(rows) > 0:
+                yield [_from_row(row) for row in rows]
+            if len(rows) < BATCH_SIZE:
+                return
+            last = rows[-1][0]
+
+    def usage(self, bucket, prefix):
+        """Returns (number of objects, total bytes) under prefix."""
+        where, args = _range_clause(bucket, prefix)
+        with self._lock:
+            row = self._connect().execute(
+                    'SELECT COUNT(*), TOTAL(size) FROM objects WHERE ' + where,
+                    args).fetchone()
+        return row[0], int(row[1])
+
+    def directory_list(self, bucket, prefix, delimiter='/'):
+        """Lists 'directories' and keys directly under prefix.
+
+        Skips over each directory with one indexed lookup, so the cost
+        depends on the number of entries returned rather than the number of
+        objects below prefix.
+
+        Returns:
+            (tuple) : (list of common prefixes, list of keys)
+        """
+        where, args = _range_clause(bucket, prefix)
+        prefixes = []
+        keys = []
+        start = prefix
+        with self._lock:
+            conn = self._connect()
+            while True:
+                row = conn.execute('SELECT key FROM objects WHERE ' + where
+                        + ' AND key >= ? ORDER BY key LIMIT 1', args + (start,)).fetchone()
+                if row is None:
+                    return prefixes, keys
+                key = row[0]
+                end = key.find(delimiter, len(prefix))
+                if end < 0:
+                    keys.append(key)
+                    start = key + '\0'
+                else:
+                    common_prefix = key[:end + len(delimiter)]
+                    prefixes.append(common_prefix)
+                    start = _successor(common_prefix)
+
+    def clear(self, bucket=None):
+        """Removes all entries, or all entries of bucket."""
+        with self._lock:
+            conn = self._connect()
+            if bucket is None:
+                conn.execute('DELETE FROM objects')
+                conn.execute('DELETE FROM snapshots')
+                # Left behind by refreshes that were killed
+                conn.execute('DELETE FROM staged_objects')
+            else:
+                conn.execute('DELETE FROM objects WHERE bucket=?', (bucket,))
+                conn.execute('DELETE FROM snapshots WHERE bucket=?', (bucket,))
+            conn.commit()
+
+    def __getstate__(self):
+        # Connections can't be pickled, worker processes reconnect
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+def _successor(prefix):
+    """Returns the smallest string greater than every string starting with prefix.
+
+    sqlite compares text as UTF-8 bytes, the same order as S3 keys, and
+    UTF-8 preserves code point order.
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _range_clause(bucket, prefix):
+    """Returns a WHERE clause and its arguments matching keys under prefix."""
+    if prefix == '':
+        return 'bucket=?', (bucket,)
+    return 'bucket=? AND key >= ? AND key < ?', (bucket, prefix, _successor(prefix))
+
+def _to_row(bucket, _object):
+    last_modified = _object.get('LastModified')
+    if isinstance(last_modified, datetime.datetime):
+        last_modified = last_modified.isoformat()
+    return (bucket, _object['Key'], _object.get('Size', 0), _object.get('ETag'),
+            last_modified, _object.get('StorageClass'))
+
+def _from_row(row):
+    _object = {'Key' : row[0], 'Size' : row[1]}
+    if row[2] is not None:
+        _object['ETag'] = row[2]
+    if row[3] is not None:
+        try:
+            _object['LastModified'] = datetime.datetime.fromisoformat(row[3])
+        except ValueError:
+            _object['LastModified'] = row[3]
+    if row[4] is not None:
+        _object['StorageClass'] = row[4]
+    return _object
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
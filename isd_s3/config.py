@@ -2,9 +2,8 @@
 
 import sys
 import os
+import re
 import logging
-from pathlib import Path
-from logging.handlers import RotatingFileHandler
 try:
     from configparser import ConfigParser, ExtendedInterpolation
 except:
@@ -15,6 +14,58 @@ logger = logging.getLogger(__name__)
 ISD_S3_DEFAULT_BUCKET = 'ISD_S3_DEFAULT_BUCKET'
 AWS_SHARED_CREDENTIALS_FILE = 'AWS_SHARED_CREDENTIALS_FILE'
 S3_URL = 'S3_URL'
+ISD_S3_ETAG_CACHE = 'ISD_S3_ETAG_CACHE'
+ISD_S3_INDEX = 'ISD_S3_INDEX'
+ISD_S3_BATCH_WORKERS = 'ISD_S3_BATCH_WORKERS'
+ISD_S3_SOCKET = 'ISD_S3_SOCKET'
+
+# Commands of a json batch run at the same time
+DEFAULT_BATCH_WORKERS = 8
+
+def _parse_bool(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+# Client options settable in isd_s3.ini, with their environment variable and type
+CLIENT_OPTIONS = {
+        'max_pool_connections' : ('ISD_S3_MAX_POOL_CONNECTIONS', int),
+        'max_attempts' : ('ISD_S3_MAX_ATTEMPTS', int),
+        'retry_mode' : ('ISD_S3_RETRY_MODE', str),
+        'connect_timeout' : ('ISD_S3_CONNECT_TIMEOUT', float),
+        'read_timeout' : ('ISD_S3_READ_TIMEOUT', float),
+        'tcp_keepalive' : ('ISD_S3_TCP_KEEPALIVE', _parse_bool),
+        }
+
+def parse_size(size):
+    """Parses a number of bytes, optionally with a unit.
+
+    KB, MB, GB and TB are powers of 1000, KiB, MiB, GiB and TiB powers of 1024.
+
+    Example:
+        '64MiB' yields 67108864
+    """
+    match = re.match(r'^\s*(\d+)\s*(?:([KMGT])(i?)B?)?\s*$', str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError('Invalid size: {}'.format(size))
+    number, unit, binary = match.groups()
+    if unit is None:
+        return int(number)
+    base = 1024 if binary else 1000
+    return int(number) * base ** ('KMGT'.index(unit.upper()) + 1)
+
+# Transfer options settable in isd_s3.ini, with their environment variable and type
+TRANSFER_OPTIONS = {
+        'multipart_chunksize' : ('ISD_S3_MULTIPART_CHUNKSIZE', parse_size),
+        'max_transfer_concurrency' : ('ISD_S3_MAX_TRANSFER_CONCURRENCY', int),
+        'adaptive_transfers' : ('ISD_S3_ADAPTIVE_TRANSFERS', _parse_bool),
+        }
+
+# Retry options settable in isd_s3.ini, with their environment variable and type
+RETRY_OPTIONS = {
+        'retry_attempts' : ('ISD_S3_RETRY_ATTEMPTS', int),
+        'retry_budget' : ('ISD_S3_RETRY_BUDGET', int),
+        'retry_base_delay' : ('ISD_S3_RETRY_BASE_DELAY', float),
+        'retry_max_delay' : ('ISD_S3_RETRY_MAX_DELAY', float),
+        }
 
 def read_config_parser(filename):
     """Get configuration parser."""
@@ -44,7 +95,7 @@ def configure_environment_from_file(ini_file=None):
         ini_file (str): ini configuration file.
     """
     if ini_file is None:
-        home = str(Path.home())
+        home = os.path.expanduser("~")
         ini_file = os.path.join(home,'.aws','isd_s3.ini')
     _cfg = read_config_parser(ini_file)
 
@@ -52,8 +103,22 @@ def configure_environment_from_file(ini_file=None):
     s3_url = _cfg.get('default', 's3_url')
     credentials = _cfg.get('default', 'credentials')
     default_bucket = _cfg.get('default', 'bucket')
+    etag_cache = _cfg.get('default', 'etag_cache', fallback=None)
+    index = _cfg.get('default', 'index', fallback=None)
+    batch_workers = _cfg.get('default', 'batch_workers', fallback=None)
+    socket_file = _cfg.get('default', 'socket', fallback=None)
 
     configure_environment(s3_url, credentials, default_bucket)
+    set_etag_cache_file(etag_cache)
+    set_index_file(index)
+    set_batch_workers(batch_workers)
+    set_socket_file(socket_file)
+    for option in CLIENT_OPTIONS:
+        set_client_option(option, _cfg.get('default', option, fallback=None))
+    for option in TRANSFER_OPTIONS:
+        set_transfer_option(option, _cfg.get('default', option, fallback=None))
+    for option in RETRY_OPTIONS:
+        set_retry_option(option, _cfg.get('default', option, fallback=None))
 
 
 def configure_environment(s3_url, credentials, default_bucket):
@@ -80,6 +145,43 @@ def set_default_bucket(default_bucket):
         os.environ[ISD_S3_DEFAULT_BUCKET] = remove_trailing_slash(default_bucket)
         logger.info('Default bucket set to {}'.format(default_bucket))
 
+def set_etag_cache_file(etag_cache):
+    if etag_cache is not None:
+        os.environ[ISD_S3_ETAG_CACHE] = etag_cache
+        logger.info('ETag cache file set to {}'.format(etag_cache))
+
+def set_index_file(index):
+    if index is not None:
+        os.environ[ISD_S3_INDEX] = index
+        logger.info('Bucket index file set to {}'.format(index))
+
+def set_batch_workers(batch_workers):
+    if batch_workers is not None:
+        os.environ[ISD_S3_BATCH_WORKERS] = str(batch_workers)
+        logger.info('Batch workers set to {}'.format(batch_workers))
+
+def set_socket_file(socket_file):
+    if socket_file is not None:
+        os.environ[ISD_S3_SOCKET] = socket_file
+        logger.info('Daemon socket set to {}'.format(socket_file))
+
+def set_client_option(option, value):
+    """Sets one of CLIENT_OPTIONS."""
+    _set_option(CLIENT_OPTIONS, option, value)
+
+def set_transfer_option(option, value):
+    """Sets one of TRANSFER_OPTIONS."""
+    _set_option(TRANSFER_OPTIONS, option, value)
+
+def set_retry_option(option, value):
+    """Sets one of RETRY_OPTIONS."""
+    _set_option(RETRY_OPTIONS, option, value)
+
+def _set_option(options, option, value):
+    if value is not None:
+        os.environ[options[option][0]] = str(value)
+        logger.info('{} set to {}'.format(option, value))
+
 def get_s3_url():
     if S3_URL in os.environ:
         return os.environ[S3_URL]
@@ -90,6 +192,81 @@ def get_credentials_file():
         return os.environ[AWS_SHARED_CREDENTIALS_FILE]
     return None
 
+def get_etag_cache_file():
+    """Returns the ETag cache file, or None if disabled with 'none'."""
+    if ISD_S3_ETAG_CACHE in os.environ:
+        etag_cache = os.environ[ISD_S3_ETAG_CACHE]
+        if etag_cache.lower() in ('', 'none'):
+            return None
+        return etag_cache
+    return os.path.join(os.path.expanduser("~"), '.cache', 'isd_s3', 'etag_cache.sqlite')
+
+def get_index_file():
+    """Returns the bucket index file, or None if disabled with 'none'."""
+    if ISD_S3_INDEX in os.environ:
+        index = os.environ[ISD_S3_INDEX]
+        if index.lower() in ('', 'none'):
+            return None
+        return index
+    return os.path.join(os.path.expanduser("~"), '.cache', 'isd_s3', 'bucket_index.sqlite')
+
+# Variables passed along with each forwarded command, or only read by the
+# daemon itself, see get_command_environment
+DAEMON_LOCAL_VARIABLES = (S3_URL, AWS_SHARED_CREDENTIALS_FILE, ISD_S3_DEFAULT_BUCKET,
+        ISD_S3_SOCKET, ISD_S3_BATCH_WORKERS)
+
+def is_command_variable(name):
+    """Whether an environment variable changes how a forwarded command runs."""
+    return name.startswith(('AWS_', 'ISD_S3_')) and name not in DAEMON_LOCAL_VARIABLES
+
+def get_command_environment():
+    """Returns the AWS_* and ISD_S3_* variables that change how commands run.
+
+    Commands are only forwarded to a daemon with the same ones, so they run
+    with the credentials and settings they would run with locally.
+    """
+    return {k : v for k, v in os.environ.items() if is_command_variable(k)}
+
+def get_socket_file():
+    """Returns the socket of the isd_s3 daemon, or None if disabled with 'none'."""
+    if ISD_S3_SOCKET in os.environ:
+        socket_file = os.environ[ISD_S3_SOCKET]
+        if socket_file.lower() in ('', 'none'):
+            return None
+        return socket_file
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir is None:
+        runtime_dir = os.path.join(os.path.expanduser("~"), '.cache', 'isd_s3')
+    return os.path.join(runtime_dir, 'isd_s3.sock')
+
+def get_batch_workers():
+    """Returns the number of commands of a json batch to run at the same time."""
+    if ISD_S3_BATCH_WORKERS in os.environ:
+        return int(os.environ[ISD_S3_BATCH_WORKERS])
+    return DEFAULT_BATCH_WORKERS
+
+def get_client_options():
+    """Returns the CLIENT_OPTIONS that are set, as a dict."""
+    return _get_options(CLIENT_OPTIONS)
+
+def get_transfer_options():
+    """Returns the TRANSFER_OPTIONS that are set, as a dict."""
+    return _get_options(TRANSFER_OPTIONS)
+
+def get_retry_options():
+    """Returns the RETRY_OPTIONS that are set, as a dict."""
+    return _get_options(RETRY_OPTIONS)
+
+def _get_options(available):
+    options = {}
+    for option, (env_var, _type) in available.items():
+        if env_var in os.environ:
+            try:
+                options[option] = _type(os.environ[env_var])
+            except ValueError:
+                logger.warning('Ignoring invalid {}: {}'.format(env_var, os.environ[env_var]))
+    return options
+
 def get_default_bucket():
     if ISD_S3_DEFAULT_BUCKET in os.environ:
         return os.environ[ISD_S3_DEFAULT_BUCKET]
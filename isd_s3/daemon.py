@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Serves isd_s3 commands over a Unix domain socket.
+
+`isd_s3 serve` keeps Sessions, with their clients, credentials and
+connection pools, warm between commands. The command line tool forwards
+commands to it when it is running, which saves interpreter startup, the
+boto3 import and a TLS handshake per call.
+
+A request is one line of json:
+
+    {"commands": [{"command": "gm", "--key": "ds084.1/file.nc"}], "cwd": "/data",
+     "env": {"AWS_PROFILE": "rda"}}
+
+Commands are dicts as understood by flatten_dict, or lists of command line
+arguments. Relative local paths are resolved against cwd. env holds the
+client's variables from config.get_command_environment. If it is given, the
+daemon first answers with the names of the variables it doesn't share,
+
+    {"environment": ["AWS_PROFILE"]}
+
+and only runs the commands if there are none. The client then runs them
+itself. The response is one line of json per command, see
+__main__.run_batch, sent as commands finish. The connection is closed
+after the last one.
+
+This module only handles the socket, so the client stays light. Running
+commands is up to the run function given to serve.
+
+Example usage:
+```
+$ isd_s3 serve &
+$ isd_s3 gm -k ds084.1/file.nc
+```
+"""
+
+import os
+import json
+import errno
+import signal
+import socket
+import logging
+import threading
+import socketserver
+
+if __package__ is None or __package__ == "":
+    import config
+else:
+    from . import config
+
+logger = logging.getLogger(__name__)
+
+# Seconds a client waits to connect
+CONNECT_TIMEOUT = 1
+
+class EnvironmentMismatch(OSError):
+    """The daemon runs with other credentials or settings than the client."""
+
+def request(commands, cwd=None, socket_file=None, env=None):
+    """Sends commands to a running daemon.
+
+    Connects and checks the daemon's environment before returning, so a
+    missing or differently configured daemon raises right away and the
+    caller can run the commands itself.
+
+    Args:
+        commands (list): Command dicts or argument lists.
+        cwd (str): Directory relative local paths are resolved against.
+                   Default the current directory.
+        socket_file (str): Socket of the daemon.
+                           Default config.get_socket_file
+        env (dict): Variables the daemon must share.
+                    Default config.get_command_environment
+
+    Returns:
+        (generator) : status dict per command, as they finish.
+
+    Raises:
+        OSError: if no daemon is listening on socket_file.
+        EnvironmentMismatch: if the daemon doesn't share env.
+    """
+    if socket_file is None:
+        socket_file = config.get_socket_file()
+    if env is None:
+        env = config.get_command_environment()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    response = None
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(socket_file)
+        sock.settimeout(None)
+        message = {'commands' : commands, 'cwd' : cwd or os.getcwd(), 'env' : env}
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        response = sock.makefile('rb')
+        line = response.readline()
+        if line == b'':
+            raise OSError(errno.ECONNRESET, 'isd_s3 daemon closed the connection', socket_file)
+        reply = json.loads(line)
+        if reply.get('environment'):
+            raise EnvironmentMismatch(errno.EINVAL, 'isd_s3 daemon has other values of '
+                    + ', '.join(reply['environment']), socket_file)
+    except BaseException:
+        if response is not None:
+            response.close()
+        sock.close()
+        raise
+    # Invalid requests are answered with an error status instead
+    return _read_statuses(sock, response, [] if 'environment' in reply else [reply])
+
+def _read_statuses(sock, response, statuses):
+    with sock, response:
+        yield from statuses
+        for line in response:
+            yield json.loads(line)
+
+def is_running(socket_file):
+    """Returns whether a daemon is listening on socket_file."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(socket_file)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if line == b'':
+            # is_running probes without sending a request
+            return
+        try:
+            message = json.loads(line)
+            commands = message['commands']
+            cwd = message.get('cwd')
+            env = message.get('env')
+            if not isinstance(commands, list):
+                raise ValueError('commands is not a list')
+            if env is not None and not isinstance(env, dict):
+                raise ValueError('env is not a dict')
+        except (ValueError, KeyError, TypeError) as e:
+            self._send({'index' : None, 'command' : None, 'status' : 'error',
+                    'error' : 'Invalid request: {}'.format(e)})
+            return
+        if env is not None:
+            differences = _environment_differences(env)
+            self._send({'environment' : differences})
+            if len(differences) > 0:
+                logger.info('Not running commands from {}, environment differs: {}'.format(
+                        cwd, ', '.join(differences)))
+                return
+        logger.debug('Running {} commands from {}'.format(len(commands), cwd))
+        try:
+            for status in self.server.run(commands, cwd):
+                self._send(status)
+        except BrokenPipeError:
+            logger.info('Client disconnected before all results were sent')
+
+    def _send(self, status):
+        self.wfile.write(json.dumps(status, default=lambda x: x.__str__()).encode() + b'\n')
+        self.wfile.flush()
+
+def _environment_differences(env):
+    """Returns the names of variables of env the daemon doesn't share."""
+    own = config.get_command_environment()
+    env = {k : v for k, v in env.items() if config.is_command_variable(k)}
+    return sorted(k for k in set(own) | set(env) if own.get(k) != env.get(k))
+
+def serve(run, socket_file):
+    """Serves requests until interrupted.
+
+    The socket is only accessible to the user running the daemon, since
+    commands run with the daemon's credentials.
+
+    Args:
+        run (function): Called with (commands, cwd) for each request,
+                        returns an iterable of status dicts.
+        socket_file (str): Socket to listen on. Parent directories are
+                           created. A stale socket file is replaced.
+
+    Raises:
+        OSError: if another daemon is listening on socket_file.
+    """
+    if is_running(socket_file):
+        raise OSError(errno.EADDRINUSE, 'isd_s3 daemon already running', socket_file)
+    directory = os.path.dirname(socket_file)
+    if directory != '':
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    if os.path.exists(socket_file):
+        os.remove(socket_file)
+
+    umask = os.umask(0o177)
+    try:
+        server = _Server(socket_file, _Handler)
+    finally:
+        os.umask(umask)
+    server.run = run
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _interrupt)
+    logger.info('Serving on {}'.format(socket_file))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_file)
+        logger.info('Stopped serving on {}'.format(socket_file))
+
+def _interrupt(signum, frame):
+    # Stops serve_forever like ctrl-c, so the socket file is removed
+    raise KeyboardInterrupt
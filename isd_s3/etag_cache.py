@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Persistent cache of ETags and md5s computed for local files.
+
+Entries are keyed by path and only used while the file's device, inode,
+size and mtime (ns) still match, so an unchanged file costs one stat.
+The cache is only an optimization: sqlite errors are logged and treated
+as misses.
+
+Example usage:
+```
+>>> from isd_s3 import etag_cache
+>>> cache = etag_cache.ETagCache('/tmp/etag_cache.sqlite')
+>>> cache.get('file.nc', chunk_size=1024*1024*25)
+```
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1000000
+# Files modified this recently may still be written to, so are not cached
+MIN_AGE_SECONDS = 2
+# Number of writes between checks of the entry cap
+EVICTION_INTERVAL = 1000
+# Hits only refresh an entry's last use after this many seconds, sparing writes
+LAST_USED_RESOLUTION = 3600
+
+class ETagCache(object):
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        """ETagCache constructor
+
+        Args:
+            path (str): sqlite file. Parent directories are created.
+            max_entries (int): Least recently used entries are evicted above
+                               this number of entries.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def _connect(self):
+        """Returns a connection, reconnecting in forked processes."""
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        directory = os.path.dirname(self.path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS etags (
+                path TEXT NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                etag TEXT,
+                md5 TEXT,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (path, chunk_size))''')
+        conn.execute('CREATE INDEX IF NOT EXISTS etags_last_used ON etags (last_used)')
+        conn.commit()
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def get(self, local_file, chunk_size, stat=None):
+        """Returns cached hashes of local_file.
+
+        Args:
+            local_file (str): Filename of local file.
+            chunk_size (int): Part size the ETag was computed with.
+            stat (os.stat_result): stat of local_file, if already known.
+
+        Returns:
+            (dict) : {'etag': str or None, 'md5': str or None}, or None if
+                     there is no valid entry.
+        """
+        path = os.path.abspath(local_file)
+        if stat is None:
+            stat = os.stat(path)
+        try:
+            return self._get(path, chunk_size, stat)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning('ETag cache {} unavailable: {}'.format(self.path, e))
+            return None
+
+    def _get(self, path, chunk_size, stat):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('''SELECT etag, md5, last_used FROM etags
+                    WHERE path=? AND chunk_size=? AND device=? AND inode=?
+                    AND size=? AND mtime_ns=?''',
+                    (path, chunk_size) + _stat_key(stat)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[2] < LAST_USED_RESOLUTION:
+                return {'etag' : row[0], 'md5' : row[1]}
+            conn.execute('UPDATE etags SET last_used=? WHERE path=? AND chunk_size=?',
+                    (time.time(), path, chunk_size))
+            conn.commit()
+        return {'etag' : row[0], 'md5' : row[1]}
+
+    def put(self, local_file, chunk_size, stat, etag=None, md5=None):
+        """Stores hashes of local_file.
+
+        Nothing is stored if the file changed since stat was taken, or was
+        modified too recently to be trusted.
+
+        Args:
+            local_file (str): Filename of local file.
+            chunk_size (int): Part size the ETag was computed with.
+            stat (os.stat_result): stat of local_file taken before hashing.
+            etag (str): S3 ETag of the file.
+            md5 (str): hex md5 of the file.
+        """
+        path = os.path.abspath(local_file)
+        try:
+            current = os.stat(path)
+        except OSError:
+            return
+        if _stat_key(current) != _stat_key(stat):
+            return
+        if time.time() - stat.st_mtime < MIN_AGE_SECONDS:
+            return
+        try:
+            self._put(path, chunk_size, stat, etag, md5)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning('ETag cache {} unavailable: {}'.format(self.path, e))
+
+    def _put(self, path, chunk_size, stat, etag, md5):
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute('''SELECT etag, md5 FROM etags
+                    WHERE path=? AND chunk_size=? AND device=? AND inode=?
+                    AND size=? AND mtime_ns=?''',
+                    (path, chunk_size) + _stat_key(stat)).fetchone()
+            if old is not None:
+                etag = etag or old[0]
+                md5 = md5 or old[1]
+            conn.execute('''INSERT OR REPLACE INTO etags
+                    (path, chunk_size, device, inode, size, mtime_ns, etag, md5, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (path, chunk_size) + _stat_key(stat) + (etag, md5, time.time()))
+            conn.commit()
+            self._writes += 1
+            if self._writes % EVICTION_INTERVAL == 0:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        """Removes least recently used entries above max_entries."""
+        count = conn.execute('SELECT COUNT(*) FROM etags').fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        # Evict an extra tenth so this doesn't run on every write
+        excess += self.max_entries // 10
+        conn.execute('''DELETE FROM etags WHERE rowid IN
+                (SELECT rowid FROM etags ORDER BY last_used LIMIT ?)''', (excess,))
+        conn.commit()
+        logger.debug('Evicted {} entries from {}'.format(excess, self.path))
+
+    def get_etag(self, local_file, chunk_size, compute):
+        """Returns the ETag of local_file, calling compute on a miss.
+
+        Args:
+            local_file (str): Filename of local file.
+            chunk_size (int): Part size the ETag is computed with.
+            compute (func): called as compute(local_file, chunk_size).
+        """
+        stat = os.stat(local_file)
+        cached = self.get(local_file, chunk_size, stat)
+        if cached is not None and cached['etag'] is not None:
+            return cached['etag']
+        etag = compute(local_file, chunk_size)
+        self.put(local_file, chunk_size, stat, etag=etag)
+        return etag
+
+    def get_md5(self, local_file, compute):
+        """Returns the hex md5 of local_file, calling compute on a miss.
+
+        Args:
+            local_file (str): Filename of local file.
+            compute (func): called as compute(local_file).
+        """
+        path = os.path.abspath(local_file)
+        stat = os.stat(path)
+        try:
+            with self._lock:
+                row = self._connect().execute('''SELECT md5 FROM etags
+                        WHERE path=? AND device=? AND inode=? AND size=? AND mtime_ns=?
+                        AND md5 IS NOT NULL''', (path,) + _stat_key(stat)).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning('ETag cache {} unavailable: {}'.format(self.path, e))
+            row = None
+        if row is not None:
+            return row[0]
+        md5 = compute(local_file)
+        # md5s not found alongside an ETag are stored with chunk_size 0
+        self.put(local_file, 0, stat, md5=md5)
+        return md5
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM etags')
+            conn.commit()
+
+    def __getstate__(self):
+        # Connections can't be pickled, worker processes reconnect
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+def _stat_key(stat):
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
@@ -9,47 +9,247 @@ Example usage:
 ```
 """
 
-import pdb
 import sys
 import os
 import json
 import re
-import boto3
+import base64
+import hashlib
+import queue
+import time
+import threading
+import itertools
+import collections
+import botocore.exceptions
 import logging
-import multiprocessing
-import mimetypes
+import functools
+import contextlib
 
-from boto3.s3.transfer import TransferConfig
+# boto3 is imported where clients and transfer configs are created, so
+# importing this module, e.g. for the command line parser, stays fast.
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 if __package__ is None or __package__ == "":
     import config
+    from etag_cache import ETagCache
+    from metadata_cache import MetadataCache, DEFAULT_TTL
+    from bucket_index import BucketIndex
+    from key_patterns import glob_to_regex, regex_prefixes
+    from transfer_tuner import TransferTuner
+    from stats import SessionStats
+    from progress import Progress
+    from retry import RetryPolicy, RETRYABLE_CODES
 else:
     from . import config
+    from .etag_cache import ETagCache
+    from .metadata_cache import MetadataCache, DEFAULT_TTL
+    from .bucket_index import BucketIndex
+    from .key_patterns import glob_to_regex, regex_prefixes
+    from .transfer_tuner import TransferTuner
+    from .stats import SessionStats
+    from .progress import Progress
+    from .retry import RetryPolicy, RETRYABLE_CODES
 
 logger = logging.getLogger(__name__)
 
+# Clients shared by Sessions, see Session.get_session
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Characters probed when sampling split points of a flat prefix
+KEY_SAMPLE_ALPHABET = '-./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+# Key ranges created per listing thread, so uneven ranges balance out
+SHARDS_PER_WORKER = 4
+# Pages each listing thread may buffer ahead of the consumer
+LISTING_PAGE_BUFFER = 4
+# Maximum number of keys accepted by a single DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+# Default number of concurrent requests for bulk operations
+DEFAULT_CONCURRENCY = 8
+# Tasks queued per bulk worker, bounding memory for large file lists
+TASKS_PER_WORKER = 2
+# Part size of multipart uploads, also used to calculate ETags
+MULTIPART_CHUNKSIZE = 1024*1024*25
+# Parts of a single upload or download in flight at once
+MAX_TRANSFER_CONCURRENCY = 10
+# Objects at least this large are downloaded as resumable byte ranges
+RANGED_DOWNLOAD_THRESHOLD = MULTIPART_CHUNKSIZE * 4
+# Connections per client, enough for DEFAULT_CONCURRENCY multipart transfers
+DEFAULT_CLIENT_OPTIONS = {
+        'max_pool_connections' : DEFAULT_CONCURRENCY * MAX_TRANSFER_CONCURRENCY,
+        }
+# Read size when streaming a range into its file
+DOWNLOAD_BUFFER_SIZE = 1024*1024
+PARTIAL_DOWNLOAD_SUFFIX = '.isd_s3_part'
+# Largest object a single CopyObject request can copy
+MAX_COPY_OBJECT_SIZE = 1024*1024*1024*5
+# Most parts a multipart upload can have
+MAX_PARTS = 10000
+# Headers of an object kept when its metadata is replaced on copy
+CONTENT_HEADERS = ('ContentType', 'ContentEncoding', 'CacheControl', 'ContentDisposition',
+        'ContentLanguage', 'Expires')
+# Smallest part S3 accepts, except for the last part
+MIN_PART_SIZE = 1024*1024*5
+DOWNLOAD_JOURNAL_SUFFIX = '.isd_s3_journal'
+# Units understood by parse_block_size
+BLOCK_SIZE_UNITS = {
+        'KB' : 1000,
+        'MB' : 1000000,
+        'GB' : 1000000000,
+        'TB' : 1000000000000,
+        }
+
 class Session(object):
 
-    def __init__(self, endpoint_url=None, credentials_loc=None, default_bucket=None, verify=True):
+    def __init__(self, endpoint_url=None, credentials_loc=None, default_bucket=None, verify=True, etag_cache=None, metadata_cache_size=0, metadata_cache_ttl=DEFAULT_TTL, bucket_index=None, client_config=None, max_pool_connections=None, max_attempts=None, retry_mode=None, connect_timeout=None, read_timeout=None, tcp_keepalive=None, multipart_chunksize=None, max_transfer_concurrency=None, adaptive_transfers=None, stats=False, progress=None, retry_attempts=None, retry_budget=None, retry_base_delay=None, retry_max_delay=None, shared_client=True):
         """Session constructor
 
         Args:
             endpoint_url (str): The s3 url to connect to.
             credentials_loc (str): location of the credentials file.
-                                   (default: ~/.aws/credentials)
+                                   Used by this Session only.
+                                   (default: AWS_SHARED_CREDENTIALS_FILE or
+                                   ~/.aws/credentials)
             default_bucket (str): bucket to use if not specified explicitly.
+            etag_cache (str, bool): sqlite file caching hashes of local files.
+                                    False disables the cache.
+                                    (default: ISD_S3_ETAG_CACHE or
+                                    ~/.cache/isd_s3/etag_cache.sqlite)
+            metadata_cache_size (int): Number of get_metadata results to cache.
+                                       Default 0 (no cache)
+            metadata_cache_ttl (float): Seconds a cached result is used for.
+            bucket_index (str, bool): sqlite file indexing bucket listings.
+                                      False disables the index.
+                                      (default: ISD_S3_INDEX or
+                                      ~/.cache/isd_s3/bucket_index.sqlite)
+            client_config (botocore.config.Config): Advanced client
+                                                    configuration. Clients
+                                                    with one are not shared.
+            max_pool_connections (int): Most open connections of the client.
+                                        (default: DEFAULT_MAX_POOL_CONNECTIONS)
+            max_attempts (int): Attempts per request, including the first.
+            retry_mode (str): botocore retry mode, 'legacy', 'standard' or
+                              'adaptive'.
+            connect_timeout (float): Seconds to wait for a connection.
+            read_timeout (float): Seconds to wait for a response.
+            tcp_keepalive (bool): Send TCP keepalive probes on idle connections.
+            multipart_chunksize (int): Part size of multipart transfers.
+                                       Raised for files that would need
+                                       more than MAX_PARTS parts.
+                                       (default: MULTIPART_CHUNKSIZE)
+            max_transfer_concurrency (int): Most parts of a file transferred
+                                            at once.
+                                            (default: MAX_TRANSFER_CONCURRENCY)
+            adaptive_transfers (bool): Tune the parts transferred at once
+                                       from measured throughput. Default False
+            stats (bool): Count requests and time local operations in
+                          self.stats, see stats.SessionStats. The client
+                          isn't shared then. Requests of worker processes
+                          aren't counted. Default False
+            progress (progress.Progress, func): Receives progress of
+                                                transfers. A function is
+                                                called with each event,
+                                                see progress.Progress.
+            retry_attempts (int): Attempts per request after botocore's own
+                                  retries gave up, including the first.
+                                  (default: retry.DEFAULT_ATTEMPTS)
+            retry_budget (int): Retries per operation, shared by all its
+                                requests. (default: retry.DEFAULT_BUDGET)
+            retry_base_delay (float): Seconds the first retry waits at most,
+                                      doubled for each further retry.
+            retry_max_delay (float): Most seconds a retry waits.
+            shared_client (bool): Use the client shared by Sessions with the
+                                  same endpoint, credentials, verify and
+                                  client options. False gives this Session
+                                  a client of its own. Default True
+
+        Client, transfer and retry options not given are read from
+        isd_s3.ini or the environment, see config.CLIENT_OPTIONS,
+        config.TRANSFER_OPTIONS and config.RETRY_OPTIONS. Sessions with the same endpoint,
+        credentials, verify and client options share one client.
         """
 
 
-        config.configure_environment(endpoint_url, credentials_loc, default_bucket)
-        self.client = self.get_session(verify=verify)
-
-    def get_session(self, endpoint_url=None, verify=True):
+        config.set_s3_url(endpoint_url)
+        config.set_default_bucket(default_bucket)
+        self.endpoint_url = config.get_s3_url()
+        # Kept out of the environment, where it would outlive this Session
+        self.credentials_file = credentials_loc or config.get_credentials_file()
+        self.verify = verify
+        self.client_options = config.get_client_options()
+        for option, value in (('max_pool_connections', max_pool_connections),
+                ('max_attempts', max_attempts), ('retry_mode', retry_mode),
+                ('connect_timeout', connect_timeout), ('read_timeout', read_timeout),
+                ('tcp_keepalive', tcp_keepalive)):
+            if value is not None:
+                self.client_options[option] = value
+        self.stats = SessionStats() if stats else None
+        self.client = self.get_session(endpoint_url=endpoint_url, verify=verify,
+                client_config=client_config, client_options=self.client_options,
+                shared=shared_client and self.stats is None, credentials_file=self.credentials_file)
+        if self.stats is not None:
+            self.stats.register(self.client.meta.events)
+
+        self.transfer_options = config.get_transfer_options()
+        for option, value in (('multipart_chunksize', multipart_chunksize),
+                ('max_transfer_concurrency', max_transfer_concurrency),
+                ('adaptive_transfers', adaptive_transfers)):
+            if value is not None:
+                self.transfer_options[option] = value
+        self.multipart_chunksize = self.transfer_options.get('multipart_chunksize', MULTIPART_CHUNKSIZE)
+        if self.multipart_chunksize < MIN_PART_SIZE:
+            logger.warning('multipart_chunksize raised to the minimum part size, {}'.format(MIN_PART_SIZE))
+            self.multipart_chunksize = MIN_PART_SIZE
+        self.max_transfer_concurrency = max(1, self.transfer_options.get(
+                'max_transfer_concurrency', MAX_TRANSFER_CONCURRENCY))
+        self.transfer_tuner = None
+        if self.transfer_options.get('adaptive_transfers'):
+            self.transfer_tuner = TransferTuner(self.max_transfer_concurrency)
+
+        self.retry_options = config.get_retry_options()
+        for option, value in (('retry_attempts', retry_attempts), ('retry_budget', retry_budget),
+                ('retry_base_delay', retry_base_delay), ('retry_max_delay', retry_max_delay)):
+            if value is not None:
+                self.retry_options[option] = value
+        self.retry_policy = RetryPolicy(**dict((option[len('retry_'):], value)
+                for option, value in self.retry_options.items()))
+
+        self.progress = progress
+        if progress is not None and not isinstance(progress, Progress):
+            self.progress = Progress(progress)
+
+        if etag_cache is None:
+            etag_cache = config.get_etag_cache_file()
+        self.etag_cache = None
+        if etag_cache:
+            self.etag_cache = ETagCache(etag_cache)
+
+        self.metadata_cache = None
+        if metadata_cache_size > 0:
+            self.metadata_cache = MetadataCache(metadata_cache_size, metadata_cache_ttl)
+
+        if bucket_index is None:
+            bucket_index = config.get_index_file()
+        self.bucket_index = None
+        if bucket_index:
+            self.bucket_index = BucketIndex(bucket_index)
+
+    def get_session(self, endpoint_url=None, verify=True, client_config=None, client_options=None, shared=True, credentials_file=None):
         """Gets a boto3 session client.
         This should generally be executed after module load.
 
+        Clients are cached per process, endpoint, credentials, verify and
+        client options, and are safe to share between threads.
+
         Args:
             use_local_cred (bool): Use personal credentials for session. Default False.
             endpoint_url: url to s3. Default https://s3.amazonaws.com/
+            client_config (botocore.config.Config): Advanced client configuration.
+                                                    The client is not cached.
+            client_options (dict): config.CLIENT_OPTIONS values.
+            shared (bool): Use the cached client. False creates a new one.
+            credentials_file (str): Shared credentials file. Default
+                                    AWS_SHARED_CREDENTIALS_FILE, or
+                                    ~/.aws/credentials
 
         Returns:
             (botocore.client.S3): botocore client object
@@ -64,21 +264,35 @@ class Session(object):
             endpoint_url = s3_url
 
 
-        session = boto3.session.Session()
+        options = dict(DEFAULT_CLIENT_OPTIONS)
+        options.update(client_options or {})
+        client_args = {
+                'service_name' : 's3',
+                'verify' : verify,
+                'config' : get_client_config(options, client_config)
+                }
         s3_protocol_identifier = 's3://'
         if endpoint_url.startswith(s3_protocol_identifier):
             bucket = endpoint_url.split(s3_protocol_identifier)[1]
             config.set_default_bucket(bucket)
-            return session.client(
-                    service_name='s3',
-                    verify=verify
-                    )
-
-        return session.client(
-                service_name='s3',
-                endpoint_url=endpoint_url,
-                verify=verify
-                )
+            endpoint_url = None
+        else:
+            client_args['endpoint_url'] = endpoint_url
+
+        if credentials_file is None:
+            credentials_file = config.get_credentials_file()
+        if client_config is not None or not shared:
+            return _new_boto3_session(credentials_file).client(**client_args)
+        cache_key = (os.getpid(), endpoint_url, verify, credentials_file,
+                os.environ.get('AWS_PROFILE'), os.environ.get('AWS_ACCESS_KEY_ID'),
+                tuple(sorted(options.items())))
+        with _clients_lock:
+            client = _clients.get(cache_key)
+            if client is None:
+                # boto3 sessions aren't thread safe, so clients are created under the lock
+                client = _new_boto3_session(credentials_file).client(**client_args)
+                _clients[cache_key] = client
+        return client
 
     def list_buckets(self, buckets_only=False):
         """Lists all buckets.
@@ -110,7 +324,7 @@ class Session(object):
         return env_bucket
 
 
-    def directory_list(self, bucket=None, prefix="", ls=False, keys_only=False):
+    def directory_list(self, bucket=None, prefix="", ls=False, keys_only=False, max_age=None):
         """Lists directories using a prefix, similar to POSIX ls
 
         Args:
@@ -118,8 +332,16 @@ class Session(object):
             prefix (str): Prefix from which to filter.
             ls (bool): Defaut False
             keys_only (bool): Only return the keys.  Default False.
+            max_age (float): Answer from the bucket index if it was refreshed
+                             within this many seconds, refreshing it first
+                             otherwise. Default None (list the bucket)
         """
         bucket = self.get_bucket(bucket)
+        if self._use_index(bucket, prefix, max_age):
+            prefixes, keys = self.bucket_index.directory_list(bucket, prefix)
+            if len(prefixes) > 0:
+                return prefixes
+            return keys
         response = self.client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/')
 
         if 'CommonPrefixes' in response:
@@ -130,31 +352,101 @@ class Session(object):
 
 
 
-    def disk_usage(bucket=None, prefix="",regex=None,block_size='1MB'):
+    def disk_usage(self, bucket=None, prefix="", regex=None, block_size='1MB', parallelism=1, max_age=None, depth=0, human_readable=False, glob=None):
         """Returns the disk usage for a set of objects.
 
+        Sizes are added up while listing, so memory does not grow with the
+        number of objects.
+
         Args:
             bucket (str) [REQUIRED]: Name of s3 bucket.
             prefix (str): Prefix from which to filter.
             regex (str): regex string.  Default None
+            glob (str): glob matching whole keys. See iter_objects.
             block_size (str): block size
-
-        Returns (dict): disk usage of objects>
+            parallelism (int): Number of key ranges to list and add up
+                               concurrently. Default 1
+            max_age (float): Answer from the bucket index if it was refreshed
+                             within this many seconds. See iter_objects.
+            depth (int): Also break usage down by the first depth '/'
+                         separated key components after prefix. Default 0
+            human_readable (bool): Report sizes as strings in the largest
+                                   fitting unit (e.g. '1.5GB') instead of
+                                   block_size units. Default False
+
+        Returns (dict): {'disk_usage': size, 'units': block_size, 'objects': count},
+                        plus 'prefixes' mapping each breakdown prefix to
+                        the same fields if depth > 0.
 
         """
         bucket = self.get_bucket(bucket)
-
-        contents = self.list_objects(bucket, prefix, regex=regex)
-        total = 0
         divisor = parse_block_size(block_size)
-        for _object in contents:
-            total += _object['Size'] / divisor
-        return {'disk_usage':total,'units':block_size}
+        regex = _pattern_regex(regex, glob)
 
-    def list_objects(self, bucket=None, prefix="", ls=False, keys_only=False, regex=None):
+        if self._use_index(bucket, prefix, max_age, parallelism):
+            if regex is None and depth == 0:
+                usage = {prefix : list(self.bucket_index.usage(bucket, prefix))}
+            else:
+                usage = self._sum_usage(self._iter_index_pages(bucket, prefix, regex),
+                        prefix, regex, depth)
+        elif self._listing_prefixes(prefix, regex) != [prefix]:
+            usage = self._sum_usage(self._iter_listing(bucket, prefix, regex, parallelism),
+                    prefix, regex, depth)
+        elif parallelism is not None and parallelism > 1:
+            usage = self._sum_usage_parallel(bucket, prefix, regex, depth, parallelism)
+        else:
+            usage = self._sum_usage(self._iter_range(bucket, prefix), prefix, regex, depth)
+
+        def result(counts):
+            if human_readable:
+                return {'disk_usage' : format_size(counts[1]), 'objects' : counts[0]}
+            return {'disk_usage' : counts[1] / divisor, 'units' : block_size, 'objects' : counts[0]}
+
+        total = result([sum(x[0] for x in usage.values()), sum(x[1] for x in usage.values())])
+        if depth > 0:
+            total['prefixes'] = {k : result(usage[k]) for k in sorted(usage)}
+        return total
+
+    def _sum_usage(self, pages, prefix, regex, depth):
+        """Adds up object counts and bytes of pages of objects.
+
+        Returns:
+            (dict) : [objects, bytes] by breakdown prefix. See _usage_group.
+        """
+        usage = collections.defaultdict(lambda: [0, 0])
+        objects = itertools.chain.from_iterable(pages)
+        if regex is not None:
+            objects = self.iter_regex_filter(objects, regex)
+        for _object in objects:
+            counts = usage[_usage_group(_object['Key'], prefix, depth)]
+            counts[0] += 1
+            counts[1] += _object['Size']
+        return usage
+
+    def _sum_usage_parallel(self, bucket, prefix, regex, depth, parallelism):
+        """Adds up usage of independent key ranges of prefix concurrently.
+
+        Unlike iter_objects, ranges don't need to come back in key order, so
+        every range is summed as soon as a thread is free.
+        """
+        usage = collections.defaultdict(lambda: [0, 0])
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            split_points = self._get_split_points(bucket, prefix, parallelism, pool)
+            bounds = [None] + split_points + [None]
+            logger.debug('Summing {} in {} key ranges'.format(prefix, len(bounds) - 1))
+            sum_range = lambda start_end: self._sum_usage(
+                    self._iter_range(bucket, prefix, *start_end), prefix, regex, depth)
+            for range_usage in pool.map(sum_range, zip(bounds[:-1], bounds[1:])):
+                for group, counts in range_usage.items():
+                    usage[group][0] += counts[0]
+                    usage[group][1] += counts[1]
+        return usage
+
+    def list_objects(self, bucket=None, prefix="", ls=False, keys_only=False, regex=None, parallelism=1, max_age=None, glob=None):
         """Lists objects from a bucket, optionally matching _prefix.
 
-        prefix should be heavily preferred.
+        prefix should be heavily preferred. See iter_objects to avoid
+        holding the whole listing in memory.
 
         Args:
             bucket (str): Name of s3 bucket.
@@ -162,6 +454,12 @@ class Session(object):
             ls (bool): Get 'directories'.
             keys_only (bool): Only return the keys.
             regex (str): regex string
+            glob (str): glob matching whole keys. See iter_objects.
+            parallelism (int): Number of key ranges to list concurrently.
+                               Values greater than 1 split prefix into
+                               independent key ranges. Default 1
+            max_age (float): Answer from the bucket index if it was refreshed
+                             within this many seconds. See iter_objects.
 
         Returns:
             (list) : list of objects in given bucket
@@ -171,26 +469,294 @@ class Session(object):
         if ls:
             #if len(prefix) > 0 and prefix[-1] != '/':
             #    prefix += '/'
-            return self.directory_list(bucket, prefix, keys_only)
-
-        contents = []
-
-        response = self.client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        if 'Contents' not in response:
-            return []
-        contents.extend(response['Contents'])
-        while response['IsTruncated']:
-            response = self.client.list_objects_v2(
-                    Bucket=bucket,
-                    Prefix=prefix,
-                    ContinuationToken=response['NextContinuationToken'])
-            contents.extend(response['Contents'])
-        if regex is not None:
-            contents = self.regex_filter(contents, regex)
-        if keys_only:
-            return list(map(lambda x: x['Key'], contents))
+            return self.directory_list(bucket, prefix, keys_only, max_age=max_age)
+
+        return list(self.iter_objects(bucket, prefix, regex=regex,
+                keys_only=keys_only, parallelism=parallelism, max_age=max_age, glob=glob))
+
+    def iter_objects(self, bucket=None, prefix="", regex=None, keys_only=False, limit=None, parallelism=1, max_age=None, glob=None):
+        """Yields objects from a bucket page by page, optionally matching prefix.
+
+        Only the prefixes a regex or glob can match are listed, see
+        key_patterns.regex_prefixes. Several such prefixes are listed
+        concurrently.
+
+        Args:
+            bucket (str): Name of s3 bucket.
+            prefix (str): Prefix from which to filter.
+            regex (str): regex string, matched from the start of keys.
+            glob (str): glob matching whole keys instead of regex,
+                        e.g. 'ds084.1/2019-*/*.nc'
+            keys_only (bool): Only yield the keys.
+            limit (int): Stop after this many objects. Default None
+            parallelism (int): Number of key ranges to list concurrently. Default 1
+            max_age (float): Answer from the bucket index if prefix was
+                             refreshed within this many seconds. Otherwise
+                             the index is refreshed first. Default None
+                             (list the bucket)
+
+        Returns:
+            (generator) : objects (or keys) in key order
+        """
+        bucket = self.get_bucket(bucket)
 
-        return contents
+        regex = _pattern_regex(regex, glob)
+
+        if self._use_index(bucket, prefix, max_age, parallelism):
+            pages = self._iter_index_pages(bucket, prefix, regex)
+        else:
+            pages = self._iter_listing(bucket, prefix, regex, parallelism)
+        try:
+            objects = itertools.chain.from_iterable(pages)
+            if regex is not None:
+                objects = self.iter_regex_filter(objects, regex)
+            if keys_only:
+                objects = map(lambda x: x['Key'], objects)
+            if limit is not None:
+                objects = itertools.islice(objects, limit)
+            for _object in objects:
+                yield _object
+        finally:
+            pages.close()
+
+    def _listing_prefixes(self, prefix, regex):
+        """Returns the prefixes to list for keys under prefix matching regex."""
+        if regex is None:
+            return [prefix]
+        prefixes = regex_prefixes(regex, prefix)
+        if prefixes != [prefix]:
+            logger.debug('Narrowed {} to {} prefixes using {}'.format(prefix, len(prefixes), regex))
+        return prefixes
+
+    def _iter_index_pages(self, bucket, prefix, regex=None):
+        """Yields pages of indexed objects under prefix that regex may match."""
+        for p in self._listing_prefixes(prefix, regex):
+            yield from self.bucket_index.iter_pages(bucket, p)
+
+    def _iter_listing(self, bucket, prefix, regex=None, parallelism=1):
+        """Yields pages of objects under prefix that regex may match, in key order."""
+        prefixes = self._listing_prefixes(prefix, regex)
+        if len(prefixes) == 1 and parallelism is not None and parallelism > 1:
+            return self._iter_pages_parallel(bucket, prefixes[0], parallelism)
+        if len(prefixes) == 1:
+            return self._iter_range(bucket, prefixes[0])
+        parallelism = max(parallelism or 1, min(len(prefixes), DEFAULT_CONCURRENCY))
+        return self._iter_ranges_parallel(bucket,
+                [(p, None, None) for p in prefixes], parallelism)
+
+    def iter_keys(self, bucket=None, prefix="", regex=None, limit=None, parallelism=1, **kwargs):
+        """Yields keys from a bucket. See iter_objects.
+
+        Other arguments, e.g. glob and max_age, are passed to iter_objects.
+        """
+        return self.iter_objects(bucket, prefix, regex=regex, keys_only=True,
+                limit=limit, parallelism=parallelism, **kwargs)
+
+    def refresh_index(self, prefix="", bucket=None, incremental=False, parallelism=1):
+        """Lists prefix into the bucket index.
+
+        Args:
+            prefix (str): Prefix to index. Refreshing a sub-prefix of an
+                          indexed prefix only lists the sub-prefix.
+            bucket (str): Name of s3 bucket.
+            incremental (bool): Only list keys after the last indexed key
+                                under prefix. This is only correct for
+                                prefixes whose objects are not changed or
+                                deleted, and whose new keys sort after
+                                existing ones (e.g. dated keys). Default False
+            parallelism (int): Number of key ranges to list concurrently. Default 1
+
+        Returns:
+            (dict) : {'bucket': str, 'prefix': str, 'indexed': number of
+                     objects listed}
+        """
+        bucket = self.get_bucket(bucket)
+        if self.bucket_index is None:
+            error_msg = 'Bucket index disabled'
+            logger.error(error_msg)
+            raise ISD_S3_Exception(error_msg)
+
+        start_after = None
+        if incremental and self.bucket_index.age(bucket, prefix) is not None:
+            start_after = self.bucket_index.last_key(bucket, prefix)
+        if start_after is not None:
+            pages = self._iter_range(bucket, prefix, start_after=start_after)
+        elif parallelism is not None and parallelism > 1:
+            pages = self._iter_pages_parallel(bucket, prefix, parallelism)
+        else:
+            pages = self._iter_range(bucket, prefix)
+        try:
+            count = self.bucket_index.refresh(bucket, prefix,
+                    itertools.chain.from_iterable(pages),
+                    incremental=start_after is not None)
+        finally:
+            pages.close()
+        logger.info('Indexed {} objects under {}/{}'.format(count, bucket, prefix))
+        return {'bucket' : bucket, 'prefix' : prefix, 'indexed' : count}
+
+    def _use_index(self, bucket, prefix, max_age, parallelism=1):
+        """Returns whether to answer from the bucket index, refreshing it if stale."""
+        if max_age is None or self.bucket_index is None:
+            return False
+        if not self.bucket_index.is_fresh(bucket, prefix, max_age):
+            self.refresh_index(prefix, bucket, parallelism=parallelism)
+        return True
+
+    def _iter_range(self, bucket, prefix, start_after=None, end_at=None):
+        """Yields pages of objects under prefix with start_after < key <= end_at.
+
+        Args:
+            bucket (str): Name of s3 bucket.
+            prefix (str): Prefix from which to filter.
+            start_after (str): Exclusive lower bound. None for no bound.
+            end_at (str): Inclusive upper bound. None for no bound.
+
+        Returns:
+            (generator) : lists of objects in key order
+        """
+        kwargs = {'Bucket' : bucket, 'Prefix' : prefix}
+        if start_after is not None:
+            kwargs['StartAfter'] = start_after
+        budget = self.retry_policy.new_budget()
+        while True:
+            # A failed page is requested again, continuing where the listing was
+            response = self.retry_policy.call(lambda: self.client.list_objects_v2(**kwargs),
+                    budget, 'listing of ' + prefix)
+            contents = response.get('Contents', [])
+            if end_at is not None and len(contents) > 0 and contents[-1]['Key'] > end_at:
+                yield [x for x in contents if x['Key'] <= end_at]
+                return
+            if len(contents) > 0:
+                yield contents
+            if not response.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def _list_common_prefixes(self, bucket, prefix):
+        """Returns all 'directories' directly under prefix."""
+        prefixes = []
+        kwargs = {'Bucket' : bucket, 'Prefix' : prefix, 'Delimiter' : '/'}
+        budget = self.retry_policy.new_budget()
+        while True:
+            response = self.retry_policy.call(lambda: self.client.list_objects_v2(**kwargs),
+                    budget, 'listing of ' + prefix)
+            prefixes.extend(map(lambda x: x['Prefix'], response.get('CommonPrefixes', [])))
+            if not response.get('IsTruncated'):
+                return prefixes
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def _sample_split_points(self, bucket, prefix, pool):
+        """Finds existing keys to split a flat prefix on.
+
+        Probes the key after prefix + c for every character c in
+        KEY_SAMPLE_ALPHABET.
+        """
+        budget = self.retry_policy.new_budget()
+        def probe(start_after):
+            response = self.retry_policy.call(lambda: self.client.list_objects_v2(
+                    Bucket=bucket, Prefix=prefix, StartAfter=start_after, MaxKeys=1),
+                    budget, 'listing of ' + start_after)
+            contents = response.get('Contents', [])
+            if len(contents) == 0:
+                return None
+            return contents[0]['Key']
+
+        probes = [prefix + c for c in KEY_SAMPLE_ALPHABET]
+        found = set(pool.map(probe, probes))
+        found.discard(None)
+        return sorted(found)
+
+    def _get_split_points(self, bucket, prefix, parallelism, pool, max_depth=3):
+        """Finds keys that split prefix into roughly parallelism key ranges.
+
+        Uses delimiter fan-out over the first max_depth levels, then falls back
+        to sampling when the prefix is flat.
+
+        Returns:
+            (list) : sorted split points
+        """
+        target = parallelism * SHARDS_PER_WORKER
+        level = [prefix]
+        for _ in range(max_depth):
+            if len(level) >= target:
+                break
+            expanded = []
+            for children, parent in zip(pool.map(lambda p: self._list_common_prefixes(bucket, p), level), level):
+                expanded.extend(children if len(children) > 0 else [parent])
+            if expanded == level:
+                break
+            level = expanded
+
+        split_points = sorted(p for p in level if p > prefix)
+        if len(split_points) < parallelism:
+            split_points = sorted(set(split_points).union(
+                    self._sample_split_points(bucket, prefix, pool)))
+
+        if len(split_points) > target:
+            step = len(split_points) / target
+            split_points = [split_points[int(i * step)] for i in range(target)]
+        return split_points
+
+    def _iter_pages_parallel(self, bucket, prefix, parallelism):
+        """Yields pages of objects by splitting prefix into independent key ranges.
+
+        Ranges are listed concurrently on a pool of parallelism threads.
+        Only the next parallelism ranges are in flight, each buffering at
+        most LISTING_PAGE_BUFFER pages, so pages come back in key order
+        without holding the listing in memory.
+
+        Returns:
+            (generator) : lists of objects in key order
+        """
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            split_points = self._get_split_points(bucket, prefix, parallelism, pool)
+        bounds = [None] + split_points + [None]
+        logger.debug('Listing {} in {} key ranges'.format(prefix, len(bounds) - 1))
+        yield from self._iter_ranges_parallel(bucket,
+                [(prefix, start, end) for start, end in zip(bounds[:-1], bounds[1:])],
+                parallelism)
+
+    def _iter_ranges_parallel(self, bucket, ranges, parallelism):
+        """Yields pages of objects of sorted, non-overlapping key ranges.
+
+        Args:
+            bucket (str): Name of s3 bucket.
+            ranges (list): (prefix, start_after, end_at) tuples. See _iter_range.
+            parallelism (int): Number of ranges to list concurrently.
+
+        Returns:
+            (generator) : lists of objects in key order
+        """
+        stop = threading.Event()
+
+        def fill(page_queue, prefix, start, end):
+            try:
+                for page in self._iter_range(bucket, prefix, start, end):
+                    if not _put_unless_stopped(page_queue, page, stop):
+                        return
+            except Exception as e:
+                _put_unless_stopped(page_queue, e, stop)
+            _put_unless_stopped(page_queue, _END_OF_RANGE, stop)
+
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            try:
+                ranges = collections.deque(ranges)
+                in_flight = collections.deque()
+                while len(ranges) > 0 or len(in_flight) > 0:
+                    while len(ranges) > 0 and len(in_flight) < parallelism:
+                        page_queue = queue.Queue(maxsize=LISTING_PAGE_BUFFER)
+                        pool.submit(fill, page_queue, *ranges.popleft())
+                        in_flight.append(page_queue)
+                    page_queue = in_flight.popleft()
+                    while True:
+                        page = page_queue.get()
+                        if page is _END_OF_RANGE:
+                            break
+                        if isinstance(page, Exception):
+                            raise page
+                        yield page
+            finally:
+                stop.set()
 
     def regex_filter(self, contents, regex_str, exclude=0):
         """Filters contents using regular expression.
@@ -204,7 +770,20 @@ class Session(object):
             (list) Contents objects.
 
         """
-        filtered_objects = []
+        return list(self.iter_regex_filter(contents, regex_str, exclude))
+
+    def iter_regex_filter(self, contents, regex_str, exclude=0):
+        """Lazily filters contents using regular expression.
+
+        Args:
+            contents (iterable): response 'Contents' objects
+            regex_str (str): regular expression string
+            exclude (int): number of characters to exclude from start
+
+        Returns:
+            (generator) Contents objects.
+
+        """
         regex = re.compile(regex_str)
         for _object in contents:
             match_against = _object['Key']
@@ -212,9 +791,7 @@ class Session(object):
                 match_against = match_against[exclude:]
             match = regex.match(match_against)
             if match is not None:
-                filtered_objects.append(_object)
-
-        return filtered_objects
+                yield _object
 
     def get_metadata(self, key, bucket=None):
         """Gets metadata of a given object key.
@@ -228,7 +805,16 @@ class Session(object):
         """
         bucket = self.get_bucket(bucket)
 
-        return self.client.head_object(Bucket=bucket, Key=key)#['Metadata']
+        head = lambda: self.retry_policy.call(lambda: self.client.head_object(Bucket=bucket, Key=key),
+                description='HEAD of ' + key)
+        if self.metadata_cache is not None:
+            return self.metadata_cache.get(bucket, key, head)
+        return head()#['Metadata']
+
+    def _invalidate(self, bucket, key):
+        """Drops cached metadata of an object this Session changed."""
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(bucket, key)
 
     def replace_metadata(self, key, bucket=None, metadata=None):
         """Copies files to object store.
@@ -237,17 +823,24 @@ class Session(object):
             key (str): key of object to be replaced.
             bucket (str) : Name of s3 bucket.
             metadata (dict, str): dict or string representing key/value pairs.
+                                  Default None removes all metadata.
 
         Returns:
             None
         """
         bucket = self.get_bucket(bucket)
-        return self.copy_object(key, bucket, key, bucket, metadata)
+        if metadata is None:
+            metadata = {}
+        return self.copy_object(key, key, source_bucket=bucket, dest_bucket=bucket, metadata=metadata)
 
 
-    def move_object(self, source_key, dest_key, source_bucket=None, dest_bucket=None, metadata=None, dry_run=False):
+    def move_object(self, source_key, dest_key, source_bucket=None, dest_bucket=None, metadata=None, dry_run=False, workers=DEFAULT_CONCURRENCY, checkpoint=None):
         """Moves object to new key. This will overwrite an object the new key already exists.
 
+        All objects under source_key are copied server side on a pool of
+        workers threads while the listing is streamed. Sources are removed
+        with batched deletes, only after their copy succeeded, so a failed
+        or interrupted move can simply be run again.
 
         Args:
             source_key (str): key of object or prefix to be copied.
@@ -256,69 +849,180 @@ class Session(object):
             dest_bucket (str) : Name of s3 bucket.
             metadata (dict, str): dict or string representing key/value pairs.
             dry_run (bool): Do not execute, but print expected results.
+            workers (int): Number of copies to run at the same time.
+            checkpoint (str): File recording finished copies. Running the
+                              same move again skips those copies. Removed
+                              when the move succeeds.
 
         Returns:
-            None
+            (dict) : number of copied and deleted objects, and errors.
         """
         source_bucket = self.get_bucket(source_bucket)
         if dest_bucket is None:
             dest_bucket = source_bucket
-        keys = self.list_objects(prefix=source_key, bucket=source_bucket, keys_only=True)
-        if len(keys) == 0:
-            raise ValueError(f'key {source_key} does not exist')
-        if len(keys) >= 1:
-            old_prefix = source_key
-            new_prefix = dest_key
-            for k in keys:
-                # Remove old 'directory' and replace with new
-                new_key = new_prefix + k.replace(old_prefix, '')
+        objects = self.iter_objects(prefix=source_key, bucket=source_bucket)
+        if dest_bucket == source_bucket and dest_key.startswith(source_key):
+            # New keys would show up in a streaming listing of source_key
+            objects = list(objects)
+
+        old_prefix = source_key
+        new_prefix = dest_key
+        copied = {}
+        if checkpoint is not None:
+            copied = _read_checkpoint(checkpoint)
+        checkpoint_lock = threading.Lock()
+        summary = {'copied' : 0, 'deleted' : 0, 'failed' : 0, 'errors' : []}
+
+        def copy(_object):
+            k = _object['Key']
+            # Remove old 'directory' and replace with new
+            new_key = new_prefix + k[len(old_prefix):]
+            if dry_run:
+                print(f'copying {source_bucket}/{k} to {dest_bucket}/{new_key}')
+                return k, None
+            if copied.get(k) == _object['ETag']:
+                return k, None
+            try:
+                self.copy_object(k, new_key, source_bucket=source_bucket, dest_bucket=dest_bucket,
+                        metadata=metadata, size=_object['Size'], etag=_object['ETag'])
+            except Exception as e:
+                logger.error(f'copying {source_bucket}/{k} to {dest_bucket}/{new_key} failed: {e}')
+                return k, e
+            if checkpoint is not None:
+                with checkpoint_lock:
+                    with open(checkpoint, 'a') as fh:
+                        fh.write(json.dumps({'Key' : k, 'ETag' : _object['ETag']}) + '\n')
+            return k, None
+
+        def delete_sources(keys):
+            deleted, errors = self._delete_batch(source_bucket, keys)
+            summary['deleted'] += deleted
+            summary['failed'] += len(errors)
+            summary['errors'].extend(errors)
+
+        found = False
+        to_delete = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for k, error in _bounded_imap(pool, copy, objects, workers * TASKS_PER_WORKER):
+                found = True
+                if error is not None:
+                    summary['failed'] += 1
+                    summary['errors'].append({'Key' : k, 'Message' : str(error)})
+                    continue
+                summary['copied'] += 1
                 if dry_run:
-                    print(f'copying {source_bucket}/{k} to {dest_bucket}/{new_key}')
                     continue
-                self.copy_object(k, new_key, source_bucket=source_bucket, dest_bucket=dest_bucket, metadata=metadata)
-                self.delete([k], bucket=source_bucket)
-            return None
-
-        if dry_run:
-            print(f'copying {source_bucket}/{source_key} to {dest_bucket}/{dest_key}')
-            return None
-        self.copy_object(source_key, dest_key, source_bucket=source_bucket, dest_bucket=dest_bucket, metadata=metadata)
-        self.delete([source_key], bucket=source_bucket)
-        return None
+                to_delete.append(k)
+                if len(to_delete) == DELETE_BATCH_SIZE:
+                    delete_sources(to_delete)
+                    to_delete = []
+        if len(to_delete) > 0:
+            delete_sources(to_delete)
+        if not found:
+            raise ValueError(f'key {source_key} does not exist')
+        if checkpoint is not None and summary['failed'] == 0 and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        return summary
 
-    def copy_object(self, source_key, dest_key, source_bucket=None, dest_bucket=None, metadata=None):
+    def copy_object(self, source_key, dest_key, source_bucket=None, dest_bucket=None, metadata=None, size=None, etag=None):
         """Copies objects to new key or bucket.
 
+        Objects larger than MAX_COPY_OBJECT_SIZE are copied server side as
+        a multipart upload of parts copied in parallel.
+
         Args:
             source_key (str): key of object to be copied.
             dest_key (str): Name of new s3 object key.
             source_bucket (str): bucket of key
             dest_bucket (str) : Name of s3 bucket.
             metadata (dict, str): dict or string representing key/value pairs.
+            size (int): Size of source object, if known from a listing.
+            etag (str): ETag of source object, if known from a listing.
 
         Returns:
-            None
+            (dict) : response of the copy
         """
         source_bucket = self.get_bucket(source_bucket)
         if dest_bucket is None:
             dest_bucket = source_bucket
+        try:
+            return self._copy_object(source_key, dest_key, source_bucket, dest_bucket, metadata, size, etag)
+        finally:
+            self._invalidate(dest_bucket, dest_key)
 
-        if metadata is None:
-            return self.client.copy_object(Key=dest_key, Bucket=dest_bucket,
-                    CopySource={"Bucket": source_bucket, "Key": source_key})
+    def _copy_object(self, source_key, dest_key, source_bucket, dest_bucket, metadata, size, etag):
+        """Copies an object, see copy_object."""
+        copy_source = {"Bucket": source_bucket, "Key": source_key}
 
-        meta_dict = {'Metadata' : None}
-        if isinstance(metadata, str):
-            # Parse string or check if file exists
-             meta_dict['Metadata'] = json.loads(metadata)
-        elif isinstance(metadata, dict):
+        meta_args = {}
+        if metadata is not None:
+            if isinstance(metadata, str):
+                # Parse string or check if file exists
+                metadata = json.loads(metadata)
             #TODO assert it's a flat dict
-            meta_dict['Metadata'] = metadata
+            meta_args = {'Metadata' : metadata, 'MetadataDirective' : 'REPLACE'}
+
+        head = None
+        if size is None or len(meta_args) > 0:
+            head = self.get_metadata(source_key, bucket=source_bucket)
+            if size is None:
+                size, etag = head['ContentLength'], head['ETag']
+        if len(meta_args) > 0:
+            # REPLACE replaces the content headers too, so they are sent again
+            meta_args.update(_get_content_headers(head))
+        budget = self.retry_policy.new_budget()
+        if size <= MAX_COPY_OBJECT_SIZE:
+            return self.retry_policy.call(lambda: self.client.copy_object(Key=dest_key,
+                    Bucket=dest_bucket, CopySource=copy_source, **meta_args),
+                    budget, 'copy of ' + source_key)
+
+        if head is None:
+            head = self.get_metadata(source_key, bucket=source_bucket)
+            etag = head['ETag']
+        # Multipart uploads don't carry over metadata by themselves
+        create_args = {'Metadata' : meta_args.get('Metadata', head.get('Metadata', {}))}
+        create_args.update(_get_content_headers(head))
+        # Parts of the source's size keep its ETag
+        part_size, _ = self._get_part_size(source_bucket, source_key, size, etag)
+        if part_size > MAX_COPY_OBJECT_SIZE or -(-size // part_size) > MAX_PARTS:
+            part_size = -(-size // MAX_PARTS)
+        upload_id = self.retry_policy.call(lambda: self.client.create_multipart_upload(
+                Bucket=dest_bucket, Key=dest_key, **create_args),
+                budget, 'multipart upload of ' + dest_key)['UploadId']
+
+        def copy_part(part_number):
+            start = (part_number - 1) * part_size
+            end = min(size, start + part_size) - 1
+            response = self.retry_policy.call(lambda: self.client.upload_part_copy(
+                    Bucket=dest_bucket, Key=dest_key,
+                    UploadId=upload_id, PartNumber=part_number, CopySource=copy_source,
+                    CopySourceRange='bytes={}-{}'.format(start, end), CopySourceIfMatch=etag),
+                    budget, 'copy of part {} of {}'.format(part_number, source_key))
+            return {'PartNumber' : part_number, 'ETag' : response['CopyPartResult']['ETag']}
 
-            return self.client.copy_object(Key=dest_key, Bucket=dest_bucket,
-                    CopySource={"Bucket": source_bucket, "Key": source_key},
-                    Metadata=meta_dict,
-                    MetadataDirective="REPLACE")
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_transfer_concurrency) as pool:
+                parts = list(pool.map(copy_part, range(1, -(-size // part_size) + 1)))
+            return self.retry_policy.call(lambda: self.client.complete_multipart_upload(
+                    Bucket=dest_bucket, Key=dest_key, UploadId=upload_id,
+                    MultipartUpload={'Parts' : parts}),
+                    budget, 'completion of multipart upload of ' + dest_key)
+        except:
+            self._abort_multipart_upload(dest_bucket, dest_key, upload_id, budget)
+            raise
+
+    def _abort_multipart_upload(self, bucket, key, upload_id, budget):
+        """Aborts a failed multipart upload, so its parts aren't kept.
+
+        Errors are logged instead of raised, so they don't hide the error
+        that failed the upload.
+        """
+        try:
+            self.retry_policy.call(lambda: self.client.abort_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id),
+                    budget, 'abort of multipart upload of ' + key)
+        except Exception as e:
+            logger.warning('Could not abort multipart upload {} of {}: {}'.format(upload_id, key, e))
 
     def add_required_metadata(self, _dict):
         """Adds required metadata to dict.
@@ -345,15 +1049,35 @@ class Session(object):
     def upload_object(self, local_file, key, metadata=None, bucket=None, md5=False, verify=True):
         """Uploads files to object store.
 
+        The file is read once. The ETag used for verification is computed
+        from the same chunks that are sent to the server.
+
         Args:
             local_file (str): Filename of local file.
             key (str): Name of s3 object key.
             metadata (dict, str): dict or string representing key/value pairs.
             bucket (str) : Name of s3 bucket.
+            md5 (bool): Send Content-MD5 with every request and store the
+                        file's md5 in the 'Content-MD5' metadata.
+            verify (bool): Check the ETag returned by the server.
 
         Returns:
             None
         """
+        if self.progress is None:
+            return self._upload_object(local_file, key, metadata, bucket, md5, verify)
+        self.progress.add_total(1, os.path.getsize(local_file))
+        try:
+            self._upload_object(local_file, key, metadata, bucket, md5, verify)
+        except Exception:
+            self.progress.file_done(local_file, failed=True)
+            self.progress.finish()
+            raise
+        self.progress.file_done(local_file)
+        self.progress.finish()
+
+    def _upload_object(self, local_file, key, metadata=None, bucket=None, md5=False, verify=True):
+        """Uploads a file, see upload_object. Reports bytes, not files, to self.progress."""
         bucket = self.get_bucket(bucket)
         #if metadata is None:
         #    return self.client.upload_file(local_file, bucket, key)
@@ -370,39 +1094,235 @@ class Session(object):
             meta_dict['Metadata'] = metadata
         self.add_required_metadata(meta_dict['Metadata'])
 
-        if md5:
-            meta_dict['Metadata']['Content-MD5'] = get_md5sum(local_file)
-            #meta_dict['ContentMD5'] = get_md5sum(local_file)
-        trans_config = TransferConfig(
-                use_threads=True,
-                max_concurrency=10,
-                multipart_threshold=1024*1024*25,
-                multipart_chunksize=1024*1024*25)
+        stat = os.stat(local_file)
+        transfer_config = self.get_transfer_config(stat.st_size)
+        if md5 and stat.st_size > transfer_config.multipart_threshold:
+            # Metadata has to be sent before the first part
+            meta_dict['Metadata']['Content-MD5'] = self.get_local_md5(local_file)
 
         content_type = get_content_type(local_file)
         if content_type is not None:
             meta_dict['ContentType'] = content_type
             #meta_dict['ACL'] = "public-read"
 
-        success = False
-        etag = calculate_s3_etag(local_file)
-        retry = 0
-        max_retries = 4
-        while not success and retry < max_retries:
-            ret = self.client.upload_file(local_file, bucket, key, ExtraArgs=meta_dict, Config=trans_config)
-            if verify:
-                meta = self.get_metadata(key, bucket=bucket)
-                if etag == meta['ETag']:
-                    success = True
-                else:
-                    retry += 1
-                    logging.info('Etag doesn\'t match. Retrying')
-                    print(etag)
-                    print(meta['ETag'])
-        if retry == max_retries:
-            raise ISD_S3_Exception('ETag verification failed on upload')
-
-        return ret
+        budget = self.retry_policy.new_budget()
+        attempt = 1
+        while True:
+            try:
+                etag, server_etag = self._stream_upload(local_file, bucket, key, meta_dict, md5,
+                        transfer_config, verify, budget)
+            finally:
+                self._invalidate(bucket, key)
+            if not verify or etag == server_etag:
+                break
+            # Parts are checked as they are sent, so the whole file is only
+            # sent again if e.g. it changed while it was read.
+            error = TransientError('ETag verification failed on upload of {}: {} != {}'.format(
+                    local_file, etag, server_etag))
+            if not self.retry_policy.should_retry(error, attempt, budget):
+                raise error
+            delay = self.retry_policy.get_delay(attempt)
+            logger.info('{}. Retrying in {:.2f}s'.format(error, delay))
+            time.sleep(delay)
+            attempt += 1
+
+        if self.etag_cache is not None:
+            # Single part ETags are the md5 of the file
+            file_md5 = etag.strip('"') if '-' not in etag else None
+            self.etag_cache.put(local_file, transfer_config.multipart_chunksize, stat, etag=etag, md5=file_md5)
+        return None
+
+    def get_local_etag(self, local_file, chunk_size=None):
+        """Returns the S3 ETag of a local file, using the ETag cache.
+
+        Args:
+            local_file (str): Filename of local file.
+            chunk_size (int): Multipart chunk size. Default the part size
+                              uploads of the file use, see get_transfer_config.
+
+        Returns:
+            (str) : ETag, including quotes
+        """
+        if chunk_size is None:
+            chunk_size = get_chunk_size(os.path.getsize(local_file), self.multipart_chunksize)
+        if self.etag_cache is None:
+            return self._calculate_etag(local_file, chunk_size)
+        return self.etag_cache.get_etag(local_file, chunk_size, self._calculate_etag)
+
+    def get_local_md5(self, local_file):
+        """Returns the hex md5 of a local file, using the ETag cache."""
+        if self.etag_cache is None:
+            return self._calculate_md5(local_file)
+        return self.etag_cache.get_md5(local_file, self._calculate_md5)
+
+    def _calculate_etag(self, local_file, chunk_size):
+        with self._timer('etag', os.path.getsize(local_file)):
+            return calculate_s3_etag(local_file, chunk_size)
+
+    def _calculate_md5(self, local_file):
+        with self._timer('md5', os.path.getsize(local_file)):
+            return get_md5sum(local_file)
+
+    def _timer(self, operation, nbytes=0):
+        """Times a local operation if stats are collected."""
+        if self.stats is None:
+            return contextlib.nullcontext()
+        return self.stats.timer(operation, nbytes)
+
+    def verify_object(self, local_file, key, bucket=None):
+        """Checks whether an object has the same content as a local file.
+
+        Compares the object's ETag with the ETag of the local file: its md5
+        for objects uploaded in one request, otherwise the ETag of its parts.
+        The part size of multipart objects is inferred from their size and
+        part count.
+
+        Args:
+            local_file (str): Filename of local file.
+            key (str): Name of s3 object key.
+            bucket (str) : Name of s3 bucket.
+
+        Returns:
+            (dict) : local and remote ETag, and whether they match.
+        """
+        bucket = self.get_bucket(bucket)
+        meta = self.get_metadata(key, bucket=bucket)
+        remote_etag = meta['ETag']
+        local_etag = self._get_comparable_etag(local_file, meta['ContentLength'], remote_etag)
+        return {'local_file' : local_file,
+                'key' : key,
+                'local_etag' : local_etag,
+                'remote_etag' : remote_etag,
+                'match' : local_etag == remote_etag}
+
+    def _get_comparable_etag(self, local_file, size, remote_etag):
+        """Returns the ETag of local_file computed with the part size of an object.
+
+        Objects uploaded in one request have the md5 of their content as
+        ETag, whatever their size.
+
+        Args:
+            local_file (str): Filename of local file.
+            size (int): Size of the object.
+            remote_etag (str): ETag of the object.
+        """
+        if '-' not in remote_etag:
+            return '"{}"'.format(self.get_local_md5(local_file))
+        return self.get_local_etag(local_file, get_part_size(size, remote_etag, self.multipart_chunksize))
+
+    def _stream_upload(self, local_file, bucket, key, extra_args, md5=False, transfer_config=None, verify=True, budget=None):
+        """Uploads a file, reading it once.
+
+        Files up to the multipart threshold are sent with put_object, larger
+        files as a multipart upload with up to max_concurrency parts in
+        flight, or as many as the transfer tuner allows. Each chunk is hashed
+        by the thread that sends it.
+
+        Args:
+            local_file (str): Filename of local file.
+            bucket (str) : Name of s3 bucket.
+            key (str): Name of s3 object key.
+            extra_args (dict): Metadata and ContentType for the object.
+            md5 (bool): Send Content-MD5 with every request. If the file is
+                        sent in one request, also sets the 'Content-MD5'
+                        metadata.
+            transfer_config (TransferConfig): Part size and concurrency.
+                                              Default get_transfer_config
+                                              for the file's size.
+            verify (bool): Check the ETag of each part, sending it again
+                           if it doesn't match.
+            budget (retry.RetryBudget): Retries of the upload, shared by
+                                        its parts.
+
+        Failed requests are retried with self.retry_policy, so a failed
+        part is sent again without the rest of the file.
+
+        Returns:
+            (tuple) : ETag computed locally, ETag returned by the server
+        """
+        with open(local_file, 'rb') as fp:
+            if transfer_config is None:
+                transfer_config = self.get_transfer_config(os.fstat(fp.fileno()).st_size)
+            chunk_size = transfer_config.multipart_chunksize
+            data = fp.read(chunk_size)
+            if len(data) < chunk_size or fp.peek(1) == b'':
+                digest = hashlib.md5(data)
+                put_args = dict(extra_args)
+                if md5:
+                    put_args['ContentMD5'] = base64.b64encode(digest.digest()).decode()
+                    put_args['Metadata'] = dict(extra_args['Metadata'])
+                    put_args['Metadata']['Content-MD5'] = digest.hexdigest()
+                response = self.retry_policy.call(lambda: self.client.put_object(
+                        Bucket=bucket, Key=key, Body=data, **put_args), budget, 'upload of ' + key)
+                if self.progress is not None:
+                    self.progress.add_bytes(len(data))
+                return _combine_etag([digest]), response['ETag']
+
+            if budget is None:
+                budget = self.retry_policy.new_budget()
+            upload_id = self.retry_policy.call(lambda: self.client.create_multipart_upload(
+                    Bucket=bucket, Key=key, **extra_args),
+                    budget, 'multipart upload of ' + key)['UploadId']
+
+            def upload_part(part):
+                part_number, part_data = part
+                start = time.monotonic()
+                digest = hashlib.md5(part_data)
+                part_args = {}
+                if md5:
+                    part_args['ContentMD5'] = base64.b64encode(digest.digest()).decode()
+                expected_etag = '"{}"'.format(digest.hexdigest())
+                def send():
+                    response = self.client.upload_part(Bucket=bucket, Key=key,
+                            UploadId=upload_id, PartNumber=part_number, Body=part_data, **part_args)
+                    if verify and response['ETag'] != expected_etag:
+                        raise TransientError('ETag of part {} of {} does not match: {} != {}'.format(
+                                part_number, key, response['ETag'], expected_etag))
+                    return response
+                response = self.retry_policy.call(send, budget,
+                        'upload of part {} of {}'.format(part_number, key))
+                if self.transfer_tuner is not None:
+                    self.transfer_tuner.record(len(part_data), time.monotonic() - start)
+                if self.progress is not None:
+                    self.progress.add_bytes(len(part_data))
+                return {'PartNumber' : part_number, 'ETag' : response['ETag']}, digest
+
+            def read_parts(data):
+                part_number = 1
+                while len(data) > 0:
+                    yield part_number, data
+                    part_number += 1
+                    data = fp.read(chunk_size)
+
+            try:
+                with ThreadPoolExecutor(max_workers=transfer_config.max_concurrency) as pool:
+                    parts = list(_bounded_imap(pool, upload_part, read_parts(data),
+                            self._get_transfer_concurrency(transfer_config)))
+                response = self.retry_policy.call(lambda: self.client.complete_multipart_upload(
+                        Bucket=bucket, Key=key, UploadId=upload_id,
+                        MultipartUpload={'Parts' : [part for part, _ in parts]}),
+                        budget, 'completion of multipart upload of ' + key)
+            except:
+                self._abort_multipart_upload(bucket, key, upload_id, budget)
+                raise
+        return _combine_etag([digest for _, digest in parts]), response['ETag']
+
+    def get_transfer_config(self, size=0):
+        """Returns the TransferConfig for transferring size bytes.
+
+        Uses this Session's multipart_chunksize and max_transfer_concurrency.
+        See get_transfer_config.
+        """
+        return get_transfer_config(size, self.multipart_chunksize, self.max_transfer_concurrency)
+
+    def _get_transfer_concurrency(self, transfer_config):
+        """Returns the parts to keep in flight, as a number or a function for _bounded_imap."""
+        max_concurrency = self.max_transfer_concurrency
+        if transfer_config is not None:
+            max_concurrency = transfer_config.max_concurrency
+        if self.transfer_tuner is None:
+            return max_concurrency
+        return lambda: min(self.transfer_tuner.get_concurrency(), max_concurrency)
 
     def get_filelist(self, local_dir, recursive=False, ignore=[]):
         """Returns local filelist.
@@ -413,27 +1333,27 @@ class Session(object):
                               Does not follow symlinks.
             ignore (iterable[str]): strings to ignore.
         """
+        with self._timer('filelist'):
+            return self._get_filelist(local_dir, recursive, ignore)
 
+    def _get_filelist(self, local_dir, recursive, ignore):
         filelist = []
         for root,_dir,files in os.walk(local_dir, topdown=True):
             for _file in files:
                 full_filename = os.path.join(root,_file)
-
-                ignore_cur_file=False
-                for ignore_str in ignore:
-                    if ignore_str in full_filename:
-                        ignore_cur_file=True
-                        break
-                if not ignore_cur_file:
+                if not _is_ignored(full_filename, ignore):
                     filelist.append(full_filename)
             if not recursive:
                 return filelist
         return filelist
 
-    def upload_mult_objects(self, local_dir, key_prefix=None, bucket=None, recursive=False, ignore=[], metadata=None, dry_run=False):
+    def upload_mult_objects(self, local_dir, key_prefix=None, bucket=None, recursive=False, ignore=[], metadata=None, dry_run=False, workers=DEFAULT_CONCURRENCY, processes=0, sync=False, delete=False, parallelism=1):
         """Uploads files within a directory.
 
-        Uses key from local files.
+        Uses key from local files. Files are uploaded on a bounded pool of
+        worker threads sharing this Session's client. If processes is
+        greater than 1, files are spread over that many worker processes,
+        each running workers threads with its own Session.
 
         Args:
             bucket (str): Name of s3 bucket.
@@ -448,47 +1368,183 @@ class Session(object):
                                     If json str, all objects will have this placed in it.
                                     If location of script, calls script and captures output as
                                     the value of metadata.
+            workers (int): Number of upload threads (per process).
+            processes (int): Number of worker processes. Default 0 (threads only)
+            sync (bool): Skip files whose object under key_prefix has the
+                         same size and ETag.
+            delete (bool): With sync, delete objects under key_prefix
+                           that have no local file and don't match ignore.
+            parallelism (int): Number of key ranges to list concurrently with sync.
 
         Returns:
-            None
+            (dict) : counts and per-file results. See run_tasks.
+                     With sync, also the number of 'skipped' files, and
+                     with delete the number of objects 'deleted', or
+                     'would_delete' with dry_run.
 
         """
         bucket = self.get_bucket(bucket)
+        if key_prefix is None:
+            key_prefix = ''
+        assert sync or not delete
+
+        file_keys = self._get_file_keys(local_dir, key_prefix, recursive, ignore)
+        removed_keys = []
+        skipped = 0
+        if sync:
+            remote = self.iter_objects(bucket, key_prefix, parallelism=parallelism)
+            if not recursive:
+                remote = self.iter_regex_filter(remote, '^[^/]+$', exclude=len(key_prefix))
+            if len(ignore) > 0:
+                # Objects of ignored files are kept, like the files
+                local_prefix = _get_local_prefix(local_dir)
+                remote = (_object for _object in remote if not _is_ignored(
+                        local_prefix + _object['Key'][len(key_prefix):], ignore))
+            total = len(file_keys)
+            with self._timer('sync_diff'):
+                file_keys, removed_keys = self._diff_with_remote(file_keys, remote)
+            skipped = total - len(file_keys)
+            logger.info('{} files to upload, {} objects to delete'.format(
+                    len(file_keys), len(removed_keys)))
+
+        func = None
+        if metadata is not None:
+            func = self.interpret_metadata_str(metadata)
+        if self.progress is not None and not dry_run:
+            self.progress.add_total(len(file_keys), sum(os.path.getsize(_file) for _file, _ in file_keys))
+
+        def tasks():
+            for _file, key in file_keys:
+                task = {'local_file' : _file, 'key' : key, 'bucket' : bucket}
+                if self.progress is not None and processes > 1:
+                    # Worker processes don't report bytes, they are counted per file
+                    task['size'] = os.path.getsize(_file)
+                if dry_run:
+                    print('(Dry Run) Uploading: '+_file+" to "+bucket+'/'+key)
+                    continue
+                if func is not None and processes > 1:
+                    # Metadata functions may not be picklable
+                    task['metadata'] = func(_file)
+                elif func is not None:
+                    task['metadata'] = functools.partial(func, _file)
+                yield task
+
+        summary = self.run_tasks('_upload_task', tasks(), workers=workers, processes=processes)
+        if sync:
+            summary['skipped'] = skipped
+        if delete and len(removed_keys) > 0:
+            deleted = self.delete(removed_keys, bucket=bucket, dry_run=dry_run)
+            summary['would_delete' if dry_run else 'deleted'] = deleted['deleted']
+            for error in deleted['errors']:
+                error['status'] = 'failed'
+                _add_task_result(summary, error)
+        return summary
+
+    def sync(self, local_dir, key_prefix=None, bucket=None, recursive=False, ignore=[], metadata=None, dry_run=False, workers=DEFAULT_CONCURRENCY, processes=0, delete=False, parallelism=1):
+        """Uploads new and changed files within a directory.
+
+        Same as upload_mult_objects with sync=True.
+        """
+        return self.upload_mult_objects(local_dir, key_prefix=key_prefix, bucket=bucket,
+                recursive=recursive, ignore=ignore, metadata=metadata, dry_run=dry_run,
+                workers=workers, processes=processes, sync=True, delete=delete,
+                parallelism=parallelism)
+
+    def _get_file_keys(self, local_dir, key_prefix, recursive=False, ignore=[]):
+        """Returns (local file, key) pairs for files within local_dir."""
+        junk_path = _get_local_prefix(local_dir)
+        filelist = self.get_filelist(local_dir=local_dir, recursive=recursive, ignore=ignore)
+        return [(_file, key_prefix + _file[len(junk_path):]) for _file in filelist]
 
-        #if local_dir[-1] == '/':
-        #    local_dir = local_dir[:-1]
-        if local_dir[-1] != '/':
-            local_dir = '/'
+    def _diff_with_remote(self, file_keys, remote_objects):
+        """Compares local files with a listing of their destination.
 
-        junk_path = os.path.dirname(local_dir)
-        if junk_path != '':
-            junk_path += '/'
+        Args:
+            file_keys (list): (local file, key) pairs.
+            remote_objects (iterable): listed objects.
 
-        filelist = self.get_filelist(local_dir=local_dir, recursive=recursive, ignore=ignore)
-        if metadata is not None:
-            func = self._interpret_metadata_str(metadata)
-        cpus = multiprocessing.cpu_count()
-        for _file in filelist:
+        Returns:
+            (tuple) : (local file, key) pairs that are new or changed,
+                      keys of objects without a local file.
+        """
+        local = dict((key, _file) for _file, key in file_keys)
+        unchanged = set()
+        removed_keys = []
+        for _object in remote_objects:
+            key = _object['Key']
+            if key not in local:
+                removed_keys.append(key)
+                continue
+            _file = local[key]
+            if os.path.getsize(_file) != _object['Size']:
+                continue
+            if self._get_comparable_etag(_file, _object['Size'], _object['ETag']) == _object['ETag']:
+                unchanged.add(key)
+        changed = [(_file, key) for _file, key in file_keys if key not in unchanged]
+        return changed, removed_keys
+
+    def _upload_task(self, local_file, key, bucket, metadata=None, size=None):
+        """Uploads a single file for run_tasks. size is only used for progress."""
+        logger.debug('Uploading {} to {}'.format(local_file, key))
+        if callable(metadata):
+            metadata = metadata()
+        self._upload_object(local_file, key, metadata=metadata, bucket=bucket)
 
-            key_without_preceding_path = _file.replace(junk_path,'')
-            key = key_prefix + key_without_preceding_path
+    def run_tasks(self, method, tasks, workers=DEFAULT_CONCURRENCY, processes=0):
+        """Runs a Session method once per task on a bounded worker pool.
 
-            metadata_str = None
-            print(_file)
-            if metadata is not None:
-                metadata_str = func(_file)
+        At most a few tasks per worker are queued at any time, so tasks may
+        be a generator over a very large number of items.
 
-            if dry_run:
-                print('(Dry Run) Uploading: '+_file+" to "+bucket+'/'+key)
-            else:
-                try:
-                    p = multiprocessing.Process(
-                            target=self.upload_object,
-                            args=(_file, key,metadata_str, bucket ))
-                    p.start()
-                except:
-                    self.upload_object(_file,key,metadata,bucket)
+        Args:
+            method (str): Name of Session method to call.
+            tasks (iterable[dict]): keyword arguments for each call.
+            workers (int): Number of threads (per process).
+            processes (int): Number of worker processes, each with its own
+                             Session. Default 0 (threads only, sharing
+                             this Session's client)
 
+        Finished tasks are reported to self.progress as files, named by
+        their local_file or key. Tasks run by worker processes report the
+        task's size, if any, as bytes when they finish.
+
+        Returns:
+            (dict) : {'succeeded': int, 'failed': int, 'results': list}
+                     where each result is the task with 'status' set to
+                     'succeeded' or 'failed', and 'error' on failure.
+        """
+        summary = {'succeeded' : 0, 'failed' : 0, 'results' : []}
+        add_result = functools.partial(_add_task_result, summary)
+        if self.progress is not None:
+            add_result = functools.partial(self._add_task_progress, summary, processes is not None and processes > 1)
+        if processes is not None and processes > 1:
+            context = (self.endpoint_url, self.credentials_file, self.verify, self.client_options,
+                    self.transfer_options, self.retry_options)
+            batches = _batched(tasks, workers * TASKS_PER_WORKER)
+            run_batch = functools.partial(_run_task_batch, method, workers=workers)
+            with ProcessPoolExecutor(max_workers=processes,
+                    initializer=_init_worker_session, initargs=context) as pool:
+                results = itertools.chain.from_iterable(
+                        _bounded_imap(pool, run_batch, batches, processes * 2))
+                for result in results:
+                    add_result(result)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                run_task = functools.partial(_run_task, self, method)
+                for result in _bounded_imap(pool, run_task, tasks, workers * TASKS_PER_WORKER):
+                    add_result(result)
+        if self.progress is not None:
+            self.progress.finish()
+        if summary['failed'] > 0:
+            logger.warning('{} of {} tasks failed'.format(
+                    summary['failed'], summary['failed'] + summary['succeeded']))
+        return summary
+
+    def _add_task_progress(self, summary, count_bytes, result):
+        _add_task_result(summary, result)
+        self.progress.file_done(result.get('local_file', result.get('key')),
+                failed=result['status'] == 'failed',
+                nbytes=result.get('size', 0) if count_bytes else 0)
 
     def interpret_metadata_str(self, metadata):
         """Determine what metadata string is,
@@ -503,12 +1559,13 @@ class Session(object):
         # Check if json
         try:
             metadata_obj = json.loads(metadata)
-            return lambda x: metadata_obj
+            return lambda x: dict(metadata_obj)
         # Otherwise, it should be a script
         except ValueError:
             import subprocess
+            script = metadata if os.path.isabs(metadata) else './' + metadata
             def metadata_func(filename):
-                metadata_str = subprocess.check_output(['./'+metadata,filename])
+                metadata_str = subprocess.check_output([script, filename])
                 return json.loads(metadata_str)
             return metadata_func
 
@@ -516,83 +1573,420 @@ class Session(object):
     def get_object(self, key, bucket=None, local_dir='./', local_filename=None):
         """Get's object from store.
 
-        Writes to local dir
+        Writes to local dir. Objects of at least RANGED_DOWNLOAD_THRESHOLD
+        bytes are fetched as parallel byte ranges and resume after an
+        interruption. See ranged_download.
 
         Args:
             key (str) [REQUIRED]: Name of s3 object key.
             bucket (str): Name of s3 bucket.
-            write_dir (str): directory to write file to.
+            local_dir (str): directory to write file to.
+            local_filename (str): filename to write to. Default is the
+                                  basename of key.
 
         Returns:
             dict : successful or not
         """
+        bucket = self.get_bucket(bucket)
         if local_filename is None:
             local_filename = os.path.basename(key)
-        os.path.join(local_dir, local_filename)
-        self.client.download_file(bucket, key, local_filename)
+        local_filename = os.path.join(local_dir, local_filename)
+        meta = self.get_metadata(key, bucket=bucket)
+        if self.progress is None:
+            self._download(bucket, key, local_filename, meta['ContentLength'], meta['ETag'])
+            return {'result' : 'successful'}
+        self.progress.add_total(1, meta['ContentLength'])
+        try:
+            self._download(bucket, key, local_filename, meta['ContentLength'], meta['ETag'])
+        except Exception:
+            self.progress.file_done(key, failed=True)
+            self.progress.finish()
+            raise
+        self.progress.file_done(key)
+        self.progress.finish()
         return {'result' : 'successful'}
 
-    def delete(self, keys=[], bucket=None, dry_run=False):
-        """Deletes Key from given bucket.
+    def _download(self, bucket, key, local_file, size, etag):
+        """Downloads an object, using ranged_download for large objects."""
+        if size >= RANGED_DOWNLOAD_THRESHOLD:
+            self.ranged_download(key, local_file, bucket=bucket, size=size, etag=etag)
+        else:
+            callback = self.progress.add_bytes if self.progress is not None else None
+            self.client.download_file(bucket, key, local_file, Config=self.get_transfer_config(size),
+                    Callback=callback)
+
+    def ranged_download(self, key, local_file, bucket=None, size=None, etag=None, concurrency=None):
+        """Downloads an object as byte ranges fetched in parallel.
+
+        Ranges are written into a preallocated sparse file next to
+        local_file, which is renamed into place when complete. A journal
+        beside it records finished ranges and their md5s, so calling this
+        again after an interruption only fetches the missing ranges. Range
+        requests are conditional on the ETag, so a changed object isn't
+        mixed with the partial download.
+
+        The result is checked against the object's size and ETag. Ranges
+        line up with the object's parts, so multipart ETags are checked from
+        the md5s of the ranges. Single part ETags need one read of the file.
+        If the part size of a multipart object can't be found out, see
+        _get_part_size, only its size is checked.
+
+        A range that fails, also while its body is read, is fetched again
+        on its own, see retry.RetryPolicy.
 
         Args:
             key (str) [REQUIRED]: Name of s3 object key.
-            dry_run (bool): Print delete command as a sanity check.  No action taken if True.
+            local_file (str) [REQUIRED]: File to write to.
+            bucket (str): Name of s3 bucket.
+            size (int): Size of object, if known from a listing.
+            etag (str): ETag of object, if known from a listing.
+            concurrency (int): Number of ranges fetched at the same time.
+                               Default max_transfer_concurrency, tuned if
+                               adaptive_transfers is set.
 
         Returns:
             None
         """
+        bucket = self.get_bucket(bucket)
+        if size is None or etag is None:
+            meta = self.get_metadata(key, bucket=bucket)
+            size, etag = meta['ContentLength'], meta['ETag']
+        chunk_size, exact = self._get_part_size(bucket, key, size, etag)
+        part_file = local_file + PARTIAL_DOWNLOAD_SUFFIX
+        journal_file = local_file + DOWNLOAD_JOURNAL_SUFFIX
+        header = {'bucket' : bucket, 'key' : key, 'etag' : etag, 'size' : size, 'chunk_size' : chunk_size}
+
+        finished = _read_download_journal(journal_file, header)
+        if len(finished) == 0 or not os.path.exists(part_file):
+            finished = {}
+            with open(journal_file, 'w') as journal:
+                journal.write(json.dumps(header) + '\n')
+        else:
+            logger.info('Resuming {} with {} ranges done'.format(key, len(finished)))
+        with open(part_file, 'ab') as fp:
+            fp.truncate(size)
+
+        ranges = [i for i in range(max(1, -(-size // chunk_size))) if i not in finished]
+        if self.progress is not None and len(finished) > 0:
+            # Ranges of an earlier attempt count as transferred
+            self.progress.add_bytes(size - sum(min(size, (i + 1) * chunk_size) - i * chunk_size for i in ranges))
+        journal_lock = threading.Lock()
+        budget = self.retry_policy.new_budget()
+        fd = os.open(part_file, os.O_WRONLY)
+        try:
+            def read_range(start, end):
+                digest = hashlib.md5()
+                offset = start
+                try:
+                    response = self.client.get_object(Bucket=bucket, Key=key,
+                            Range='bytes={}-{}'.format(start, end), IfMatch=etag)
+                    for data in response['Body'].iter_chunks(DOWNLOAD_BUFFER_SIZE):
+                        os.pwrite(fd, data, offset)
+                        digest.update(data)
+                        offset += len(data)
+                        if self.progress is not None:
+                            self.progress.add_bytes(len(data))
+                    if offset != end + 1:
+                        raise TransientError('Short read of {} at byte {}'.format(key, offset))
+                except Exception:
+                    if self.progress is not None:
+                        # The range is read again from its start
+                        self.progress.add_bytes(start - offset)
+                    raise
+                return digest
+
+            def fetch(index):
+                fetch_start = time.monotonic()
+                start = index * chunk_size
+                end = min(size, start + chunk_size) - 1
+                digest = hashlib.md5()
+                if end >= start:
+                    digest = self.retry_policy.call(lambda: read_range(start, end), budget,
+                            'download of bytes {}-{} of {}'.format(start, end, key))
+                    os.fsync(fd)
+                    if self.transfer_tuner is not None and concurrency is None:
+                        self.transfer_tuner.record(end + 1 - start, time.monotonic() - fetch_start)
+                with journal_lock:
+                    with open(journal_file, 'a') as journal:
+                        journal.write(json.dumps({'index' : index, 'md5' : digest.hexdigest()}) + '\n')
+                finished[index] = digest.hexdigest()
+
+            if concurrency is None:
+                max_workers = self.max_transfer_concurrency
+                max_pending = self._get_transfer_concurrency(None)
+            else:
+                max_workers = max_pending = concurrency
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for _ in _bounded_imap(pool, fetch, ranges, max_pending):
+                    pass
+        finally:
+            os.close(fd)
+
+        if os.path.getsize(part_file) != size:
+            raise ISD_S3_Exception('Size of {} does not match {}'.format(part_file, key))
+        if '-' in etag:
+            md5s = [_HexDigest(finished[i]) for i in sorted(finished)]
+            local_etag = _combine_etag(md5s)
+        else:
+            local_etag = '"{}"'.format(self._calculate_md5(part_file))
+        if local_etag != etag and not exact:
+            logger.warning('Part size of {} is unknown, only its size was verified'.format(key))
+        elif local_etag != etag:
+            os.remove(journal_file)
+            raise ISD_S3_Exception('ETag verification failed on download of {}'.format(key))
+        os.replace(part_file, local_file)
+        os.remove(journal_file)
+
+    def _get_part_size(self, bucket, key, size, etag):
+        """Returns the part size of an object, and whether it's exact.
+
+        The size of the first part of a multipart object is asked for with
+        a HEAD request. If that fails, or the parts differ in size, the part
+        size is guessed, see get_part_size.
+
+        Returns:
+            (tuple) : part size, and whether the object's ETag can be
+                      computed from parts of that size.
+        """
+        if '-' not in etag:
+            return get_chunk_size(size, self.multipart_chunksize), True
+        parts = int(etag.strip('"').split('-')[1])
+        try:
+            head = self.retry_policy.call(lambda: self.client.head_object(
+                    Bucket=bucket, Key=key, PartNumber=1, IfMatch=etag),
+                    description='HEAD of part 1 of ' + key)
+            part_size = head['ContentLength']
+            if part_size > 0 and -(-size // part_size) == parts:
+                return part_size, True
+            logger.warning('Parts of {} differ in size'.format(key))
+        except botocore.exceptions.ClientError as e:
+            logger.warning('Cannot get part size of {}: {}'.format(key, e))
+        return get_part_size(size, etag, self.multipart_chunksize), False
+
+    def get_objects(self, prefix="", bucket=None, regex=None, local_dir='./', dry_run=False, workers=DEFAULT_CONCURRENCY, processes=0, parallelism=1):
+        """Downloads all objects under a prefix.
+
+        Files are written below local_dir using the full key as path, so the
+        local tree mirrors the key layout. Objects are downloaded on a bounded
+        worker pool while the listing is streamed. See run_tasks.
+
+        Args:
+            prefix (str): Prefix from which to filter.
+            bucket (str): Name of s3 bucket.
+            regex (str): regex string keys must match.
+            local_dir (str): directory to write files to.
+            dry_run (bool): Print downloads without executing them.
+            workers (int): Number of download threads (per process).
+            processes (int): Number of worker processes. Default 0 (threads only)
+            parallelism (int): Number of key ranges to list concurrently. Default 1
+
+        Returns:
+            (dict) : counts and per-file results. See run_tasks.
+        """
+        bucket = self.get_bucket(bucket)
+        # With a trailing separator, also when local_dir is /
+        local_root = os.path.join(os.path.abspath(local_dir), '')
+
+        def tasks():
+            for _object in self.iter_objects(bucket, prefix, regex=regex, parallelism=parallelism):
+                key = _object['Key']
+                if key.endswith('/'):
+                    # 'Directory' placeholder objects
+                    continue
+                local_file = os.path.normpath(os.path.join(local_root, key))
+                if not local_file.startswith(local_root):
+                    logger.warning('Skipping {}, it would be written outside {}'.format(key, local_dir))
+                    continue
+                if dry_run:
+                    print('(Dry Run) Downloading: '+bucket+'/'+key+' to '+local_file)
+                    continue
+                if self.progress is not None:
+                    self.progress.add_total(1, _object['Size'])
+                yield {'key' : key, 'bucket' : bucket, 'local_file' : local_file,
+                        'size' : _object['Size'], 'etag' : _object['ETag']}
+
+        return self.run_tasks('_download_task', tasks(), workers=workers, processes=processes)
+
+    def _download_task(self, key, bucket, local_file, size, etag):
+        """Downloads a single object for run_tasks."""
+        os.makedirs(os.path.dirname(local_file), exist_ok=True)
+        self._download(bucket, key, local_file, size, etag)
+
+    def delete(self, keys=[], bucket=None, dry_run=False, concurrency=DEFAULT_CONCURRENCY):
+        """Deletes Key from given bucket.
+
+        Keys are deleted in DeleteObjects batches of up to DELETE_BATCH_SIZE.
+        Batches are sent concurrently and filled as keys are produced, so a
+        streaming listing is deleted while it is still being listed.
+
+        Args:
+            keys (str, iterable[str]) [REQUIRED]: Names of s3 object keys.
+                May be a generator, e.g. from iter_keys.
+            dry_run (bool): Print delete command as a sanity check.  No action taken if True.
+            concurrency (int): Number of batches to send at the same time.
+
+        Returns:
+            (dict) : number of deleted keys and list of per-key errors,
+                     e.g. {'deleted': 2, 'errors': [{'Key': ..., 'Code': ..., 'Message': ...}]}
+        """
         if isinstance(keys,str):
             keys=[keys]
-        assert len(keys) > 0
         bucket = self.get_bucket(bucket)
-        for key in keys:
-            if dry_run:
+        result = {'deleted' : 0, 'errors' : []}
+
+        if dry_run:
+            for key in keys:
                 logging.info('deleting ' + key)
                 print('deleting ' + key)
-            else:
-                self.client.delete_object(Bucket=bucket, Key=key)
+                result['deleted'] += 1
+            return result
+
+        batches = _batched(keys, DELETE_BATCH_SIZE)
+        budget = self.retry_policy.new_budget()
+        delete_batch = lambda batch: self._delete_batch(bucket, batch, budget)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for deleted, errors in _bounded_imap(pool, delete_batch, batches, concurrency * 2):
+                result['deleted'] += deleted
+                result['errors'].extend(errors)
+        if len(result['errors']) > 0:
+            logger.warning('{} keys could not be deleted'.format(len(result['errors'])))
+        return result
+
+    def _delete_batch(self, bucket, keys, budget=None):
+        """Deletes up to DELETE_BATCH_SIZE keys with one DeleteObjects request.
+
+        Keys reported as failed with a retryable code, e.g. SlowDown, are
+        sent again without the others, see retry.RetryPolicy.
+
+        Returns:
+            (tuple) : number of deleted keys, list of per-key errors
+        """
+        errors = []
+        pending = keys
+        attempt = 1
+        while True:
+            try:
+                response = self.retry_policy.call(lambda: self.client.delete_objects(
+                        Bucket=bucket,
+                        Delete={'Objects' : [{'Key' : key} for key in pending], 'Quiet' : True}),
+                        budget, 'delete of {} keys'.format(len(pending)))
+            finally:
+                for key in pending:
+                    self._invalidate(bucket, key)
+            failed = [{'Key' : x['Key'], 'Code' : x.get('Code'), 'Message' : x.get('Message')}
+                    for x in response.get('Errors', [])]
+            errors.extend(x for x in failed if x['Code'] not in RETRYABLE_CODES)
+            pending = [x['Key'] for x in failed if x['Code'] in RETRYABLE_CODES]
+            if len(pending) == 0:
+                break
+            error = TransientError('{} keys failed to delete'.format(len(pending)))
+            if not self.retry_policy.should_retry(error, attempt, budget):
+                errors.extend(x for x in failed if x['Code'] in RETRYABLE_CODES)
+                break
+            delay = self.retry_policy.get_delay(attempt)
+            logger.info('Retrying delete of {} keys in {:.2f}s'.format(len(pending), delay))
+            time.sleep(delay)
+            attempt += 1
+        return len(keys) - len(errors), errors
 
-    def delete_mult(self, bucket=None, prefix="", obj_regex=None, dry_run=False, recursive=False):
+    def delete_mult(self, bucket=None, prefix="", obj_regex=None, dry_run=False, recursive=False, parallelism=1, concurrency=DEFAULT_CONCURRENCY):
         """Delete objects where keys match regex or prefix.
 
         Args:
             bucket (str) : Name of s3 bucket.
+            parallelism (int): Number of key ranges to list concurrently. Default 1
+            concurrency (int): Number of delete batches to send at the same time.
+
+        Returns:
+            (dict) : See delete
         """
         bucket = self.get_bucket(bucket)
         if recursive:
             assert obj_regex is None
-            all_keys = self.list_objects(bucket=bucket, regex=obj_regex, keys_only=True, prefix=prefix)
-        else:
-            all_objects = self.list_objects(bucket=bucket, regex=obj_regex, prefix=prefix)
+        all_objects = self.iter_objects(bucket=bucket, regex=obj_regex, prefix=prefix, parallelism=parallelism)
+        if not recursive:
             regex = '^[^/]+$'
-            all_objects = self.regex_filter(all_objects, regex, exclude= len(prefix))
-            all_keys = list(map(lambda x: x['Key'], all_objects))
+            all_objects = self.iter_regex_filter(all_objects, regex, exclude= len(prefix))
+        all_keys = map(lambda x: x['Key'], all_objects)
 
-        self.delete(bucket=bucket, keys=all_keys, dry_run=dry_run)
+        return self.delete(bucket=bucket, keys=all_keys, dry_run=dry_run, concurrency=concurrency)
 
-    def search_metadata(self, bucket=None, obj_regex=None, metadata_key=None):
+    def search_metadata(self, bucket=None, obj_regex=None, metadata_key=None, metadata_value=None, prefix="", workers=DEFAULT_CONCURRENCY, parallelism=1):
         """Search metadata. Narrow search using regex for keys.
 
         Args:
             bucket (str): Name of s3 bucket.
             obj_regex (str): Regular expression to narrow search
-            metadata_key (str): dict key of metadata to search
+            metadata_key (str): dict key of metadata to search. Default None
+                                matches no objects.
+            metadata_value (str): Only match objects where metadata_key has
+                                  this value. Default None matches any value.
+            prefix (str): Prefix from which to filter.
+            workers (int): Number of HEAD requests to send at the same time.
+            parallelism (int): Number of key ranges to list concurrently. Default 1
 
         Returns:
             (list): keys that match
         """
         bucket = self.get_bucket(bucket)
+        # User metadata keys are returned in lower case
+        if metadata_key is not None:
+            metadata_key = metadata_key.lower()
 
-        all_keys = self.list_objects(bucket, regex=obj_regex, keys_only=True)
         matching_keys = []
-        for key in all_keys:
-            return_dict = self.get_metadata(bucket, key)
-            if metadata_key in return_dict.keys():
+        for key, return_dict in self.iter_metadata(bucket, prefix, regex=obj_regex,
+                workers=workers, parallelism=parallelism):
+            metadata = return_dict.get('Metadata', {})
+            if metadata_key not in metadata:
+                continue
+            if metadata_value is None or metadata[metadata_key] == metadata_value:
                 matching_keys.append(key)
 
         return matching_keys
 
+    def iter_metadata(self, bucket=None, prefix="", regex=None, workers=DEFAULT_CONCURRENCY, parallelism=1):
+        """Yields metadata of all objects under a prefix.
+
+        HEAD requests are sent concurrently while the listing is streamed.
+        Objects removed after being listed are skipped.
+
+        Args:
+            bucket (str): Name of s3 bucket.
+            prefix (str): Prefix from which to filter.
+            regex (str): regex string keys must match.
+            workers (int): Number of HEAD requests to send at the same time.
+            parallelism (int): Number of key ranges to list concurrently. Default 1
+
+        Returns:
+            (generator) : (key, head_object response) in key order
+        """
+        bucket = self.get_bucket(bucket)
+
+        def head(key):
+            try:
+                return key, self.get_metadata(key, bucket=bucket)
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                    logger.debug('{} was removed after listing'.format(key))
+                    return key, None
+                raise
+
+        keys = self.iter_keys(bucket, prefix, regex=regex, parallelism=parallelism)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for key, return_dict in _bounded_imap(pool, head, keys, workers * TASKS_PER_WORKER):
+                if return_dict is not None:
+                    yield key, return_dict
+
+    def get_metadata_mult(self, prefix="", bucket=None, regex=None, workers=DEFAULT_CONCURRENCY, parallelism=1):
+        """Gets metadata of all objects under a prefix. See iter_metadata.
+
+        Returns:
+            (generator) : dicts with 'Key' and the object's metadata
+        """
+        for key, return_dict in self.iter_metadata(bucket, prefix, regex=regex,
+                workers=workers, parallelism=parallelism):
+            yield {'Key' : key, 'Metadata' : return_dict.get('Metadata', {})}
+
     def __str__(self):
         mem_adr = super.__str__(self)
         return mem_adr + "\nconfig\n-----\n" + \
@@ -614,6 +2008,86 @@ def exit_session(error):
 
 
 
+_END_OF_RANGE = object()
+
+def _put_unless_stopped(_queue, item, stop, timeout=0.1):
+    """Puts item on a bounded queue, giving up once stop is set.
+
+    Returns:
+        (bool) : True if item was queued.
+    """
+    while not stop.is_set():
+        try:
+            _queue.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _new_boto3_session(credentials_file=None):
+    """Returns a boto3 Session reading credentials from credentials_file."""
+    import boto3.session
+    if credentials_file is None:
+        return boto3.session.Session()
+    import botocore.session
+    botocore_session = botocore.session.get_session()
+    botocore_session.set_config_variable('credentials_file', credentials_file)
+    return boto3.session.Session(botocore_session=botocore_session)
+
+# Session of a bulk worker process. See run_tasks.
+_worker_session = None
+
+def _init_worker_session(endpoint_url, credentials_file, verify, client_options, transfer_options, retry_options):
+    """Creates the Session shared by all threads of a worker process."""
+    global _worker_session
+    _worker_session = Session(endpoint_url=endpoint_url, credentials_loc=credentials_file, verify=verify,
+            **client_options, **transfer_options, **retry_options)
+
+def _run_task(session, method, task):
+    """Calls a Session method, catching errors into a result dict."""
+    result = {k: v for k, v in task.items() if isinstance(v, (str, int))}
+    try:
+        getattr(session, method)(**task)
+        result['status'] = 'succeeded'
+    except Exception as e:
+        logger.error('{} failed for {}: {}'.format(method, result, e))
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    return result
+
+def _run_task_batch(method, tasks, workers):
+    """Runs a batch of tasks on the threads of a worker process."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(functools.partial(_run_task, _worker_session, method), tasks))
+
+def _add_task_result(summary, result):
+    summary[result['status']] += 1
+    summary['results'].append(result)
+
+def _batched(iterable, size):
+    """Yields lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+def _bounded_imap(pool, func, iterable, max_pending):
+    """Like pool.map, but only pulls from iterable while fewer than
+    max_pending calls are outstanding. Results are yielded in order.
+
+    max_pending may be a function, called before each new call.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.submit(func, item))
+        limit = max_pending() if callable(max_pending) else max_pending
+        while len(pending) >= limit:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
 def parse_block_size(block_size_str):
     """Gets the divisor for number of bytes given string.
 
@@ -621,12 +2095,7 @@ def parse_block_size(block_size_str):
         '1MB' yields 1000000
 
     """
-    units = {
-            'KB' : 1000,
-            'MB' : 1000000,
-            'GB' : 1000000000,
-            'TB' : 1000000000000,
-            }
+    units = BLOCK_SIZE_UNITS
     if len(block_size_str) < 3:
         print('block_size doesn\'t have enough information')
         print('defaulting to 1KB')
@@ -643,8 +2112,126 @@ def parse_block_size(block_size_str):
     divisor = base_divisor * number
     return divisor
 
-def calculate_s3_etag(file_path, chunk_size=1024*1024*25):
-    import hashlib
+def format_size(size):
+    """Formats a number of bytes in the largest unit of BLOCK_SIZE_UNITS it fills.
+
+    Example:
+        1500000 yields '1.5MB'
+    """
+    for unit, divisor in sorted(BLOCK_SIZE_UNITS.items(), key=lambda x: -x[1]):
+        if size >= divisor:
+            return '{:.1f}{}'.format(size / divisor, unit)
+    return '{}B'.format(size)
+
+def _pattern_regex(regex, glob):
+    """Returns regex, or the regex equivalent of glob."""
+    if glob is None:
+        return regex
+    if regex is not None:
+        error_msg = 'regex and glob can not both be given'
+        logger.error(error_msg)
+        raise ISD_S3_Exception(error_msg)
+    return glob_to_regex(glob)
+
+def _get_content_headers(head):
+    """Returns the CONTENT_HEADERS of a head_object response, as arguments of a copy or upload."""
+    return dict((header, head[header]) for header in CONTENT_HEADERS if header in head)
+
+def _is_ignored(filename, ignore):
+    """Whether filename contains one of the strings of ignore."""
+    return any(ignore_str in filename for ignore_str in ignore)
+
+def _get_local_prefix(local_dir):
+    """Returns the part of the paths of files in local_dir not used in their keys."""
+    if local_dir[-1] != '/':
+        local_dir += '/'
+    junk_path = os.path.dirname(local_dir)
+    if junk_path != '':
+        junk_path += '/'
+    return junk_path
+
+def _usage_group(key, prefix, depth):
+    """Returns prefix plus the first depth '/' separated components of the rest of key.
+
+    Keys with fewer components are their own group.
+    """
+    end = len(prefix)
+    for _ in range(depth):
+        end = key.find('/', end)
+        if end < 0:
+            return key
+        end += 1
+    return key[:end]
+
+def get_client_config(options, client_config=None):
+    """Returns the botocore Config for client options.
+
+    Args:
+        options (dict): config.CLIENT_OPTIONS values.
+        client_config (botocore.config.Config): Config the options are merged into.
+
+    Returns:
+        (botocore.config.Config)
+    """
+    import botocore.config
+    config_args = {}
+    for option in ('max_pool_connections', 'connect_timeout', 'read_timeout', 'tcp_keepalive'):
+        if options.get(option) is not None:
+            config_args[option] = options[option]
+    retries = {}
+    if options.get('max_attempts') is not None:
+        retries['total_max_attempts'] = options['max_attempts']
+    if options.get('retry_mode') is not None:
+        retries['mode'] = options['retry_mode']
+    if len(retries) > 0:
+        config_args['retries'] = retries
+    client_options = botocore.config.Config(**config_args)
+    if client_config is not None:
+        return client_options.merge(client_config)
+    return client_options
+
+def get_chunk_size(size, chunk_size=MULTIPART_CHUNKSIZE):
+    """Returns the part size to transfer size bytes with.
+
+    That is chunk_size, unless size would need more than MAX_PARTS parts,
+    in which case it's the smallest whole MiB that fits. E.g. a 1TiB file
+    has parts of 105MiB instead of 25MiB.
+    """
+    min_chunk_size = -(-size // MAX_PARTS)
+    if min_chunk_size <= chunk_size:
+        return chunk_size
+    mib = 1024*1024
+    return -(-min_chunk_size // mib) * mib
+
+def get_transfer_config(size=0, chunk_size=MULTIPART_CHUNKSIZE, max_concurrency=MAX_TRANSFER_CONCURRENCY):
+    """Returns the TransferConfig for transferring size bytes.
+
+    Uses the same part size as uploads, so objects keep matching
+    calculate_s3_etag. Files below the part size are sent in one request
+    without threads, and no more threads are used than there are parts.
+
+    Args:
+        size (int): Size of the file or object.
+        chunk_size (int): Part size, raised for very large files.
+                          See get_chunk_size.
+        max_concurrency (int): Most parts transferred at once.
+    """
+    from boto3.s3.transfer import TransferConfig
+    chunk_size = get_chunk_size(size, chunk_size)
+    parts = max(1, -(-size // chunk_size))
+    return TransferConfig(
+            use_threads=parts > 1,
+            max_concurrency=max(1, min(max_concurrency, parts)),
+            multipart_threshold=chunk_size,
+            multipart_chunksize=chunk_size)
+
+def calculate_s3_etag(file_path, chunk_size=None):
+    """Returns the ETag S3 gives file_path when uploaded with parts of chunk_size.
+
+    chunk_size defaults to the part size uploads use, see get_chunk_size.
+    """
+    if chunk_size is None:
+        chunk_size = get_chunk_size(os.path.getsize(file_path))
     md5s = []
 
     with open(file_path, 'rb') as fp:
@@ -654,6 +2241,83 @@ def calculate_s3_etag(file_path, chunk_size=1024*1024*25):
                 break
             md5s.append(hashlib.md5(data))
 
+    return _combine_etag(md5s)
+
+def get_part_size(size, etag, chunk_size=MULTIPART_CHUNKSIZE):
+    """Returns the part size an object was most likely uploaded with.
+
+    Objects uploaded with chunk_size or MULTIPART_CHUNKSIZE, as adjusted by
+    get_chunk_size, are recognized from their size and the part count in
+    their ETag. Other multipart objects are assumed to have parts of
+    whole MiB.
+
+    Args:
+        size (int): Size of the object.
+        etag (str): ETag of the object.
+        chunk_size (int): Configured part size.
+    """
+    if '-' not in etag:
+        return get_chunk_size(size, chunk_size)
+    parts = int(etag.strip('"').split('-')[1])
+    for candidate in (chunk_size, MULTIPART_CHUNKSIZE):
+        candidate = get_chunk_size(size, candidate)
+        if -(-size // candidate) == parts:
+            return candidate
+    mib = 1024*1024
+    chunk_size = -(-size // parts)
+    return -(-chunk_size // mib) * mib
+
+def _read_download_journal(journal_file, header):
+    """Reads finished ranges of a download journal.
+
+    Returns:
+        (dict) : md5 of each finished range index, or an empty dict if
+                 the journal is missing or belongs to another download.
+    """
+    finished = {}
+    try:
+        with open(journal_file) as journal:
+            if json.loads(journal.readline()) != header:
+                return {}
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Partially written last line
+                    break
+                finished[entry['index']] = entry['md5']
+    except (OSError, ValueError):
+        return {}
+    return finished
+
+def _read_checkpoint(checkpoint):
+    """Reads the ETag of each copied key from a move checkpoint."""
+    copied = {}
+    if not os.path.exists(checkpoint):
+        return copied
+    with open(checkpoint) as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Partially written last line
+                break
+            copied[entry['Key']] = entry['ETag']
+    return copied
+
+class _HexDigest(object):
+    """Stands in for a hashlib object with a known digest."""
+    def __init__(self, hexdigest):
+        self._hexdigest = hexdigest
+    def hexdigest(self):
+        return self._hexdigest
+    def digest(self):
+        return bytes.fromhex(self._hexdigest)
+
+def _combine_etag(md5s):
+    """Computes the S3 ETag from the md5s of each part."""
+    if len(md5s) == 0:
+        md5s = [hashlib.md5()]
     if len(md5s) == 1:
         return '"{}"'.format(md5s[0].hexdigest())
 
@@ -661,10 +2325,12 @@ def calculate_s3_etag(file_path, chunk_size=1024*1024*25):
     digests_md5 = hashlib.md5(digests)
     return '"{}-{}"'.format(digests_md5.hexdigest(), len(md5s))
 
-def get_md5sum(local_file):
-    import hashlib
-    content_md5 = hashlib.md5(open(local_file,'rb').read()).hexdigest()
-    return content_md5
+def get_md5sum(local_file, chunk_size=MULTIPART_CHUNKSIZE):
+    content_md5 = hashlib.md5()
+    with open(local_file, 'rb') as fp:
+        for data in iter(lambda: fp.read(chunk_size), b''):
+            content_md5.update(data)
+    return content_md5.hexdigest()
 
 def guess_content_type(filename):
     """Based on the filename, guess content-type.
@@ -674,7 +2340,12 @@ def guess_content_type(filename):
 class ISD_S3_Exception(Exception):
     pass
 
+class TransientError(ISD_S3_Exception):
+    """A failure that may pass when the request is repeated, see retry.RetryPolicy."""
+    retryable = True
+
 
 def get_content_type(filename):
     """Get MIME type based on filename"""
+    import mimetypes
     return mimetypes.MimeTypes().guess_type(filename)[0]
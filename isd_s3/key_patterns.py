@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Derives key prefixes from regex and glob patterns.
+
+Key regexes are matched from the start of the key, so their leading
+literal text is a prefix every matching key shares. Listing only those
+prefixes lets the server do the narrowing instead of listing everything
+and filtering on the client. Alternations and small character classes
+expand into several prefixes.
+
+Example usage:
+```
+>>> from isd_s3 import key_patterns
+>>> key_patterns.regex_prefixes(key_patterns.glob_to_regex('ds084.1/201[89]-*/*.nc'))
+['ds084.1/2018-', 'ds084.1/2019-']
+```
+"""
+
+import re
+import logging
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+# Most prefixes a pattern expands into before expansion stops
+MAX_PATTERN_PREFIXES = 64
+
+def glob_to_regex(pattern):
+    """Translates a glob into a regex matching whole keys.
+
+    '*' and '?' don't match '/', '**' does. '[...]' and '[!...]' are
+    character classes.
+
+    Args:
+        pattern (str): glob, e.g. 'ds084.1/2019-*/*.nc'
+
+    Returns:
+        (str) : regex string
+    """
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        elif c == '[' and pattern.find(']', i + 2) > 0:
+            end = pattern.find(']', i + 2)
+            body = pattern[i+1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex.append('[' + body + ']')
+            i = end + 1
+            continue
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return ''.join(regex) + r'\Z'
+
+def regex_prefixes(regex_str, prefix="", max_prefixes=MAX_PATTERN_PREFIXES):
+    """Returns prefixes that every key matched by regex_str starts with.
+
+    Args:
+        regex_str (str): regex matched against the start of keys.
+        prefix (str): Prefix keys must also start with.
+        max_prefixes (int): Stop expanding alternations and character
+                            classes above this many prefixes.
+
+    Returns:
+        (list) : sorted prefixes, none starting with another. Empty if no key
+                 can match both regex_str and prefix.
+    """
+    try:
+        parsed = sre_parse.parse(regex_str)
+    except re.error:
+        return [prefix]
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & sre_parse.SRE_FLAG_IGNORECASE:
+        return [prefix]
+    expanded, _ = _expand(list(parsed), max_prefixes)
+
+    narrowed = []
+    for regex_prefix in expanded:
+        if regex_prefix.startswith(prefix):
+            narrowed.append(regex_prefix)
+        elif prefix.startswith(regex_prefix):
+            narrowed.append(prefix)
+
+    prefixes = []
+    for p in sorted(set(narrowed)):
+        if len(prefixes) == 0 or not p.startswith(prefixes[-1]):
+            prefixes.append(p)
+    return prefixes
+
+def _expand(items, max_prefixes):
+    """Expands the leading literal part of parsed regex items.
+
+    Returns:
+        (tuple) : (list of prefixes, whether items are literal throughout)
+    """
+    prefixes = ['']
+    for i, (op, av) in enumerate(items):
+        if op == sre_parse.LITERAL:
+            choices, complete = [chr(av)], True
+        elif op == sre_parse.IN:
+            choices, complete = _class_chars(av, max_prefixes), True
+            if choices is None:
+                return prefixes, False
+        elif op == sre_parse.SUBPATTERN:
+            if av[1] & sre_parse.SRE_FLAG_IGNORECASE:
+                return prefixes, False
+            choices, complete = _expand(list(av[-1]), max_prefixes)
+        elif op == sre_parse.BRANCH:
+            choices, complete = [], True
+            for branch in av[1]:
+                branch_prefixes, branch_complete = _expand(list(branch), max_prefixes)
+                choices.extend(branch_prefixes)
+                complete = complete and branch_complete
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            # At least one repetition, whatever follows is unknown
+            choices, _ = _expand(list(av[2]), max_prefixes)
+            complete = False
+        elif op == sre_parse.AT and i == 0 and av in (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING):
+            continue
+        else:
+            return prefixes, False
+
+        if len(prefixes) * len(choices) > max_prefixes:
+            return prefixes, False
+        prefixes = [p + c for p in prefixes for c in choices]
+        if not complete:
+            return prefixes, False
+    return prefixes, True
+
+def _class_chars(items, max_chars):
+    """Returns the characters of a character class, or None if too many or negated."""
+    chars = []
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            chars.append(chr(av))
+        elif op == sre_parse.RANGE and av[1] - av[0] < max_chars:
+            chars.extend(chr(c) for c in range(av[0], av[1] + 1))
+        else:
+            return None
+        if len(chars) > max_chars:
+            return None
+    return chars
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""In-process cache of head_object responses.
+
+Entries expire after a TTL and the least recently used entries are evicted
+above a maximum size. Concurrent lookups of the same key wait for a single
+request instead of each sending their own.
+
+Example usage:
+```
+>>> from isd_s3 import isd_s3
+>>> session = isd_s3.Session(metadata_cache_size=10000, metadata_cache_ttl=60)
+>>> session.get_metadata('ds084.1/file.nc')
+>>> session.metadata_cache.stats()
+```
+"""
+
+import copy
+import time
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60
+
+class _Load(object):
+    """A lookup in progress, shared by all threads waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.invalidated = False
+
+class MetadataCache(object):
+
+    def __init__(self, max_size, ttl=DEFAULT_TTL):
+        """MetadataCache constructor
+
+        Args:
+            max_size (int): Maximum number of cached objects.
+            ttl (float): Seconds an entry is used for.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._loads = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits' : 0, 'misses' : 0, 'coalesced' : 0,
+                'expired' : 0, 'evicted' : 0, 'invalidated' : 0}
+
+    def get(self, bucket, key, load):
+        """Returns the cached response for an object, calling load on a miss.
+
+        Args:
+            bucket (str): Name of s3 bucket.
+            key (str): Name of s3 object key.
+            load (func): called without arguments to get the response.
+
+        Returns:
+            (dict) : a copy of the response
+        """
+        cache_key = (bucket, key)
+        owner = False
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                expires, value = entry
+                if time.monotonic() < expires:
+                    self._entries.move_to_end(cache_key)
+                    self._counters['hits'] += 1
+                    return copy.deepcopy(value)
+                del self._entries[cache_key]
+                self._counters['expired'] += 1
+            pending = self._loads.get(cache_key)
+            if pending is not None:
+                self._counters['coalesced'] += 1
+            else:
+                self._counters['misses'] += 1
+                pending = _Load()
+                self._loads[cache_key] = pending
+                owner = True
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return copy.deepcopy(pending.value)
+
+        try:
+            pending.value = load()
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._loads.get(cache_key) is pending:
+                    del self._loads[cache_key]
+                if pending.error is None and not pending.invalidated:
+                    self._store(cache_key, pending.value)
+            pending.done.set()
+        return copy.deepcopy(pending.value)
+
+    def _store(self, cache_key, value):
+        """Adds an entry. Must hold the lock."""
+        self._entries[cache_key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._counters['evicted'] += 1
+
+    def invalidate(self, bucket, key):
+        """Drops an object.
+
+        A lookup in progress may have read the old state, so its result is
+        not stored and later lookups send a new request.
+        """
+        cache_key = (bucket, key)
+        with self._lock:
+            if self._entries.pop(cache_key, None) is not None:
+                self._counters['invalidated'] += 1
+            pending = self._loads.pop(cache_key, None)
+            if pending is not None:
+                pending.invalidated = True
+
+    def clear(self):
+        """Drops all entries."""
+        with self._lock:
+            self._entries.clear()
+            for pending in self._loads.values():
+                pending.invalidated = True
+            self._loads.clear()
+
+    def stats(self):
+        """Returns hit/miss counters and the current size.
+
+        Returns:
+            (dict) : hits, misses, coalesced, expired, evicted, invalidated
+                     and size
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+        return stats
+
+    def __getstate__(self):
+        # Worker processes start with an empty cache
+        state = self.__dict__.copy()
+        state['_entries'] = collections.OrderedDict()
+        state['_loads'] = {}
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Reports progress of transfers.
+
+A Progress is shared by all transfers of a Session, across its worker
+threads. Bytes are counted as they are sent or received, through the
+transfer Callback of boto3 and the ranges of multipart transfers, and
+files as they finish. Bulk operations add the files they will transfer to
+the totals, so the remaining time can be estimated.
+
+Callbacks are called with an event dict, see Progress.snapshot:
+    'progress' : at most once per interval while bytes or files move.
+    'file' : when a file finished, with 'file' and 'status' set.
+    'done' : when an operation finished.
+Events are delivered one at a time, from the thread that caused them.
+
+Example usage:
+```
+>>> from isd_s3 import isd_s3, progress
+>>> def show(event):
+...     print(event['files_done'], event['bytes_per_second'], event['eta'])
+>>> session = isd_s3.Session(progress=show)
+>>> session.upload_mult_objects('/data/ds084.1', recursive=True)
+>>> session = isd_s3.Session(progress=progress.TerminalReporter())
+```
+"""
+
+import sys
+import time
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+# Seconds between 'progress' events
+DEFAULT_INTERVAL = 0.5
+# Seconds of history the current rates are computed over
+RATE_WINDOW = 10
+
+class Progress(object):
+
+    def __init__(self, callback=None, interval=DEFAULT_INTERVAL):
+        """Progress constructor
+
+        Args:
+            callback (func): Called with each event dict.
+            interval (float): Least seconds between 'progress' events.
+        """
+        self.callbacks = []
+        if callback is not None:
+            self.callbacks.append(callback)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._emit_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discards all counts."""
+        with self._lock:
+            self.started = time.monotonic()
+            self.files_total = 0
+            self.files_done = 0
+            self.files_failed = 0
+            self.bytes_total = 0
+            self.bytes_done = 0
+            self._samples = collections.deque([(self.started, 0, 0)])
+            self._last_event = 0
+
+    def add_total(self, files=0, nbytes=0):
+        """Adds files and bytes about to be transferred to the totals."""
+        with self._lock:
+            self.files_total += files
+            self.bytes_total += nbytes
+
+    def add_bytes(self, nbytes):
+        """Counts transferred bytes. Usable as boto3 transfer Callback.
+
+        Args:
+            nbytes (int): Bytes since the last call. Negative when a
+                          transfer is retried.
+        """
+        with self._lock:
+            self.bytes_done += nbytes
+            event = self._due()
+        if event is not None:
+            self._emit(event)
+
+    def file_done(self, name, failed=False, nbytes=0):
+        """Counts a finished file.
+
+        Args:
+            name (str): Local file or key.
+            failed (bool): Whether the transfer failed.
+            nbytes (int): Bytes transferred, if not counted by add_bytes.
+        """
+        with self._lock:
+            self.bytes_done += nbytes
+            if failed:
+                self.files_failed += 1
+            else:
+                self.files_done += 1
+            event = self._due()
+            file_event = self._snapshot('file')
+        file_event['file'] = name
+        file_event['status'] = 'failed' if failed else 'succeeded'
+        self._emit(file_event)
+        if event is not None:
+            self._emit(event)
+
+    def finish(self):
+        """Sends a 'done' event for a finished operation."""
+        with self._lock:
+            event = self._snapshot('done')
+        self._emit(event)
+
+    def snapshot(self, event='progress'):
+        """Returns the current counts and rates.
+
+        Returns:
+            (dict) : 'event', files_done, files_failed, files_total,
+                     bytes_done, bytes_total, elapsed seconds, current
+                     bytes_per_second and files_per_second, and the eta in
+                     seconds, None while unknown.
+        """
+        with self._lock:
+            return self._snapshot(event)
+
+    def _due(self):
+        # Called with the lock held. Returns a 'progress' event once per interval.
+        now = time.monotonic()
+        if now - self._last_event < self.interval:
+            return None
+        self._last_event = now
+        return self._snapshot('progress', now)
+
+    def _snapshot(self, event, now=None):
+        # Called with the lock held
+        if now is None:
+            now = time.monotonic()
+        files = self.files_done + self.files_failed
+        samples = self._samples
+        samples.append((now, self.bytes_done, files))
+        while len(samples) > 2 and now - samples[1][0] >= RATE_WINDOW:
+            samples.popleft()
+        start, start_bytes, start_files = samples[0]
+        seconds = now - start
+        bytes_per_second = files_per_second = 0
+        if seconds > 0:
+            bytes_per_second = (self.bytes_done - start_bytes) / seconds
+            files_per_second = (files - start_files) / seconds
+
+        eta = None
+        if self.bytes_total > 0 and bytes_per_second > 0:
+            eta = max(0, self.bytes_total - self.bytes_done) / bytes_per_second
+        elif self.files_total > 0 and files_per_second > 0:
+            eta = max(0, self.files_total - files) / files_per_second
+        return {'event' : event,
+                'files_done' : self.files_done,
+                'files_failed' : self.files_failed,
+                'files_total' : self.files_total,
+                'bytes_done' : self.bytes_done,
+                'bytes_total' : self.bytes_total,
+                'elapsed' : now - self.started,
+                'bytes_per_second' : bytes_per_second,
+                'files_per_second' : files_per_second,
+                'eta' : eta}
+
+    def _emit(self, event):
+        with self._emit_lock:
+            for callback in self.callbacks:
+                try:
+                    callback(event)
+                except Exception:
+                    logger.exception('Progress callback failed')
+
+class TerminalReporter(object):
+
+    def __init__(self, stream=None, interval=1):
+        """Prints progress events as a single status line.
+
+        On a terminal the line is redrawn in place, otherwise a line is
+        written every interval seconds.
+
+        Args:
+            stream (file): Where to write. Default sys.stderr
+            interval (float): Least seconds between lines.
+        """
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self._last = 0
+        self._width = 0
+        self._tty = self.stream.isatty()
+
+    def __call__(self, event):
+        if event['event'] == 'file':
+            return
+        now = time.monotonic()
+        done = event['event'] == 'done'
+        if not done and now - self._last < (0 if self._tty else self.interval):
+            return
+        self._last = now
+        line = format_event(event)
+        if self._tty:
+            self.stream.write('\r' + line.ljust(self._width) + ('\n' if done else ''))
+            self._width = 0 if done else len(line)
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+def format_event(event):
+    """Returns a one line summary of a progress event."""
+    files = '{} files'.format(event['files_done'])
+    if event['files_total'] > 0:
+        files = '{}/{} files'.format(event['files_done'], event['files_total'])
+    if event['files_failed'] > 0:
+        files += ', {} failed'.format(event['files_failed'])
+    transferred = _format_bytes(event['bytes_done'])
+    if event['bytes_total'] > 0:
+        transferred += '/' + _format_bytes(event['bytes_total'])
+    rates = '{}/s, {:.1f} files/s'.format(_format_bytes(event['bytes_per_second']),
+            event['files_per_second'])
+    if event['event'] == 'done':
+        return '{}, {} in {}'.format(files, transferred, _format_seconds(event['elapsed']))
+    eta = 'ETA ' + (_format_seconds(event['eta']) if event['eta'] is not None else '?')
+    return '{}, {}, {}, {}'.format(files, transferred, rates, eta)
+
+def _format_bytes(nbytes):
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(nbytes) < 1024 or unit == 'TiB':
+            return '{:.0f}{}'.format(nbytes, unit) if unit == 'B' else '{:.1f}{}'.format(nbytes, unit)
+        nbytes /= 1024
+
+def _format_seconds(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Retries failed requests with exponential backoff and jitter.
+
+botocore already retries each request a few times, see the max_attempts
+and retry_mode client options. A RetryPolicy covers what it can't:
+- requests that still fail after botocore's attempts, e.g. while a server
+  keeps answering 503 SlowDown under load;
+- connections that break while a response body is read;
+- multipart parts whose ETag doesn't match the data sent;
+- keys that a DeleteObjects request reports as failed.
+
+Only the failed request is repeated: one part, one range, one page of a
+listing or the failed keys of a batch, never the whole object. All
+retries of one operation, e.g. a transfer, a listing or a delete, draw
+from a shared budget, so a failing server isn't flooded with retries.
+
+Example usage:
+```
+>>> from isd_s3 import isd_s3
+>>> session = isd_s3.Session(retry_attempts=5, retry_budget=50)
+>>> session.retry_policy.call(lambda: session.client.head_bucket(Bucket='rda-data'))
+```
+"""
+
+import time
+import random
+import logging
+import threading
+import botocore.exceptions
+
+logger = logging.getLogger(__name__)
+
+# Attempts per request, including the first
+DEFAULT_ATTEMPTS = 3
+# Retries per operation, shared by its requests
+DEFAULT_BUDGET = 10
+# Seconds the first retry waits at most, doubled for each further retry
+DEFAULT_BASE_DELAY = 0.5
+# Most seconds a retry waits
+DEFAULT_MAX_DELAY = 20
+# Error codes worth retrying
+RETRYABLE_CODES = frozenset((
+        'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+        'TooManyRequestsException', 'RequestThrottled', 'BandwidthLimitExceeded',
+        'InternalError', 'ServiceUnavailable', 'RequestTimeout', 'OperationAborted'))
+RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504))
+
+class RetryBudget(object):
+    """Retries left for one operation. Shared by threads."""
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Uses up one retry. Returns False if none are left."""
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+class RetryPolicy(object):
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, budget=DEFAULT_BUDGET, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        """RetryPolicy constructor
+
+        Args:
+            attempts (int): Attempts per request, including the first.
+                            1 disables retries.
+            budget (int): Retries per operation, shared by its requests.
+            base_delay (float): Seconds the first retry waits at most.
+            max_delay (float): Most seconds any retry waits.
+        """
+        self.attempts = max(1, attempts)
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def new_budget(self):
+        """Returns the budget of a new operation."""
+        return RetryBudget(self.budget)
+
+    def get_delay(self, attempt):
+        """Returns the seconds to wait before retrying after attempt.
+
+        Full jitter: a random delay up to base_delay * 2 ** (attempt - 1),
+        capped at max_delay, so clients that failed together don't retry
+        together.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def is_retryable(self, error):
+        """Returns whether error may pass when the request is repeated."""
+        if getattr(error, 'retryable', False):
+            return True
+        if isinstance(error, botocore.exceptions.ClientError):
+            response = error.response
+            return (response.get('Error', {}).get('Code') in RETRYABLE_CODES or
+                    response.get('ResponseMetadata', {}).get('HTTPStatusCode') in RETRYABLE_STATUS)
+        return isinstance(error, (botocore.exceptions.HTTPClientError,
+                botocore.exceptions.ConnectionError,
+                botocore.exceptions.IncompleteReadError))
+
+    def should_retry(self, error, attempt, budget=None):
+        """Returns whether to retry a request that failed with error.
+
+        Args:
+            error (Exception): What attempt failed with.
+            attempt (int): Attempts made so far.
+            budget (RetryBudget): Budget of the operation. A retry uses
+                                  one up. Default no limit.
+        """
+        if attempt >= self.attempts or not self.is_retryable(error):
+            return False
+        return budget is None or budget.take()
+
+    def call(self, func, budget=None, description=None):
+        """Calls func, retrying retryable errors.
+
+        Args:
+            func (func): Called without arguments. Has to be safe to repeat.
+            budget (RetryBudget): Budget of the operation. Default a new one.
+            description (str): What func does, for log messages.
+
+        Returns:
+            Result of func.
+
+        Raises:
+            The error of the last attempt.
+        """
+        if budget is None:
+            budget = self.new_budget()
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if not self.should_retry(e, attempt, budget):
+                    raise
+                delay = self.get_delay(attempt)
+                logger.info('Retrying {} in {:.2f}s after attempt {}: {}'.format(
+                        description or getattr(func, '__name__', 'request'), delay, attempt, e))
+                time.sleep(delay)
+                attempt += 1
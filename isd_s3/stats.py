@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Collects request and operation statistics of a Session.
+
+Requests are counted through botocore event hooks on the Session's client,
+per API: calls, attempts, retries, errors, throttling responses, bytes
+sent and received, and a latency histogram. Local work that can dominate
+bulk jobs, like hashing files and walking directories, is timed as
+operations.
+
+Example usage:
+```
+>>> from isd_s3 import isd_s3
+>>> session = isd_s3.Session(stats=True)
+>>> session.upload_mult_objects('/data/ds084.1', recursive=True)
+>>> print(session.stats.summary())
+>>> session.stats.to_dict()['requests']['PutObject']['retries']
+```
+"""
+
+import time
+import bisect
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Error codes of throttling responses, as retried by botocore
+THROTTLING_CODES = frozenset((
+        'SlowDown', 'Throttling', 'ThrottlingException', 'ThrottledException',
+        'RequestThrottledException', 'TooManyRequestsException',
+        'RequestLimitExceeded', 'BandwidthLimitExceeded', 'RequestThrottled',
+        'ProvisionedThroughputExceededException', 'PriorRequestNotComplete'))
+THROTTLING_STATUS = 429
+# Key of the call start time in the botocore request context
+_CONTEXT_START = 'isd_s3_stats_start'
+# Prefix of OpenMetrics metric names
+METRIC_PREFIX = 'isd_s3'
+
+class Histogram(object):
+    """Counts of observed values per bucket, with their sum."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Returns (upper bound, count of values <= bound) per bucket,
+        ending with infinity.
+        """
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding quantile q."""
+        if self.count == 0:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+    def to_dict(self):
+        return {'count' : self.count,
+                'sum' : self.sum,
+                'buckets' : dict((_format_bound(bound), total) for bound, total in self.cumulative())}
+
+class SessionStats(object):
+
+    def __init__(self):
+        """SessionStats constructor
+
+        Counts are kept until reset. Safe to update from many threads.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discards everything counted so far."""
+        with self._lock:
+            self.started = time.time()
+            self._requests = {}
+            self._operations = {}
+
+    def register(self, events):
+        """Registers the hooks counting requests.
+
+        Args:
+            events (botocore.hooks.HierarchicalEmitter): Events of the
+                   client, client.meta.events. Every request of the client
+                   is counted, so it shouldn't be shared with other Sessions.
+        """
+        events.register('before-call.s3', self._before_call)
+        events.register('before-send.s3', self._before_send)
+        events.register('response-received.s3', self._response_received)
+        events.register('after-call.s3', self._after_call)
+        events.register('after-call-error.s3', self._after_call_error)
+
+    def _request(self, api):
+        # Called with the lock held
+        request = self._requests.get(api)
+        if request is None:
+            request = {'calls' : 0, 'attempts' : 0, 'retries' : 0, 'errors' : 0,
+                    'throttled' : 0, 'bytes_sent' : 0, 'bytes_received' : 0,
+                    'latency' : Histogram()}
+            self._requests[api] = request
+        return request
+
+    def _before_call(self, context, **kwargs):
+        context[_CONTEXT_START] = time.perf_counter()
+
+    def _before_send(self, event_name, request, **kwargs):
+        # Sent once per attempt, so retried bodies are counted again
+        nbytes = int(request.headers.get('Content-Length', 0))
+        with self._lock:
+            self._request(_api_name(event_name))['bytes_sent'] += nbytes
+
+    def _response_received(self, event_name, response_dict, parsed_response, exception, **kwargs):
+        api = _api_name(event_name)
+        throttled = False
+        nbytes = 0
+        if response_dict is not None:
+            # Responses to HEAD requests have the length of the object, but no body
+            if not api.startswith('Head'):
+                nbytes = int(response_dict['headers'].get('content-length', 0))
+            code = (parsed_response or {}).get('Error', {}).get('Code')
+            throttled = response_dict['status_code'] == THROTTLING_STATUS or code in THROTTLING_CODES
+        with self._lock:
+            request = self._request(api)
+            request['attempts'] += 1
+            request['bytes_received'] += nbytes
+            if throttled:
+                request['throttled'] += 1
+
+    def _after_call(self, event_name, http_response, context, **kwargs):
+        self._end_call(event_name, context, http_response.status_code >= 300)
+
+    def _after_call_error(self, event_name, context, **kwargs):
+        self._end_call(event_name, context, True)
+
+    def _end_call(self, event_name, context, failed):
+        start = context.get(_CONTEXT_START)
+        retries = context.get('retries', {}).get('attempt', 1) - 1
+        with self._lock:
+            request = self._request(_api_name(event_name))
+            request['calls'] += 1
+            request['retries'] += retries
+            if failed:
+                request['errors'] += 1
+            if start is not None:
+                request['latency'].observe(time.perf_counter() - start)
+
+    def record(self, operation, seconds, nbytes=0):
+        """Records a local operation.
+
+        Args:
+            operation (str): Name of the operation, e.g. 'etag'.
+            seconds (float): Time it took.
+            nbytes (int): Bytes it processed.
+        """
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = {'calls' : 0, 'bytes' : 0, 'latency' : Histogram()}
+                self._operations[operation] = stats
+            stats['calls'] += 1
+            stats['bytes'] += nbytes
+            stats['latency'].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, operation, nbytes=0):
+        """Records the time of the with block as operation."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(operation, time.perf_counter() - start, nbytes)
+
+    def to_dict(self):
+        """Returns everything counted.
+
+        Returns:
+            (dict) : 'requests' and 'operations' by name, with the elapsed
+                     seconds since the stats were started or reset.
+                     Latencies are histograms with cumulative counts per
+                     upper bound in seconds.
+        """
+        with self._lock:
+            requests = {}
+            for api, request in self._requests.items():
+                requests[api] = dict(request, latency=request['latency'].to_dict())
+            operations = {}
+            for operation, stats in self._operations.items():
+                operations[operation] = dict(stats, latency=stats['latency'].to_dict())
+            return {'elapsed' : time.time() - self.started,
+                    'requests' : requests,
+                    'operations' : operations}
+
+    def summary(self):
+        """Returns a table of requests and operations, for people."""
+        row = '{:<26} {:>8} {:>7} {:>7} {:>9} {:>10} {:>10} {:>8} {:>8}'
+        op_row = '{:<26} {:>8} {:>10} {:>8} {:>8} {:>10}'
+        with self._lock:
+            lines = ['Requests ({:.1f}s)'.format(time.time() - self.started),
+                    row.format('api', 'calls', 'retries', 'errors', 'throttled',
+                        'sent', 'received', 'mean', 'p99')]
+            for api, request in sorted(self._requests.items()):
+                lines.append(row.format(api, request['calls'], request['retries'],
+                    request['errors'], request['throttled'],
+                    _format_bytes(request['bytes_sent']), _format_bytes(request['bytes_received']),
+                    *_format_latency(request['latency'])))
+            if len(self._operations) > 0:
+                lines.append('')
+                lines.append(op_row.format('operation', 'calls', 'bytes', 'mean', 'p99', 'total'))
+                for operation, stats in sorted(self._operations.items()):
+                    lines.append(op_row.format(operation, stats['calls'],
+                        _format_bytes(stats['bytes']), *_format_latency(stats['latency']),
+                        '{:.2f}s'.format(stats['latency'].sum)))
+        return '\n'.join(lines)
+
+    def to_openmetrics(self):
+        """Returns the stats in the OpenMetrics text format."""
+        stats = self.to_dict()
+        lines = []
+        def family(name, metric_type, help_text, samples):
+            name = '{}_{}'.format(METRIC_PREFIX, name)
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            lines.append('# HELP {} {}'.format(name, help_text))
+            for suffix, labels, value in samples:
+                label_str = ','.join('{}="{}"'.format(k, v) for k, v in labels)
+                lines.append('{}{}{{{}}} {}'.format(name, suffix, label_str, value))
+
+        requests = sorted(stats['requests'].items())
+        for counter, help_text in (('calls', 'API calls.'),
+                ('attempts', 'HTTP requests, including retries.'),
+                ('retries', 'Retried HTTP requests.'),
+                ('errors', 'API calls that failed.'),
+                ('throttled', 'Throttling responses.'),
+                ('bytes_sent', 'Bytes of request bodies.'),
+                ('bytes_received', 'Bytes of response bodies.')):
+            family('requests_' + counter, 'counter', help_text,
+                    [('_total', [('api', api)], request[counter]) for api, request in requests])
+        family('request_seconds', 'histogram', 'Latency of API calls, including retries.',
+                _histogram_samples('api', requests))
+
+        operations = sorted(stats['operations'].items())
+        family('operations_bytes', 'counter', 'Bytes processed by local operations.',
+                [('_total', [('operation', name)], op['bytes']) for name, op in operations])
+        family('operation_seconds', 'histogram', 'Time of local operations.',
+                _histogram_samples('operation', operations))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+def _histogram_samples(label, items):
+    samples = []
+    for name, stats in items:
+        latency = stats['latency']
+        for bound, total in latency['buckets'].items():
+            samples.append(('_bucket', [(label, name), ('le', bound)], total))
+        samples.append(('_count', [(label, name)], latency['count']))
+        samples.append(('_sum', [(label, name)], latency['sum']))
+    return samples
+
+def _api_name(event_name):
+    # e.g. 'after-call.s3.PutObject'
+    return event_name.rsplit('.', 1)[-1]
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else str(bound)
+
+def _format_latency(histogram):
+    if histogram.count == 0:
+        return '-', '-'
+    p99 = histogram.quantile(0.99)
+    p99 = '>{}s'.format(histogram.bounds[-1]) if p99 == float('inf') else '{}s'.format(p99)
+    return '{:.3f}s'.format(histogram.sum / histogram.count), p99
+
+def _format_bytes(nbytes):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if nbytes < 1024:
+            return '{:.0f}{}'.format(nbytes, unit) if unit == 'B' else '{:.1f}{}'.format(nbytes, unit)
+        nbytes /= 1024
+    return '{:.1f}TiB'.format(nbytes)
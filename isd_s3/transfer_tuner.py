@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Tunes the number of parts transferred at once from measured throughput.
+
+Parts are timed as they finish. Once a window of parts is done, the
+aggregate throughput of the window is compared with the previous one and
+the concurrency is moved one step, keeping its direction while throughput
+improves and reversing it when throughput drops. Part sizes are never
+changed, so ETags computed with the configured chunk size stay valid.
+
+Example usage:
+```
+>>> from isd_s3 import isd_s3
+>>> session = isd_s3.Session(adaptive_transfers=True)
+>>> session.upload_mult_objects('/data/ds084.1', recursive=True)
+>>> session.transfer_tuner.stats()
+```
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# A window is this many parts per part in flight
+PARTS_PER_WINDOW = 2
+# Relative throughput drop that reverses the direction
+TOLERANCE = 0.05
+# Seconds without a finished part after which a window restarts
+IDLE_SECONDS = 2
+
+class TransferTuner(object):
+
+    def __init__(self, max_concurrency, min_concurrency=1):
+        """TransferTuner constructor
+
+        Args:
+            max_concurrency (int): Most parts in flight. Also the start value.
+            min_concurrency (int): Fewest parts in flight.
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.concurrency = max_concurrency
+        self._direction = -1
+        self._lock = threading.Lock()
+        self._window_start = None
+        self._window_bytes = 0
+        self._window_parts = 0
+        self._last_part = None
+        self._throughput = None
+        self._part_bytes = 0
+        self._part_seconds = 0
+
+    def get_concurrency(self):
+        """Returns the number of parts to keep in flight."""
+        return self.concurrency
+
+    def record(self, nbytes, seconds):
+        """Records a finished part.
+
+        Args:
+            nbytes (int): Size of the part.
+            seconds (float): Time the part took.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._part_bytes += nbytes
+            self._part_seconds += seconds
+            if self._last_part is None or now - self._last_part > IDLE_SECONDS:
+                self._window_start = now - seconds
+                self._window_bytes = 0
+                self._window_parts = 0
+            self._last_part = now
+            self._window_bytes += nbytes
+            self._window_parts += 1
+            if self._window_parts < self.concurrency * PARTS_PER_WINDOW:
+                return
+            previous = self.concurrency
+            throughput = self._window_bytes / max(now - self._window_start, 1e-6)
+            if self._throughput is not None and throughput < self._throughput * (1 - TOLERANCE):
+                self._direction = -self._direction
+            self._throughput = throughput
+            concurrency = self.concurrency + self._direction
+            if concurrency < self.min_concurrency or concurrency > self.max_concurrency:
+                self._direction = -self._direction
+                concurrency = self.concurrency + self._direction
+            self.concurrency = max(self.min_concurrency, min(self.max_concurrency, concurrency))
+            logger.debug('{:.0f} B/s with {} parts in flight, now {}'.format(
+                    throughput, previous, self.concurrency))
+            self._window_start = now
+            self._window_bytes = 0
+            self._window_parts = 0
+
+    def stats(self):
+        """Returns the current concurrency and measured throughput.
+
+        Returns:
+            (dict) : concurrency, throughput of the last window and mean
+                     throughput of a single part, in bytes per second.
+        """
+        with self._lock:
+            part_throughput = None
+            if self._part_seconds > 0:
+                part_throughput = self._part_bytes / self._part_seconds
+            return {'concurrency' : self.concurrency,
+                    'throughput' : self._throughput,
+                    'part_throughput' : part_throughput}
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Test AsyncSession against the S3 stand-in of the benchmarks.
+
+Needs no bucket or credentials.
+"""
+import sys
+import os
+import time
+import asyncio
+import inspect
+import shutil
+import tempfile
+import botocore.exceptions
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from isd_s3 import async_session
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+# More than fit in one batch of the iterator, see async_session.ITER_BATCH_SIZE
+KEYS = ['list/{:05d}'.format(i) for i in range(2500)]
+
+server = None
+tmpdir = None
+
+def setup_module():
+    global server, tmpdir
+    server = fake_s3.FakeS3Server(buckets=(BUCKET,)).start()
+    for key in KEYS:
+        server.put(BUCKET, key, key.encode())
+    tmpdir = tempfile.mkdtemp()
+
+def teardown_module():
+    server.stop()
+    shutil.rmtree(tmpdir)
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def new_session(**kwargs):
+    server.faults = []
+    return async_session.AsyncSession(endpoint_url=server.url, default_bucket=BUCKET,
+            etag_cache=False, bucket_index=False, max_attempts=1, retry_attempts=1, **kwargs)
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_iter_keys():
+    async def main():
+        async with new_session() as session:
+            keys = [key async for key in session.iter_keys(prefix='list/')]
+            assert keys == KEYS
+            objects = [o async for o in session.iter_objects(prefix='list/', parallelism=4)]
+            assert [o['Key'] for o in objects] == KEYS
+            assert objects[0]['Size'] == len(KEYS[0])
+            # Stopping early doesn't list the rest
+            server.reset_counts()
+            async for key in session.iter_keys(prefix='list/'):
+                break
+            assert server.reset_counts()['ListObjectsV2'] == 1
+            assert len(await session.list_objects(prefix='list/', keys_only=True)) == len(KEYS)
+    run(main())
+    passed()
+
+def test_own_client():
+    session = new_session()
+    shared = isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+            bucket_index=False, max_attempts=1, max_pool_connections=session.concurrency)
+    other = new_session()
+    assert session.session.client is not shared.client
+    assert other.session.client is not session.session.client
+    run(session.close())
+    run(other.close())
+    passed()
+
+def test_loop_not_blocked():
+    async def main():
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.ensure_future(tick())
+        async with new_session() as session:
+            await asyncio.gather(*[session.get_metadata(k) for k in KEYS[:50]])
+        ticker.cancel()
+        assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.05
+    latency, server.latency = server.latency, 0.05
+    try:
+        run(main())
+    finally:
+        server.latency = latency
+    passed()
+
+def test_get_and_put():
+    async def main():
+        async with new_session(concurrency=4) as session:
+            paths = []
+            for i in range(10):
+                path = os.path.join(tmpdir, 'put{}'.format(i))
+                with open(path, 'wb') as fh:
+                    fh.write(os.urandom(1000 + i))
+                paths.append(path)
+            await asyncio.gather(*[session.upload_object(p, 'put/' + os.path.basename(p), metadata={'n' : str(i)})
+                    for i, p in enumerate(paths)])
+            metadata = await asyncio.gather(*[session.get_metadata('put/put{}'.format(i)) for i in range(10)])
+            assert [m['ContentLength'] for m in metadata] == [1000 + i for i in range(10)]
+            assert metadata[3]['Metadata']['n'] == '3'
+
+            local_dir = tempfile.mkdtemp(dir=tmpdir)
+            await asyncio.gather(*[session.get_object('put/put{}'.format(i), local_dir=local_dir)
+                    for i in range(10)])
+            for path in paths:
+                with open(path, 'rb') as fh, open(os.path.join(local_dir, os.path.basename(path)), 'rb') as got:
+                    assert fh.read() == got.read()
+            assert (await session.verify_object(paths[0], 'put/put0'))['match']
+
+            found = [m async for m in session.get_metadata_mult('put/')]
+            assert [m['Key'] for m in found] == ['put/put{}'.format(i) for i in range(10)]
+            result = await session.delete(['put/put{}'.format(i) for i in range(10)])
+            assert result == {'deleted' : 10, 'errors' : []}
+            assert await session.list_objects(prefix='put/') == []
+    run(main())
+    passed()
+
+def test_errors():
+    async def main():
+        async with new_session() as session:
+            try:
+                await session.get_metadata('missing')
+                assert False
+            except botocore.exceptions.ClientError as e:
+                assert e.response['Error']['Code'] == '404'
+
+            # One failing request doesn't affect the others
+            results = await asyncio.gather(session.get_metadata(KEYS[0]),
+                    session.get_metadata('missing'), session.get_metadata(KEYS[1]),
+                    return_exceptions=True)
+            assert results[0]['ContentLength'] == len(KEYS[0])
+            assert isinstance(results[1], botocore.exceptions.ClientError)
+            assert results[2]['ContentLength'] == len(KEYS[1])
+
+            try:
+                await session.upload_object(os.path.join(tmpdir, 'missing'), 'missing')
+                assert False
+            except Exception as e:
+                assert not isinstance(e, AssertionError)
+
+            # Errors of a later listing page reach the async for
+            server.add_fault('ListObjectsV2', status=403, code='AccessDenied', after=1)
+            keys = []
+            try:
+                async for key in session.iter_keys(prefix='list/'):
+                    keys.append(key)
+                assert False
+            except botocore.exceptions.ClientError as e:
+                assert e.response['Error']['Code'] == 'AccessDenied'
+            assert keys == KEYS[:1000]
+
+            server.add_fault('HeadObject', status=403, code='AccessDenied', after=5)
+            try:
+                async for _ in session.get_metadata_mult('list/'):
+                    pass
+                assert False
+            except botocore.exceptions.ClientError as e:
+                # HEAD responses have no body with an error code
+                assert e.response['Error']['Code'] == '403'
+
+            # The session is still usable
+            assert (await session.get_metadata(KEYS[0]))['ContentLength'] == len(KEYS[0])
+    run(main())
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
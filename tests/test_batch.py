@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Test json batches, locally and on the daemon, against the S3 stand-in of
+the benchmarks.
+
+Needs no bucket or credentials.
+"""
+import sys
+import os
+import json
+import time
+import inspect
+import tempfile
+import threading
+import subprocess
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import __main__ as main
+from isd_s3 import daemon
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+
+OTHER_BUCKET = 'other'
+
+server = None
+tmpdir = None
+socket_file = None
+runner = None
+
+def setup_module():
+    global server, tmpdir, socket_file, runner
+    server = fake_s3.FakeS3Server(buckets=(BUCKET, OTHER_BUCKET)).start()
+    server.put(BUCKET, 'a', b'a')
+    tmpdir = tempfile.mkdtemp()
+    socket_file = os.path.join(tmpdir, 'isd_s3.sock')
+    runner = main.BatchRunner(2)
+    # serve runs until interrupted, so the daemon thread ends with the process
+    threading.Thread(target=daemon.serve, args=(runner.run, socket_file), daemon=True).start()
+    while not daemon.is_running(socket_file):
+        time.sleep(0.01)
+
+def teardown_module():
+    server.stop()
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def by_index(statuses):
+    return sorted(statuses, key=lambda x: x['index'])
+
+def bad_batch():
+    """Entries that can't be turned into arguments, and valid ones after them."""
+    return [{'no_command' : 'x'}, 'junk', ['--s3_url', server.url, 'gm', '-k', 'a', '-b', BUCKET],
+            {'command' : 'gm', '--s3_url' : server.url, '--key' : 'a', '--bucket' : BUCKET}]
+
+def check_bad_batch(statuses):
+    statuses = by_index(statuses)
+    assert [s['status'] for s in statuses] == ['error', 'error', 'ok', 'ok'], statuses
+    assert 'command' in statuses[0]['error'] and 'junk' in statuses[1]['error']
+    assert statuses[3]['result']['ContentLength'] == 1
+
+def test_bad_entries_local():
+    os.environ[main.config.ISD_S3_SOCKET] = 'none'
+    try:
+        assert main._forward(bad_batch(), batch=True) is None
+        check_bad_batch(main.run_batch(bad_batch()))
+    finally:
+        del os.environ[main.config.ISD_S3_SOCKET]
+    passed()
+
+def test_bad_entries_forwarded():
+    os.environ[main.config.ISD_S3_SOCKET] = socket_file
+    try:
+        statuses = main._forward(bad_batch(), batch=True)
+        assert statuses is not None
+        check_bad_batch(statuses)
+    finally:
+        del os.environ[main.config.ISD_S3_SOCKET]
+    passed()
+
+def access_key(session):
+    credentials = session.client._request_signer._credentials
+    return credentials and credentials.access_key
+
+def test_credentials_not_shared():
+    files = {}
+    for name in ('a', 'b'):
+        files[name] = os.path.join(tmpdir, name + '.credentials')
+        with open(files[name], 'w') as fh:
+            fh.write('[default]\naws_access_key_id = {0}\naws_secret_access_key = {0}\n'.format(name))
+    saved = {k : os.environ.pop(k, None) for k in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY')}
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = files['a']
+    os.environ['AWS_EC2_METADATA_DISABLED'] = 'true'
+    try:
+        parser = main._get_parser()
+        # Sessions of the other tests use the credentials in the environment
+        local_runner = main.BatchRunner(1)
+        sessions = []
+        for command in (['-cf', files['b'], 'lb'], ['lb'], ['-cf', files['b'], 'lb'], ['lb']):
+            args = main._prepare_batch_command(parser, ['--s3_url', server.url] + command)
+            sessions.append(local_runner._get_session(args))
+        # Commands without -cf keep the credentials of the process
+        assert [access_key(s) for s in sessions] == ['b', 'a', 'b', 'a']
+        assert sessions[0] is sessions[2] and sessions[1] is sessions[3]
+        assert os.environ['AWS_SHARED_CREDENTIALS_FILE'] == files['a']
+        local_runner.close()
+    finally:
+        for k, v in saved.items():
+            if v is not None:
+                os.environ[k] = v
+        del os.environ['AWS_SHARED_CREDENTIALS_FILE']
+    passed()
+
+def test_default_bucket():
+    server.put(BUCKET, 'b', b'b')
+    # Left in the environment by an earlier Session of the process
+    os.environ[main.config.ISD_S3_DEFAULT_BUCKET] = OTHER_BUCKET
+    try:
+        common = ['--s3_url', server.url, '--default_bucket', BUCKET]
+        commands = [common + ['gm', '-k', 'a'],
+                common + ['cp', '-k', 'a', '-dk', 'copied'],
+                common + ['mv', '-k', 'b', '-dk', 'moved']]
+        statuses = by_index(main.run_batch(commands))
+        assert [s['status'] for s in statuses] == ['ok', 'ok', 'ok'], statuses
+    finally:
+        del os.environ[main.config.ISD_S3_DEFAULT_BUCKET]
+    objects = server.buckets[BUCKET]
+    assert objects['copied']['Body'] == b'a' and objects['moved']['Body'] == b'b'
+    assert 'b' not in objects and server.buckets[OTHER_BUCKET] == {}
+    for key in ('copied', 'moved'):
+        objects.pop(key)
+    passed()
+
+def test_forwarded_paths():
+    client_dir = tempfile.mkdtemp(dir=tmpdir)
+    os.mkdir(os.path.join(client_dir, 'data'))
+    with open(os.path.join(client_dir, 'data', 'file.txt'), 'w') as fh:
+        fh.write('file')
+    with open(os.path.join(client_dir, 'metadata.sh'), 'w') as fh:
+        fh.write('#!/bin/sh\necho \'{"script" : "ran"}\'\n')
+    os.chmod(os.path.join(client_dir, 'metadata.sh'), 0o755)
+    common = ['--s3_url', server.url, '--default_bucket', BUCKET]
+    commands = [common + ['um', '-ld', 'data', '-kp', 'paths/', '-md', 'metadata.sh'],
+            common + ['um', '-ld', 'data', '-kp', 'json/', '-md', '{"json" : "kept"}']]
+    statuses = by_index(daemon.request(commands, cwd=client_dir, socket_file=socket_file))
+    assert [s['status'] for s in statuses] == ['ok', 'ok'], statuses
+    objects = server.buckets[BUCKET]
+    assert objects['paths/file.txt']['Metadata']['script'] == 'ran'
+    assert objects['json/file.txt']['Metadata']['json'] == 'kept'
+
+    # A checkpoint in the client's directory marking the object as copied
+    checkpoint = os.path.join(client_dir, 'moves')
+    with open(checkpoint, 'w') as fh:
+        fh.write(json.dumps({'Key' : 'paths/file.txt', 'ETag' : objects['paths/file.txt']['ETag']}) + '\n')
+    statuses = list(daemon.request([common + ['mv', '-k', 'paths/', '-dk', 'moved/', '-cp', 'moves']],
+            cwd=client_dir, socket_file=socket_file))
+    assert statuses[0]['status'] == 'ok', statuses
+    assert 'moved/file.txt' not in objects and 'paths/file.txt' not in objects
+    assert not os.path.exists(checkpoint)
+    objects.pop('json/file.txt')
+    passed()
+
+def test_environment_mismatch():
+    env = main.config.get_command_environment()
+    command = ['--s3_url', server.url, 'gm', '-k', 'a', '-b', BUCKET]
+    statuses = list(daemon.request([command], socket_file=socket_file, env=env))
+    assert statuses[0]['status'] == 'ok'
+    for changed in (dict(env, AWS_PROFILE='other'), dict(env, ISD_S3_RETRY_ATTEMPTS='1')):
+        try:
+            daemon.request([command], socket_file=socket_file, env=changed)
+            assert False
+        except daemon.EnvironmentMismatch as e:
+            assert 'AWS_PROFILE' in str(e) or 'ISD_S3_RETRY_ATTEMPTS' in str(e)
+    # Variables passed with each command may differ
+    statuses = list(daemon.request([command], socket_file=socket_file,
+            env=dict(env, AWS_SHARED_CREDENTIALS_FILE='/other', ISD_S3_DEFAULT_BUCKET='other')))
+    assert statuses[0]['status'] == 'ok'
+
+    # A daemon started with other settings leaves the command to this process
+    other_socket = os.path.join(tmpdir, 'other.sock')
+    daemon_env = dict(os.environ, ISD_S3_SOCKET=other_socket, ISD_S3_RETRY_ATTEMPTS='2')
+    process = subprocess.Popen([sys.executable, '-m', 'isd_s3', 'serve'], cwd=PACKAGE_DIR,
+            env=daemon_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ[main.config.ISD_S3_SOCKET] = other_socket
+    try:
+        while not daemon.is_running(other_socket):
+            assert process.poll() is None
+            time.sleep(0.05)
+        assert main._forward([command]) is None
+        os.environ['ISD_S3_RETRY_ATTEMPTS'] = '2'
+        assert list(main._forward([command]))[0]['status'] == 'ok'
+    finally:
+        os.environ.pop('ISD_S3_RETRY_ATTEMPTS', None)
+        del os.environ[main.config.ISD_S3_SOCKET]
+        process.terminate()
+        process.wait()
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Test the bucket index against the S3 stand-in of the benchmarks.
+
+Needs no bucket or credentials.
+"""
+import sys
+import os
+import time
+import inspect
+import shutil
+import tempfile
+import threading
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from isd_s3 import bucket_index
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+KEYS = ['ds/a.txt', 'ds/b/1.nc', 'ds/b/2.nc', 'ds/b/c/3.nc', 'ds/b0', 'ds/c/4.nc',
+        'ds/cé/5.nc', 'ds/d', 'other/6.nc']
+# More than one page of the index, see bucket_index.BATCH_SIZE
+MANY = ['many/{:05d}'.format(i) for i in range(2500)]
+
+server = None
+tmpdir = None
+
+def setup_module():
+    global server, tmpdir
+    server = fake_s3.FakeS3Server(buckets=(BUCKET,)).start()
+    for key in KEYS + MANY:
+        server.put(BUCKET, key, key.encode())
+    tmpdir = tempfile.mkdtemp()
+
+def teardown_module():
+    server.stop()
+    shutil.rmtree(tmpdir)
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def new_session(name):
+    return isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+            bucket_index=os.path.join(tmpdir, name + '.sqlite'))
+
+def test_directory_list():
+    session = new_session('directory_list')
+    session.refresh_index('ds/')
+    server.reset_counts()
+    for prefix in ('ds/', 'ds/b/', 'ds/c', 'ds/b/c/', 'ds/missing/'):
+        prefixes, keys = session.bucket_index.directory_list(BUCKET, prefix)
+        response = session.client.list_objects_v2(Bucket=BUCKET, Prefix=prefix, Delimiter='/')
+        assert prefixes == [p['Prefix'] for p in response.get('CommonPrefixes', [])], prefix
+        assert keys == [o['Key'] for o in response.get('Contents', [])], prefix
+        assert session.directory_list(prefix=prefix, max_age=60) \
+                == session.directory_list(prefix=prefix), prefix
+    # Only the comparisons above listed the bucket
+    assert server.reset_counts() == {'ListObjectsV2' : 10}
+    assert session.bucket_index.directory_list(BUCKET, 'ds/') \
+            == (['ds/b/', 'ds/c/', 'ds/cé/'], ['ds/a.txt', 'ds/b0', 'ds/d'])
+    passed()
+
+def test_listing_from_index():
+    session = new_session('listing')
+    assert session.refresh_index('many/', parallelism=4)['indexed'] == len(MANY)
+    server.reset_counts()
+    assert session.list_objects(prefix='many/', keys_only=True, max_age=60) == MANY
+    assert list(session.iter_keys(prefix='many/', max_age=60)) == MANY
+    assert session.list_objects(prefix='many/001', keys_only=True, max_age=60) \
+            == [k for k in MANY if k.startswith('many/001')]
+    objects = session.list_objects(prefix='many/', regex='many/0000[12]', max_age=60)
+    assert [o['Key'] for o in objects] == ['many/00001', 'many/00002']
+    assert objects[0]['Size'] == len('many/00001')
+    assert objects[0]['ETag'] == server.buckets[BUCKET]['many/00001']['ETag']
+    usage = session.disk_usage(prefix='many/', max_age=60, human_readable=True)
+    assert usage['objects'] == len(MANY)
+    assert session.disk_usage(prefix='many/', max_age=60, depth=1)['prefixes']['many/00000']['objects'] == 1
+    assert server.reset_counts() == {}
+    passed()
+
+def test_refresh():
+    session = new_session('refresh')
+    index = session.bucket_index
+    assert index.age(BUCKET, 'ds/') is None
+    # A stale or missing prefix is refreshed before answering
+    assert session.list_objects(prefix='ds/b/', keys_only=True, max_age=60) \
+            == ['ds/b/1.nc', 'ds/b/2.nc', 'ds/b/c/3.nc']
+    assert server.reset_counts() == {'ListObjectsV2' : 1}
+    assert index.age(BUCKET, 'ds/b/') < 60 and index.age(BUCKET, 'ds/') is None
+    # A refresh of a parent prefix covers narrower ones
+    session.refresh_index('ds/')
+    assert index.age(BUCKET, 'ds/b/c/') < 60
+    count = index._connect().execute('SELECT COUNT(*) FROM snapshots').fetchone()[0]
+    assert count == 1
+    server.reset_counts()
+    session.list_objects(prefix='ds/b/', max_age=60)
+    assert server.reset_counts() == {}
+    time.sleep(0.02)
+    session.list_objects(prefix='ds/b/', max_age=0.01)
+    assert server.reset_counts() == {'ListObjectsV2' : 1}
+    # Other buckets aren't affected
+    assert index.age('another', 'ds/') is None
+    passed()
+
+def test_refresh_not_blocking():
+    index = bucket_index.BucketIndex(os.path.join(tmpdir, 'blocking.sqlite'))
+    index.refresh(BUCKET, 'ds/', [{'Key' : 'ds/old', 'Size' : 1}])
+    listed = threading.Event()
+    release = threading.Event()
+
+    def listing():
+        yield {'Key' : 'ds/new', 'Size' : 2}
+        listed.set()
+        release.wait()
+
+    thread = threading.Thread(target=index.refresh, args=(BUCKET, 'ds/', listing()))
+    thread.start()
+    try:
+        assert listed.wait(10)
+        # Answered from the previous listing while the new one is staged
+        answers = []
+        reader = threading.Thread(target=lambda: answers.append(
+                (index.usage(BUCKET, 'ds/'), index.last_key(BUCKET, 'ds/'))), daemon=True)
+        reader.start()
+        reader.join(10)
+        assert answers == [((1, 1), 'ds/old')]
+    finally:
+        release.set()
+        thread.join()
+    assert [o['Key'] for page in index.iter_pages(BUCKET, 'ds/') for o in page] == ['ds/new']
+    staged = index._connect().execute('SELECT COUNT(*) FROM staged_objects').fetchone()[0]
+    assert staged == 0
+    passed()
+
+def test_refresh_failed():
+    index = bucket_index.BucketIndex(os.path.join(tmpdir, 'failed.sqlite'))
+    index.refresh(BUCKET, 'ds/', [{'Key' : 'ds/old', 'Size' : 1}])
+
+    def listing():
+        yield {'Key' : 'ds/new', 'Size' : 2}
+        raise OSError('listing failed')
+
+    try:
+        index.refresh(BUCKET, 'ds/', listing())
+        assert False
+    except OSError:
+        pass
+    assert index.usage(BUCKET, 'ds/') == (1, 1)
+    staged = index._connect().execute('SELECT COUNT(*) FROM staged_objects').fetchone()[0]
+    assert staged == 0
+    passed()
+
+def test_stale_after_put_and_delete():
+    session = new_session('stale')
+    session.refresh_index('ds/')
+    path = os.path.join(tmpdir, 'new.nc')
+    with open(path, 'wb') as fh:
+        fh.write(b'new')
+    session.upload_object(path, 'ds/b/new.nc')
+    session.delete('ds/b/1.nc')
+    # Within max_age the index answers as of its last refresh
+    keys = session.list_objects(prefix='ds/b/', keys_only=True, max_age=60)
+    assert keys == ['ds/b/1.nc', 'ds/b/2.nc', 'ds/b/c/3.nc']
+    assert session.directory_list(prefix='ds/b/', max_age=60) == ['ds/b/c/']
+    assert session.bucket_index.directory_list(BUCKET, 'ds/b/')[1] == ['ds/b/1.nc', 'ds/b/2.nc']
+    # A refresh replaces the indexed keys, dropping deleted ones
+    assert session.refresh_index('ds/b/')['indexed'] == 3
+    keys = session.list_objects(prefix='ds/b/', keys_only=True, max_age=60)
+    assert keys == ['ds/b/2.nc', 'ds/b/c/3.nc', 'ds/b/new.nc']
+    assert session.bucket_index.directory_list(BUCKET, 'ds/b/')[1] == ['ds/b/2.nc', 'ds/b/new.nc']
+    # Keys outside the refreshed prefix are kept
+    assert 'ds/a.txt' in session.list_objects(prefix='ds/', keys_only=True, max_age=60)
+
+    # Incremental refreshes only add keys sorting after the last indexed one
+    session.upload_object(path, 'ds/b/z.nc')
+    session.upload_object(path, 'ds/b/0.nc')
+    session.delete('ds/b/2.nc')
+    assert session.refresh_index('ds/b/', incremental=True)['indexed'] == 1
+    keys = session.list_objects(prefix='ds/b/', keys_only=True, max_age=60)
+    assert keys == ['ds/b/2.nc', 'ds/b/c/3.nc', 'ds/b/new.nc', 'ds/b/z.nc']
+    session.refresh_index('ds/b/')
+    keys = session.list_objects(prefix='ds/b/', keys_only=True, max_age=60)
+    assert keys == ['ds/b/0.nc', 'ds/b/c/3.nc', 'ds/b/new.nc', 'ds/b/z.nc']
+    for key in ('ds/b/0.nc', 'ds/b/new.nc', 'ds/b/z.nc'):
+        server.buckets[BUCKET].pop(key)
+    server.put(BUCKET, 'ds/b/1.nc', b'ds/b/1.nc')
+    server.put(BUCKET, 'ds/b/2.nc', b'ds/b/2.nc')
+    passed()
+
+def test_disabled():
+    session = isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+            bucket_index=False)
+    try:
+        session.refresh_index('ds/')
+        assert False
+    except isd_s3.ISD_S3_Exception:
+        pass
+    # max_age is ignored without an index
+    assert session.list_objects(prefix='ds/b/', keys_only=True, max_age=60) \
+            == ['ds/b/1.nc', 'ds/b/2.nc', 'ds/b/c/3.nc']
+    passed()
+
+def test_unavailable():
+    blocker = os.path.join(tmpdir, 'blocker')
+    open(blocker, 'w').close()
+    index = bucket_index.BucketIndex(os.path.join(blocker, 'index.sqlite'))
+    # An index that can't be opened is never fresh
+    assert not index.is_fresh(BUCKET, 'ds/', 60)
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test copies and moves against the S3 stand-in of the benchmarks.
+
+Needs no bucket or credentials. Objects above a lowered
+MAX_COPY_OBJECT_SIZE are copied in parts, as objects above 5GiB are.
+"""
+import sys
+import os
+import inspect
+import datetime
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+MAX_COPY_OBJECT_SIZE = 10 * 1000 * 1000
+
+server = None
+session = None
+saved_max_copy_object_size = None
+
+def setup_module():
+    global server, session, saved_max_copy_object_size
+    saved_max_copy_object_size = isd_s3.MAX_COPY_OBJECT_SIZE
+    isd_s3.MAX_COPY_OBJECT_SIZE = MAX_COPY_OBJECT_SIZE
+    server = fake_s3.FakeS3Server(buckets=(BUCKET,)).start()
+    session = isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+            bucket_index=False, max_attempts=1, retry_base_delay=0.01)
+
+def teardown_module():
+    server.stop()
+    isd_s3.MAX_COPY_OBJECT_SIZE = saved_max_copy_object_size
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def test_multipart_copy_keeps_etag():
+    for part_size in (isd_s3.MIN_PART_SIZE, 5500000):
+        body = os.urandom(part_size * 3 + 1000)
+        server.put(BUCKET, 'source', body, part_size=part_size)
+        server.reset_counts()
+        session.copy_object('source', 'dest')
+        assert server.reset_counts()['UploadPartCopy'] == 4
+        objects = server.buckets[BUCKET]
+        assert objects['dest']['Body'] == body
+        assert objects['dest']['ETag'] == objects['source']['ETag']
+    passed()
+
+def test_multipart_copy_retries():
+    body = os.urandom(isd_s3.MIN_PART_SIZE * 2 + 1000)
+    server.put(BUCKET, 'retry', body, part_size=isd_s3.MIN_PART_SIZE)
+    server.reset_counts()
+    server.add_fault('CreateMultipartUpload')
+    server.add_fault('UploadPartCopy', after=1)
+    session.copy_object('retry', 'retried')
+    requests = server.reset_counts()
+    assert requests['CreateMultipartUpload'] == 2 and requests['UploadPartCopy'] == 4
+    assert server.buckets[BUCKET]['retried']['Body'] == body
+    passed()
+
+def test_copy_replace_keeps_headers():
+    headers = {'ContentType' : 'application/x-netcdf', 'ContentEncoding' : 'gzip',
+            'CacheControl' : 'max-age=3600', 'ContentDisposition' : 'attachment',
+            'ContentLanguage' : 'en', 'Expires' : datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)}
+    small = b'small'
+    large = os.urandom(isd_s3.MIN_PART_SIZE * 2 + 1000)
+    for source, body in (('headers/small', small), ('headers/large', large)):
+        session.client.put_object(Bucket=BUCKET, Key=source, Body=body, **headers)
+        dest = source.replace('headers/', 'replaced/')
+        session.copy_object(source, dest, metadata={'dataset' : 'ds084.1'})
+        head = session.get_metadata(dest)
+        assert head['Metadata'] == {'dataset' : 'ds084.1'}, head['Metadata']
+        for header, value in headers.items():
+            assert head[header] == value, (source, header, head.get(header))
+    assert server.buckets[BUCKET]['replaced/large']['PartSizes'] is not None
+    passed()
+
+def test_move_prefix():
+    body = os.urandom(isd_s3.MIN_PART_SIZE * 2 + 1000)
+    server.put(BUCKET, 'old/large', body, part_size=isd_s3.MIN_PART_SIZE)
+    server.put(BUCKET, 'old/small', b'small')
+    etag = server.buckets[BUCKET]['old/large']['ETag']
+    summary = session.move_object('old/', 'new/')
+    assert summary['copied'] == 2 and summary['deleted'] == 2 and summary['failed'] == 0
+    objects = server.buckets[BUCKET]
+    assert sorted(k for k in objects if k.startswith(('old/', 'new/'))) == ['new/large', 'new/small']
+    assert objects['new/large']['ETag'] == etag and objects['new/small']['Body'] == b'small'
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
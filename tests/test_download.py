@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test downloads against the S3 stand-in of the benchmarks.
+
+Needs no bucket or credentials.
+"""
+import sys
+import os
+import inspect
+import tempfile
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+# Parts of a whole number of MB, not MiB, e.g. uploaded with -mc 5.5MB
+PART_SIZE = 5500000
+
+server = None
+session = None
+
+def setup_module():
+    global server, session
+    server = fake_s3.FakeS3Server(buckets=(BUCKET,)).start()
+    session = isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+            bucket_index=False)
+
+def teardown_module():
+    server.stop()
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def list_files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+            for root, _, names in os.walk(directory) for name in names)
+
+def test_get_objects():
+    keys = ('get/a.txt', 'get/sub/b.txt', 'get/sub/')
+    for key in keys:
+        server.put(BUCKET, key, key.encode())
+    local_dir = tempfile.mkdtemp()
+    summary = session.get_objects('get/', local_dir=local_dir)
+    assert summary['succeeded'] == 2 and summary['failed'] == 0
+    assert list_files(local_dir) == ['get/a.txt', 'get/sub/b.txt']
+    with open(os.path.join(local_dir, 'get/sub/b.txt'), 'rb') as fh:
+        assert fh.read() == b'get/sub/b.txt'
+    for key in keys:
+        server.buckets[BUCKET].pop(key)
+    passed()
+
+def test_get_objects_outside_local_dir():
+    escaping = ('../escape.txt', 'a/../../escape.txt', 'a/b/../../../escape.txt',
+            '/tmp/escape.txt', '//escape.txt', '..', 'a/..')
+    for key in escaping + ('inside.txt',):
+        server.put(BUCKET, key, b'x')
+    parent = tempfile.mkdtemp()
+    local_dir = os.path.join(parent, 'target')
+    os.mkdir(local_dir)
+    for prefix in ('', '.', '/', 'a/'):
+        summary = session.get_objects(prefix, local_dir=local_dir)
+        assert summary['failed'] == 0
+        assert set(r['key'] for r in summary['results']).isdisjoint(escaping)
+    # Nothing was written next to or above local_dir
+    assert list_files(parent) == ['target/inside.txt']
+    assert not os.path.exists('/tmp/escape.txt')
+    for key in escaping + ('inside.txt',):
+        server.buckets[BUCKET].pop(key)
+    passed()
+
+def test_ranged_download_part_size():
+    body = os.urandom(PART_SIZE * 2 + 1000)
+    server.put(BUCKET, 'parts', body, part_size=PART_SIZE)
+    local_file = os.path.join(tempfile.mkdtemp(), 'parts')
+    session.ranged_download('parts', local_file)
+    with open(local_file, 'rb') as fh:
+        assert fh.read() == body
+    passed()
+
+def test_ranged_download_unknown_part_size():
+    body = os.urandom(PART_SIZE * 2 + 1000)
+    server.put(BUCKET, 'unknown', body, part_size=PART_SIZE)
+    server.add_fault('HeadObject', status=403, code='AccessDenied')
+    local_file = os.path.join(tempfile.mkdtemp(), 'unknown')
+    # The ETag can't be checked, but the size can
+    session.ranged_download('unknown', local_file, size=len(body),
+            etag=server.buckets[BUCKET]['unknown']['ETag'])
+    with open(local_file, 'rb') as fh:
+        assert fh.read() == body
+    passed()
+
+def test_ranged_download_bad_etag():
+    body = os.urandom(PART_SIZE * 2 + 1000)
+    server.put(BUCKET, 'bad', body, part_size=PART_SIZE)
+    server.buckets[BUCKET]['bad']['ETag'] = '"{}-3"'.format('0' * 32)
+    local_file = os.path.join(tempfile.mkdtemp(), 'bad')
+    try:
+        session.ranged_download('bad', local_file)
+        assert False
+    except isd_s3.ISD_S3_Exception:
+        pass
+    assert not os.path.exists(local_file)
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test the ETag cache.
+
+Needs no bucket or credentials.
+"""
+import sys
+import os
+import time
+import inspect
+import shutil
+import tempfile
+import threading
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from isd_s3 import etag_cache
+
+# Old enough to be cached, see etag_cache.MIN_AGE_SECONDS
+OLD = time.time() - 3600
+
+tmpdir = None
+
+def setup_module():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown_module():
+    shutil.rmtree(tmpdir)
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def write(name, data, mtime=OLD):
+    path = os.path.join(tmpdir, name)
+    with open(path, 'wb') as fh:
+        fh.write(data)
+    os.utime(path, (mtime, mtime))
+    return path
+
+class Counter(object):
+    """Hash function counting its calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def etag(self, local_file, chunk_size):
+        with self._lock:
+            self.calls += 1
+        return isd_s3.calculate_s3_etag(local_file, chunk_size)
+
+    def md5(self, local_file):
+        with self._lock:
+            self.calls += 1
+        return isd_s3.get_md5sum(local_file)
+
+def test_etag_cache_hit():
+    cache = etag_cache.ETagCache(os.path.join(tmpdir, 'hit.sqlite'))
+    path = write('hit', b'data')
+    counter = Counter()
+    etag = cache.get_etag(path, 1024, counter.etag)
+    assert cache.get_etag(path, 1024, counter.etag) == etag and counter.calls == 1
+    # Another part size is another entry
+    cache.get_etag(path, 2, counter.etag)
+    assert counter.calls == 2
+    md5 = cache.get_md5(path, counter.md5)
+    assert cache.get_md5(path, counter.md5) == md5 and counter.calls == 3
+    # A new connection to the same file sees the entries
+    assert etag_cache.ETagCache(cache.path).get(path, 1024)['etag'] == etag
+    passed()
+
+def test_etag_cache_invalidation():
+    cache = etag_cache.ETagCache(os.path.join(tmpdir, 'invalidation.sqlite'))
+    path = write('changed', b'aaaa')
+    counter = Counter()
+    cache.get_etag(path, 1024, counter.etag)
+    # Same size and content, new mtime
+    os.utime(path, (OLD + 1, OLD + 1))
+    assert cache.get(path, 1024) is None
+    assert cache.get_etag(path, 1024, counter.etag) == isd_s3.calculate_s3_etag(path, 1024)
+    assert counter.calls == 2
+    # New size, same mtime
+    write('changed', b'aaaaa', mtime=OLD + 1)
+    assert cache.get(path, 1024) is None
+    assert cache.get_etag(path, 1024, counter.etag) == isd_s3.calculate_s3_etag(path, 1024)
+    # Same size and mtime, new file
+    os.remove(path)
+    write('changed', b'bbbbb', mtime=OLD + 1)
+    assert cache.get_md5(path, counter.md5) == isd_s3.get_md5sum(path)
+    passed()
+
+def test_etag_cache_recent_files():
+    cache = etag_cache.ETagCache(os.path.join(tmpdir, 'recent.sqlite'))
+    path = write('recent', b'data', mtime=time.time())
+    counter = Counter()
+    cache.get_etag(path, 1024, counter.etag)
+    cache.get_etag(path, 1024, counter.etag)
+    # Files being written to aren't cached
+    assert counter.calls == 2 and cache.get(path, 1024) is None
+    passed()
+
+def test_etag_cache_eviction():
+    interval, resolution = etag_cache.EVICTION_INTERVAL, etag_cache.LAST_USED_RESOLUTION
+    etag_cache.EVICTION_INTERVAL, etag_cache.LAST_USED_RESOLUTION = 5, 0
+    try:
+        cache = etag_cache.ETagCache(os.path.join(tmpdir, 'eviction.sqlite'), max_entries=10)
+        path = write('evicted', b'data')
+        stat = os.stat(path)
+        for chunk_size in range(1, 21):
+            cache.put(path, chunk_size, stat, etag=str(chunk_size))
+            if chunk_size == 12:
+                # Used recently, so kept
+                time.sleep(0.01)
+                assert cache.get(path, 1)['etag'] == '1'
+        count = cache._connect().execute('SELECT COUNT(*) FROM etags').fetchone()[0]
+        assert count <= 10
+        assert cache.get(path, 1)['etag'] == '1'
+        assert cache.get(path, 2) is None
+        assert cache.get(path, 20)['etag'] == '20'
+    finally:
+        etag_cache.EVICTION_INTERVAL, etag_cache.LAST_USED_RESOLUTION = interval, resolution
+    passed()
+
+def test_etag_cache_concurrent():
+    paths = [write('concurrent{}'.format(i), os.urandom(1000)) for i in range(20)]
+    path = os.path.join(tmpdir, 'concurrent.sqlite')
+    # Two caches on one file, like two processes
+    caches = [etag_cache.ETagCache(path), etag_cache.ETagCache(path)]
+    counter = Counter()
+    errors = []
+
+    def run(cache):
+        try:
+            for _ in range(3):
+                for p in paths:
+                    assert cache.get_etag(p, 100, counter.etag) == isd_s3.calculate_s3_etag(p, 100)
+                    assert cache.get_md5(p, counter.md5) == isd_s3.get_md5sum(p)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(caches[i % 2],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # Each hash is computed at most once per thread, and reused after
+    assert counter.calls <= 8 * 2 * len(paths)
+    calls = counter.calls
+    run(etag_cache.ETagCache(path))
+    assert errors == [] and counter.calls == calls
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Test narrowing regexes and globs to key prefixes.
+
+Needs no bucket or credentials.
+"""
+import sys
+import os
+import re
+import inspect
+import itertools
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import key_patterns
+from isd_s3.key_patterns import regex_prefixes, glob_to_regex
+
+# Keys for checking that no matching key falls outside the prefixes
+KEYS = [''.join(chars) for n in range(1, 5) for chars in itertools.product('ab/.-1', repeat=n)]
+KEYS += ['ds084.1/2018-01/x.nc', 'ds084.1/2019-12/y.nc', 'ds084.1/2019-12/sub/z.nc',
+        'ds084.1/readme', 'ds084.10/2019-01/x.nc', 'ds084.2/2019-01/x.nc', 'DS084.1/x.nc',
+        'ds0841/x.nc', 'ds084.1/2019-1/x.grb', 'ds084.1\n/x']
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def check_complete(regex, prefix=''):
+    """Asserts that every key matching regex and prefix starts with a prefix of regex_prefixes."""
+    prefixes = regex_prefixes(regex, prefix)
+    for key in KEYS:
+        if key.startswith(prefix) and re.match(regex, key):
+            assert any(key.startswith(p) for p in prefixes), (regex, prefix, key, prefixes)
+    return prefixes
+
+def test_literal():
+    assert check_complete('ds084\\.1/') == ['ds084.1/']
+    assert check_complete('ds084.1/') == ['ds084']
+    assert check_complete('ds084\\.1/2019') == ['ds084.1/2019']
+    assert check_complete('') == ['']
+    passed()
+
+def test_alternation():
+    assert check_complete('ds084\\.(1|2)/') == ['ds084.1/', 'ds084.2/']
+    assert check_complete('ds084\\.(1|10)/') == ['ds084.1/', 'ds084.10/']
+    assert check_complete('(ds084\\.1|ds084\\.2)/2019') == ['ds084.1/2019', 'ds084.2/2019']
+    assert check_complete('a|b') == ['a', 'b']
+    # An empty alternative matches the shorter prefix
+    assert check_complete('ds084\\.1(0|)/') == ['ds084.1/', 'ds084.10/']
+    # Alternatives that aren't literal stop the expansion after them
+    assert check_complete('ds084\\.(1.*|2)/x') == ['ds084.1', 'ds084.2']
+    # Prefixes that start with another are dropped
+    assert check_complete('(a|ab)c') == ['abc', 'ac']
+    assert check_complete('(a|a.)c') == ['a']
+    passed()
+
+def test_character_classes():
+    assert check_complete('ds084\\.1/201[89]-') == ['ds084.1/2018-', 'ds084.1/2019-']
+    assert check_complete('x[a-c]') == ['xa', 'xb', 'xc']
+    assert check_complete('x[a-c]y') == ['xay', 'xby', 'xcy']
+    # Negated, category and wide classes aren't expanded
+    assert check_complete('x[^a]y') == ['x']
+    assert check_complete('x\\dy') == ['x']
+    assert check_complete('x[\\d]y') == ['x']
+    assert check_complete('x[\\x00-\\xff]y') == ['x']
+    assert check_complete('x[a-z][a-z]') == ['x' + c for c in 'abcdefghijklmnopqrstuvwxyz']
+    passed()
+
+def test_anchors():
+    assert check_complete('^ds084\\.1/') == ['ds084.1/']
+    assert check_complete('\\Ads084\\.1/') == ['ds084.1/']
+    assert check_complete('ds084\\.1$') == ['ds084.1']
+    assert check_complete('ds084\\.1\\Z') == ['ds084.1']
+    # An anchor after the start only matches the empty prefix up to it
+    assert check_complete('ds^084') == ['ds']
+    assert check_complete('ds\\b084') == ['ds']
+    passed()
+
+def test_repeats():
+    assert check_complete('ds0+84') == ['ds0']
+    assert check_complete('ds0*84') == ['ds']
+    assert check_complete('ds0?84') == ['ds']
+    assert check_complete('ds(08)+4') == ['ds08']
+    assert check_complete('ds0{2}') == ['ds0']
+    assert check_complete('ds0{0,2}') == ['ds']
+    assert check_complete('ds0+?84') == ['ds0']
+    passed()
+
+def test_not_narrowed():
+    for regex in ('.*\\.nc', '(?i)ds084', 'ds(?i:084)', '(?=ds)ds084', '(d)s\\1', '[^/]*/x',
+            '.', '\\w+', '(?!a)b'):
+        prefixes = check_complete(regex)
+        assert all(not p.startswith('ds084') for p in prefixes), (regex, prefixes)
+    assert regex_prefixes('(?i)ds084') == ['']
+    # Invalid regexes are left to fail where they are compiled
+    assert regex_prefixes('*invalid', 'ds') == ['ds']
+    assert regex_prefixes('ds(084') == ['']
+    passed()
+
+def test_with_prefix():
+    assert check_complete('ds084\\.1/2019', 'ds084.1/') == ['ds084.1/2019']
+    assert check_complete('ds084', 'ds084.1/') == ['ds084.1/']
+    assert check_complete('ds084\\.(1|2)/', 'ds084.1') == ['ds084.1/']
+    assert check_complete('ds084\\.1/', 'ds084.2/') == []
+    assert check_complete('.*', 'ds084.2/') == ['ds084.2/']
+    passed()
+
+def test_max_prefixes():
+    assert check_complete('[ab][ab][ab]') == ['aaa', 'aab', 'aba', 'abb', 'baa', 'bab', 'bba', 'bbb']
+    assert regex_prefixes('[ab][ab][ab]', max_prefixes=4) == ['aa', 'ab', 'ba', 'bb']
+    assert regex_prefixes('[abc]', max_prefixes=2) == ['']
+    assert len(regex_prefixes('[a-h][a-h][a-h]')) <= key_patterns.MAX_PATTERN_PREFIXES
+    passed()
+
+def test_glob_to_regex():
+    regex = glob_to_regex('ds084.1/2019-*/*.nc')
+    assert re.match(regex, 'ds084.1/2019-12/y.nc')
+    assert not re.match(regex, 'ds084.1/2019-12/sub/z.nc')
+    assert not re.match(regex, 'ds084x1/2019-12/y.nc')
+    assert not re.match(regex, 'ds084.1/2019-12/y.nc4')
+    assert re.match(glob_to_regex('ds084.1/**.nc'), 'ds084.1/2019-12/sub/z.nc')
+    assert re.match(glob_to_regex('a?c'), 'abc') and not re.match(glob_to_regex('a?c'), 'a/c')
+    assert re.match(glob_to_regex('a[!b]c'), 'axc') and not re.match(glob_to_regex('a[!b]c'), 'abc')
+    assert re.match(glob_to_regex('a[]]c'), 'a]c')
+    assert re.match(glob_to_regex('a[b'), 'a[b')
+    assert re.match(glob_to_regex('a+(b)^$'), 'a+(b)^$')
+    passed()
+
+def test_glob_prefixes():
+    assert regex_prefixes(glob_to_regex('ds084.1/201[89]-*/*.nc')) == ['ds084.1/2018-', 'ds084.1/2019-']
+    assert regex_prefixes(glob_to_regex('ds084.1/*')) == ['ds084.1/']
+    assert regex_prefixes(glob_to_regex('ds084.?/x')) == ['ds084.']
+    assert regex_prefixes(glob_to_regex('ds084.[!1]/x')) == ['ds084.']
+    assert regex_prefixes(glob_to_regex('**/x.nc')) == ['']
+    for glob in ('ds084.1/201[89]-*/*.nc', 'ds084.?/*', 'ds084.[12]/**', '*/x.nc', 'ds084.1*'):
+        check_complete(glob_to_regex(glob))
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+    self = sys.modules[__name__]
+    for func_str in funcs:
+        func = getattr(self, func_str)
+        func()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test listings against the S3 stand-in of the benchmarks.
+
+Needs no bucket or credentials.
+"""
+import sys
+import os
+import inspect
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+
+# Nested keys, with names sorting just before and after the delimiter
+NESTED_KEYS = ['nested/{}/{}/{:03d}.nc'.format(a, b, i)
+        for a in ('ds084.1', 'ds084.1-old', 'ds084.10', 'ds084.2')
+        for b in ('2019', '2019-01', '2020')
+        for i in range(40)]
+NESTED_KEYS += ['nested/ds084.1', 'nested/ds084.1.tar', 'nested/readme']
+# More keys than a page, without any delimiter
+FLAT_KEYS = ['flat/{:05d}'.format(i) for i in range(2500)]
+
+server = None
+session = None
+
+def setup_module():
+    global server, session
+    server = fake_s3.FakeS3Server(buckets=(BUCKET,)).start()
+    session = isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+            bucket_index=False)
+    for key in NESTED_KEYS + FLAT_KEYS:
+        server.put(BUCKET, key, key.encode())
+
+def teardown_module():
+    server.stop()
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def test_iter_objects():
+    ret = list(session.iter_keys(BUCKET, 'nested/readme', limit=1))
+    assert ret == ['nested/readme']
+    ret = list(session.iter_objects(BUCKET, 'nested/readme', parallelism=2))
+    assert len(ret) == 1 and ret[0]['Size'] == len('nested/readme')
+    assert list(session.iter_keys(BUCKET, 'flat/', limit=1001)) == FLAT_KEYS[:1001]
+    ret = list(session.iter_keys(BUCKET, 'nested/', glob='nested/ds084.1/2019/00?.nc'))
+    assert ret == ['nested/ds084.1/2019/{:03d}.nc'.format(i) for i in range(10)]
+    passed()
+
+def test_parallel_listing():
+    for prefix, keys in (('nested/', NESTED_KEYS), ('flat/', FLAT_KEYS), ('', NESTED_KEYS + FLAT_KEYS)):
+        flat = list(session.iter_keys(BUCKET, prefix))
+        assert flat == sorted(keys)
+        for parallelism in (2, 4, 16):
+            ret = list(session.iter_keys(BUCKET, prefix, parallelism=parallelism))
+            assert ret == flat, (prefix, parallelism)
+            ret = session.list_objects(BUCKET, prefix, parallelism=parallelism)
+            assert [x['Key'] for x in ret] == flat, (prefix, parallelism)
+    passed()
+
+def test_parallel_listing_limit():
+    ret = list(session.iter_keys(BUCKET, 'nested/', limit=50, parallelism=4))
+    assert ret == sorted(NESTED_KEYS)[:50]
+    passed()
+
+def test_parallel_disk_usage():
+    total = sum(len(key) for key in NESTED_KEYS)
+    for parallelism in (1, 4):
+        ret = session.disk_usage(BUCKET, 'nested/', block_size='1KB', parallelism=parallelism)
+        assert ret['objects'] == len(NESTED_KEYS) and ret['disk_usage'] == total / 1000
+    passed()
+
+def test_search_metadata():
+    server.put(BUCKET, 'meta/a', b'a', metadata={'dataset' : 'ds084.1'})
+    server.put(BUCKET, 'meta/b', b'b', metadata={'dataset' : 'ds084.2'})
+    server.put(BUCKET, 'meta/c', b'c')
+    try:
+        ret = session.search_metadata(BUCKET, metadata_key='Dataset', prefix='meta/')
+        assert ret == ['meta/a', 'meta/b']
+        ret = session.search_metadata(BUCKET, metadata_key='dataset', metadata_value='ds084.2',
+                prefix='meta/')
+        assert ret == ['meta/b']
+        # Without a metadata key nothing matches
+        assert session.search_metadata(BUCKET, prefix='meta/') == []
+    finally:
+        for key in ('meta/a', 'meta/b', 'meta/c'):
+            server.buckets[BUCKET].pop(key)
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
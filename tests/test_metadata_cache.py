@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Test the metadata cache.
+
+Needs no bucket or credentials. The metadata cache of a Session is tested
+against the S3 stand-in of the benchmarks.
+"""
+import sys
+import os
+import time
+import inspect
+import shutil
+import tempfile
+import threading
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from isd_s3 import metadata_cache
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+
+tmpdir = None
+
+def setup_module():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown_module():
+    shutil.rmtree(tmpdir)
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def test_metadata_cache_coalescing():
+    cache = metadata_cache.MetadataCache(10)
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait()
+        return {'ETag' : '"a"'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('b', 'k', load)))
+            for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while cache.stats()['coalesced'] < 7:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and results == [{'ETag' : '"a"'}] * 8
+    stats = cache.stats()
+    assert stats['misses'] == 1 and stats['coalesced'] == 7
+    assert cache.get('b', 'k', load) == {'ETag' : '"a"'} and len(calls) == 1
+    passed()
+
+def test_metadata_cache_errors():
+    cache = metadata_cache.MetadataCache(10)
+    release = threading.Event()
+    errors = []
+
+    def load():
+        release.wait()
+        raise KeyError('k')
+
+    def get():
+        try:
+            cache.get('b', 'k', load)
+        except KeyError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=get) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while cache.stats()['coalesced'] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    # Every waiting thread sees the error, and nothing is cached
+    assert len(errors) == 4 and cache.stats()['size'] == 0
+    passed()
+
+def test_metadata_cache_invalidation():
+    cache = metadata_cache.MetadataCache(10)
+    cache.get('b', 'k', lambda: {'ETag' : '"old"'})
+    cache.invalidate('b', 'k')
+    assert cache.get('b', 'k', lambda: {'ETag' : '"new"'}) == {'ETag' : '"new"'}
+
+    # A write during a lookup may not be seen by it, so its result isn't kept
+    started = threading.Event()
+    release = threading.Event()
+
+    def load():
+        started.set()
+        release.wait()
+        return {'ETag' : '"stale"'}
+
+    cache.invalidate('b', 'k')
+    thread = threading.Thread(target=cache.get, args=('b', 'k', load))
+    thread.start()
+    started.wait()
+    cache.invalidate('b', 'k')
+    release.set()
+    thread.join()
+    assert cache.get('b', 'k', lambda: {'ETag' : '"fresh"'}) == {'ETag' : '"fresh"'}
+    passed()
+
+def test_metadata_cache_expiry_and_eviction():
+    cache = metadata_cache.MetadataCache(2, ttl=0.05)
+    for key in ('a', 'b'):
+        cache.get('b', key, lambda: {'Key' : key})
+    cache.get('b', 'a', lambda: None)
+    cache.get('b', 'c', lambda: {'Key' : 'c'})
+    # 'b' was used least recently
+    stats = cache.stats()
+    assert stats['evicted'] == 1 and stats['size'] == 2
+    assert cache.get('b', 'a', lambda: None) == {'Key' : 'a'}
+    assert cache.get('b', 'b', lambda: {'Key' : 'reloaded'}) == {'Key' : 'reloaded'}
+    time.sleep(0.06)
+    assert cache.get('b', 'a', lambda: {'Key' : 'expired'}) == {'Key' : 'expired'}
+    assert cache.stats()['expired'] == 1
+    # Callers get copies
+    cache.get('b', 'a', lambda: None)['Key'] = 'changed'
+    assert cache.get('b', 'a', lambda: None) == {'Key' : 'expired'}
+    passed()
+
+def test_metadata_cache_session():
+    server = fake_s3.FakeS3Server(buckets=(BUCKET,)).start()
+    try:
+        session = isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+                bucket_index=False, metadata_cache_size=10)
+        server.put(BUCKET, 'cached', b'old')
+        assert session.get_metadata('cached')['ContentLength'] == 3
+        assert session.get_metadata('cached')['ContentLength'] == 3
+        assert server.reset_counts() == {'HeadObject' : 1}
+        # Writes through the Session drop the cached metadata
+        path = os.path.join(tmpdir, 'new')
+        with open(path, 'wb') as fh:
+            fh.write(b'new content')
+        session.upload_object(path, 'cached')
+        assert session.get_metadata('cached')['ContentLength'] == 11
+        session.copy_object('cached', 'copied')
+        session.replace_metadata('cached', metadata={'a' : 'b'})
+        assert session.get_metadata('cached')['Metadata'] == {'a' : 'b'}
+        session.delete('cached')
+        try:
+            session.get_metadata('cached')
+            assert False
+        except Exception:
+            pass
+    finally:
+        server.stop()
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
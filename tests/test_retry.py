@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Test retries against the S3 stand-in of the benchmarks, with injected faults.
+
+Needs no bucket or credentials. botocore's own retries are turned off, so
+every retry seen is one of isd_s3.
+"""
+import sys
+import os
+import inspect
+import shutil
+import tempfile
+import botocore.exceptions
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+PART_SIZE = isd_s3.MIN_PART_SIZE
+
+server = None
+tmpdir = None
+
+def setup_module():
+    global server, tmpdir
+    server = fake_s3.FakeS3Server(buckets=(BUCKET,)).start()
+    tmpdir = tempfile.mkdtemp()
+
+def teardown_module():
+    server.stop()
+    shutil.rmtree(tmpdir)
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def new_session(**kwargs):
+    server.faults = []
+    server.reset_counts()
+    return isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+            bucket_index=False, max_attempts=1, retry_base_delay=0.01, **kwargs)
+
+def test_listing_page():
+    for i in range(2500):
+        server.put(BUCKET, 'list/{:04d}'.format(i), b'x')
+    session = new_session()
+    server.add_fault('ListObjectsV2', after=1)
+    assert len(list(session.iter_keys(BUCKET, 'list/'))) == 2500
+    # The failed second page is requested again, not the whole listing
+    assert server.requests['ListObjectsV2'] == 4
+    passed()
+
+def test_multipart_part():
+    local_file = os.path.join(tmpdir, 'upload')
+    with open(local_file, 'wb') as fh:
+        fh.write(os.urandom(PART_SIZE * 2 + 1000))
+    session = new_session(multipart_chunksize=PART_SIZE)
+    server.add_fault('UploadPart', kind='bad_etag', after=1)
+    server.add_fault('UploadPart', status=500, code='InternalError')
+    session.upload_object(local_file, 'upload')
+    assert server.requests['CreateMultipartUpload'] == 1
+    assert server.requests['UploadPart'] == 5
+    assert session.verify_object(local_file, 'upload')['match']
+    passed()
+
+def test_multipart_create_complete():
+    local_file = os.path.join(tmpdir, 'upload')
+    with open(local_file, 'wb') as fh:
+        fh.write(os.urandom(PART_SIZE * 2 + 1000))
+    session = new_session(multipart_chunksize=PART_SIZE)
+    server.add_fault('CreateMultipartUpload')
+    server.add_fault('CompleteMultipartUpload')
+    session.upload_object(local_file, 'upload')
+    assert server.requests['CreateMultipartUpload'] == 2
+    assert server.requests['CompleteMultipartUpload'] == 2
+    assert session.verify_object(local_file, 'upload')['match']
+    passed()
+
+def test_multipart_abort():
+    local_file = os.path.join(tmpdir, 'upload')
+    with open(local_file, 'wb') as fh:
+        fh.write(os.urandom(PART_SIZE * 2 + 1000))
+    session = new_session(multipart_chunksize=PART_SIZE, retry_attempts=2)
+    server.add_fault('CompleteMultipartUpload', times=2)
+    try:
+        session.upload_object(local_file, 'aborted')
+        assert False
+    except botocore.exceptions.ClientError:
+        pass
+    assert server.requests['AbortMultipartUpload'] == 1
+    assert len(server.uploads) == 0 and 'aborted' not in server.buckets[BUCKET]
+    passed()
+
+def test_ranged_download():
+    body = os.urandom(PART_SIZE * 2 + 1000)
+    server.put(BUCKET, 'download', body)
+    session = new_session(multipart_chunksize=PART_SIZE)
+    server.add_fault('GetObject', kind='truncate', after=1)
+    local_file = os.path.join(tmpdir, 'download')
+    session.ranged_download('download', local_file)
+    assert server.requests['GetObject'] == 4
+    with open(local_file, 'rb') as fh:
+        assert fh.read() == body
+    passed()
+
+def test_delete_keys():
+    for i in range(10):
+        server.put(BUCKET, 'delete/{}'.format(i), b'x')
+    session = new_session()
+    server.add_fault('DeleteObjects', kind='key_errors')
+    result = session.delete(['delete/{}'.format(i) for i in range(10)])
+    assert result == {'deleted' : 10, 'errors' : []}
+    assert server.requests['DeleteObjects'] == 2
+    passed()
+
+def test_delete_keys_not_retryable():
+    server.put(BUCKET, 'denied', b'x')
+    session = new_session()
+    server.add_fault('DeleteObjects', kind='key_errors', code='AccessDenied')
+    result = session.delete('denied')
+    assert result['deleted'] == 0 and result['errors'][0]['Code'] == 'AccessDenied'
+    assert server.requests['DeleteObjects'] == 1
+    passed()
+
+def test_delete_nothing():
+    session = new_session()
+    assert session.delete([]) == {'deleted' : 0, 'errors' : []}
+    assert session.delete([], dry_run=True) == {'deleted' : 0, 'errors' : []}
+    assert session.delete_mult(prefix='nothing/') == {'deleted' : 0, 'errors' : []}
+    assert server.requests.get('DeleteObjects', 0) == 0
+    passed()
+
+def test_attempts():
+    server.put(BUCKET, 'head', b'x')
+    session = new_session(retry_attempts=3)
+    server.add_fault('HeadObject', times=10)
+    try:
+        session.get_metadata('head')
+        assert False
+    except botocore.exceptions.ClientError:
+        pass
+    assert server.requests['HeadObject'] == 3
+    passed()
+
+def test_budget():
+    body = os.urandom(PART_SIZE * 4)
+    server.put(BUCKET, 'budget', body)
+    session = new_session(multipart_chunksize=PART_SIZE, retry_attempts=10, retry_budget=2)
+    server.add_fault('GetObject', times=100)
+    try:
+        session.ranged_download('budget', os.path.join(tmpdir, 'budget'), concurrency=1)
+        assert False
+    except botocore.exceptions.ClientError:
+        pass
+    # The first range fails, and is retried until the budget is used up
+    assert server.requests['GetObject'] == 3
+    passed()
+
+def test_not_retryable():
+    session = new_session()
+    try:
+        session.get_metadata('missing')
+        assert False
+    except botocore.exceptions.ClientError:
+        pass
+    assert server.requests['HeadObject'] == 1
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Test command line startup time.
+
+Needs no bucket or credentials. The budget is the time `isd_s3 -h` takes
+beyond starting the interpreter, in seconds, and can be changed with
+ISD_S3_STARTUP_BUDGET, e.g. on slow machines.
+"""
+import sys
+import os
+import time
+import inspect
+import subprocess
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+STARTUP_BUDGET = float(os.environ.get('ISD_S3_STARTUP_BUDGET', 0.15))
+RUNS = 5
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def run_python(*args):
+    """Returns the fastest of RUNS runs of python with args, in seconds."""
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + list(args), cwd=PACKAGE_DIR, check=True,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def test_parser_imports():
+    code = ('import sys; from isd_s3 import __main__ as main; '
+            'main._get_parser().parse_args(["-np", "gm", "-k", "test.txt"]); '
+            'print(sorted(m for m in ("boto3", "botocore", "isd_s3.isd_s3") if m in sys.modules))')
+    out = subprocess.run([sys.executable, '-c', code], cwd=PACKAGE_DIR, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert out.strip() == '[]', out
+    passed()
+
+def test_startup_budget():
+    baseline = run_python('-c', 'pass')
+    startup = run_python('-m', 'isd_s3', '-h') - baseline
+    print('isd_s3 -h: {:.3f}s over interpreter startup, budget {:.3f}s'.format(startup, STARTUP_BUDGET))
+    assert startup < STARTUP_BUDGET
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+    self = sys.modules[__name__]
+    for func_str in funcs:
+        func = getattr(self, func_str)
+        func()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Test sync against the S3 stand-in of the benchmarks.
+
+Needs no bucket or credentials.
+"""
+import sys
+import os
+import inspect
+import tempfile
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))+'/..'
+sys.path.insert(0, PACKAGE_DIR)
+from isd_s3 import isd_s3
+from benchmarks import fake_s3
+
+# The stand-in doesn't check signatures
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+BUCKET = 'test'
+PART_SIZE = isd_s3.MIN_PART_SIZE
+
+server = None
+session = None
+
+def setup_module():
+    global server, session
+    server = fake_s3.FakeS3Server(buckets=(BUCKET,)).start()
+    session = isd_s3.Session(endpoint_url=server.url, default_bucket=BUCKET, etag_cache=False,
+            bucket_index=False, multipart_chunksize=PART_SIZE)
+
+def teardown_module():
+    server.stop()
+
+def passed():
+    curframe = inspect.currentframe()
+    calframe = inspect.getouterframes(curframe, 2)
+    print('Passed ', calframe[1][3])
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+        fh.write(data)
+
+def make_dir(files):
+    """Returns a new directory holding files, a dict of name to content."""
+    local_dir = tempfile.mkdtemp()
+    for name, data in files.items():
+        write(os.path.join(local_dir, name), data)
+    return local_dir
+
+def sync(local_dir, prefix, **kwargs):
+    server.reset_counts()
+    summary = session.sync(local_dir, key_prefix=prefix, recursive=True, **kwargs)
+    summary['requests'] = server.reset_counts()
+    return summary
+
+def remote_keys(prefix):
+    return sorted(k for k in server.buckets[BUCKET] if k.startswith(prefix))
+
+def test_sync_skips_unchanged():
+    local_dir = make_dir({'a.txt' : b'a', 'sub/b.txt' : b'b' * 100,
+            'big.bin' : os.urandom(PART_SIZE * 2 + 1000)})
+    prefix = 'unchanged/'
+    summary = sync(local_dir, prefix)
+    assert summary['succeeded'] == 3 and summary['skipped'] == 0
+    assert remote_keys(prefix) == [prefix + n for n in ('a.txt', 'big.bin', 'sub/b.txt')]
+    summary = sync(local_dir, prefix)
+    assert summary['succeeded'] == 0 and summary['skipped'] == 3
+    assert 'PutObject' not in summary['requests'] and 'UploadPart' not in summary['requests']
+    passed()
+
+def test_sync_single_part_object():
+    # Larger than a part, but uploaded in one request, e.g. by another tool
+    data = os.urandom(PART_SIZE + 2 * 1024 * 1024)
+    local_dir = make_dir({'single.bin' : data})
+    prefix = 'single/'
+    server.put(BUCKET, prefix + 'single.bin', data)
+    summary = sync(local_dir, prefix)
+    assert summary['succeeded'] == 0 and summary['skipped'] == 1
+    assert session.verify_object(os.path.join(local_dir, 'single.bin'),
+            prefix + 'single.bin')['match']
+    passed()
+
+def test_sync_uploads_changed():
+    local_dir = make_dir({'same.txt' : b'same', 'size.txt' : b'short', 'content.txt' : b'aaaa'})
+    prefix = 'changed/'
+    sync(local_dir, prefix)
+    write(os.path.join(local_dir, 'size.txt'), b'longer')
+    # Same size, different content
+    write(os.path.join(local_dir, 'content.txt'), b'bbbb')
+    write(os.path.join(local_dir, 'new.txt'), b'new')
+    summary = sync(local_dir, prefix)
+    assert summary['succeeded'] == 3 and summary['skipped'] == 1
+    uploaded = sorted(os.path.basename(r['local_file']) for r in summary['results'])
+    assert uploaded == ['content.txt', 'new.txt', 'size.txt']
+    objects = server.buckets[BUCKET]
+    assert objects[prefix + 'content.txt']['Body'] == b'bbbb'
+    assert objects[prefix + 'size.txt']['Body'] == b'longer'
+    passed()
+
+def test_sync_delete():
+    local_dir = make_dir({'keep.txt' : b'keep', 'remove.txt' : b'remove', 'sub/remove.txt' : b'x'})
+    prefix = 'delete/'
+    sync(local_dir, prefix)
+    # Not below the synced directory, so kept
+    server.put(BUCKET, 'delete-other', b'other')
+    os.remove(os.path.join(local_dir, 'remove.txt'))
+    os.remove(os.path.join(local_dir, 'sub/remove.txt'))
+
+    summary = sync(local_dir, prefix, delete=True, dry_run=True)
+    assert summary['would_delete'] == 2 and 'deleted' not in summary
+    assert remote_keys(prefix) == [prefix + 'keep.txt', prefix + 'remove.txt', prefix + 'sub/remove.txt']
+    summary = sync(local_dir, prefix)
+    assert 'deleted' not in summary
+    assert remote_keys(prefix) == [prefix + 'keep.txt', prefix + 'remove.txt', prefix + 'sub/remove.txt']
+    summary = sync(local_dir, prefix, delete=True)
+    assert summary['deleted'] == 2 and summary['skipped'] == 1
+    assert remote_keys(prefix) == [prefix + 'keep.txt']
+    assert 'delete-other' in server.buckets[BUCKET]
+    passed()
+
+def test_sync_delete_ignore():
+    local_dir = make_dir({'keep.txt' : b'keep', 'remove.txt' : b'remove'})
+    prefix = 'ignore/'
+    sync(local_dir, prefix)
+    # Uploaded before it was ignored, or by someone else
+    server.put(BUCKET, prefix + 'scratch.tmp', b'tmp')
+    server.put(BUCKET, prefix + 'sub/scratch.tmp', b'tmp')
+    os.remove(os.path.join(local_dir, 'remove.txt'))
+
+    summary = sync(local_dir, prefix, delete=True, ignore=['.tmp'])
+    assert summary['deleted'] == 1
+    assert remote_keys(prefix) == [prefix + 'keep.txt', prefix + 'scratch.tmp', prefix + 'sub/scratch.tmp']
+    passed()
+
+if __name__ == '__main__':
+    # Run functions that start with 'test'
+    setup_module()
+    try:
+        funcs = list(filter(lambda x: x[:4] == 'test', dir()))
+        self = sys.modules[__name__]
+        for func_str in funcs:
+            func = getattr(self, func_str)
+            func()
+    finally:
+        teardown_module()